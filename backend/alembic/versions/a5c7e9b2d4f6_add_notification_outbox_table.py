@@ -0,0 +1,54 @@
+"""add_notification_outbox_table
+
+Revision ID: a5c7e9b2d4f6
+Revises: f3b8d1e5a7c2
+Create Date: 2025-09-05 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a5c7e9b2d4f6'
+down_revision = 'f3b8d1e5a7c2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('notification_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.Enum('PENDING', 'PROCESSING', 'SENT', 'SKIPPED', 'DEAD', name='outboxstatus'), nullable=False),
+    sa.Column('priority', sa.Integer(), nullable=False),
+    sa.Column('type', sa.String(), nullable=False),
+    sa.Column('recipient_user_id', sa.Integer(), nullable=False),
+    sa.Column('pair_id', sa.Integer(), nullable=True),
+    sa.Column('actor_user_id', sa.Integer(), nullable=True),
+    sa.Column('entity_type', sa.String(), nullable=True),
+    sa.Column('entity_id', sa.Integer(), nullable=True),
+    sa.Column('date_bucket', sa.String(), nullable=True),
+    sa.Column('cooldown_seconds', sa.Integer(), nullable=True),
+    sa.Column('text', sa.Text(), nullable=False),
+    sa.Column('reply_markup', sa.JSON(), nullable=True),
+    sa.Column('metadata_json', sa.JSON(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('max_attempts', sa.Integer(), nullable=False),
+    sa.Column('available_at', sa.DateTime(), nullable=False),
+    sa.Column('locked_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('processed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['recipient_user_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['pair_id'], ['pairs.id'], ),
+    sa.ForeignKeyConstraint(['actor_user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_notification_outbox_id'), 'notification_outbox', ['id'], unique=False)
+    op.create_index('ix_notification_outbox_claim', 'notification_outbox', ['status', 'available_at', 'priority'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_notification_outbox_claim', table_name='notification_outbox')
+    op.drop_index(op.f('ix_notification_outbox_id'), table_name='notification_outbox')
+    op.drop_table('notification_outbox')
+    sa.Enum(name='outboxstatus').drop(op.get_bind(), checkfirst=True)
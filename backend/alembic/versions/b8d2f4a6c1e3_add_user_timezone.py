@@ -0,0 +1,24 @@
+"""add_user_timezone
+
+Revision ID: b8d2f4a6c1e3
+Revises: a5c7e9b2d4f6
+Create Date: 2025-09-06 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b8d2f4a6c1e3'
+down_revision = 'a5c7e9b2d4f6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # NULL — часовой пояс по умолчанию (settings.DEFAULT_TIMEZONE)
+    op.add_column('users', sa.Column('timezone', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'timezone')
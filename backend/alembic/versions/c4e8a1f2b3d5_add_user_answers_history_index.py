@@ -0,0 +1,28 @@
+"""add_user_answers_history_index
+
+Revision ID: c4e8a1f2b3d5
+Revises: add_gpt_tasks_table
+Create Date: 2025-09-01 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8a1f2b3d5'
+down_revision = 'add_gpt_tasks_table'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_user_answers_user_created',
+        'user_answers',
+        ['user_id', 'created_at', 'id'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_user_answers_user_created', table_name='user_answers')
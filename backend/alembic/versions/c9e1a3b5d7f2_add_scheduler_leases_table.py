@@ -0,0 +1,29 @@
+"""add_scheduler_leases_table
+
+Revision ID: c9e1a3b5d7f2
+Revises: b8d2f4a6c1e3
+Create Date: 2025-09-07 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c9e1a3b5d7f2'
+down_revision = 'b8d2f4a6c1e3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Таблицу apscheduler_jobs создаёт сам SQLAlchemyJobStore при старте
+    op.create_table('scheduler_leases',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('holder', sa.String(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('scheduler_leases')
@@ -0,0 +1,31 @@
+"""add_gpt_task_queue_columns
+
+Revision ID: d4f6a8c0e2b7
+Revises: c9e1a3b5d7f2
+Create Date: 2025-09-12 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'd4f6a8c0e2b7'
+down_revision = 'c9e1a3b5d7f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('gpt_tasks', sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('gpt_tasks', sa.Column('max_attempts', sa.Integer(), nullable=False, server_default='3'))
+    op.add_column('gpt_tasks', sa.Column('available_at', sa.DateTime(), nullable=True))
+    op.add_column('gpt_tasks', sa.Column('locked_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_gpt_tasks_claim', 'gpt_tasks', ['status', 'available_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_gpt_tasks_claim', table_name='gpt_tasks')
+    op.drop_column('gpt_tasks', 'locked_at')
+    op.drop_column('gpt_tasks', 'available_at')
+    op.drop_column('gpt_tasks', 'max_attempts')
+    op.drop_column('gpt_tasks', 'attempts')
@@ -0,0 +1,32 @@
+"""add_pair_question_stats_table
+
+Revision ID: d7f1b2c3e4a6
+Revises: c4e8a1f2b3d5
+Create Date: 2025-09-02 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'd7f1b2c3e4a6'
+down_revision = 'c4e8a1f2b3d5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'pair_question_stats',
+        sa.Column('pair_id', sa.Integer(), nullable=False),
+        sa.Column('user1_answered', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('user2_answered', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('both_answered', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['pair_id'], ['pairs.id'], ),
+        sa.PrimaryKeyConstraint('pair_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('pair_question_stats')
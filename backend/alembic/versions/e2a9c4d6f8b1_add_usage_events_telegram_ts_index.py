@@ -0,0 +1,28 @@
+"""add_usage_events_telegram_ts_index
+
+Revision ID: e2a9c4d6f8b1
+Revises: d7f1b2c3e4a6
+Create Date: 2025-09-03 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e2a9c4d6f8b1'
+down_revision = 'd7f1b2c3e4a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_usage_events_telegram_ts',
+        'usage_events',
+        ['telegram_id', 'ts'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_usage_events_telegram_ts', table_name='usage_events')
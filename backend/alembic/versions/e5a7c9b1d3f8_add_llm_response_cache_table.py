@@ -0,0 +1,36 @@
+"""add_llm_response_cache_table
+
+Revision ID: e5a7c9b1d3f8
+Revises: d4f6a8c0e2b7
+Create Date: 2025-09-13 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e5a7c9b1d3f8'
+down_revision = 'd4f6a8c0e2b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('llm_response_cache',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('model', sa.String(), nullable=False),
+    sa.Column('response', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.Column('last_hit_at', sa.DateTime(), nullable=False),
+    sa.Column('hits', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index('ix_llm_response_cache_expires_at', 'llm_response_cache', ['expires_at'], unique=False)
+    op.create_index('ix_llm_response_cache_last_hit_at', 'llm_response_cache', ['last_hit_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_llm_response_cache_last_hit_at', table_name='llm_response_cache')
+    op.drop_index('ix_llm_response_cache_expires_at', table_name='llm_response_cache')
+    op.drop_table('llm_response_cache')
@@ -0,0 +1,28 @@
+"""add_notifications_dedupe_key
+
+Revision ID: f3b8d1e5a7c2
+Revises: e2a9c4d6f8b1
+Create Date: 2025-09-04 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8d1e5a7c2'
+down_revision = 'e2a9c4d6f8b1'
+branch_labels = None
+depends_on = 'b1a2c3d4e5f6'  # Таблица notifications создаётся в другой ветке миграций
+
+
+def upgrade() -> None:
+    op.add_column('notifications', sa.Column('dedupe_key', sa.String(), nullable=True))
+    op.create_index(op.f('ix_notifications_dedupe_key'), 'notifications', ['dedupe_key'], unique=True)
+    # Кулдауны проверяются выборкой по получателю и типу
+    op.create_index('ix_notifications_recipient_type_sent', 'notifications', ['recipient_user_id', 'type', 'sent_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_notifications_recipient_type_sent', table_name='notifications')
+    op.drop_index(op.f('ix_notifications_dedupe_key'), table_name='notifications')
+    op.drop_column('notifications', 'dedupe_key')
@@ -0,0 +1,36 @@
+"""add_pair_context_snapshots_table
+
+Revision ID: f6b8d0e2a4c9
+Revises: e5a7c9b1d3f8
+Create Date: 2025-09-14 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'f6b8d0e2a4c9'
+down_revision = 'e5a7c9b1d3f8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Заполняется скриптом scripts/rebuild_pair_snapshots.py (или лениво при первом чтении)
+    op.create_table(
+        'pair_context_snapshots',
+        sa.Column('pair_id', sa.Integer(), nullable=False),
+        sa.Column('mood_days', sa.JSON(), nullable=False),
+        sa.Column('mood_streak', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('mood_streak_best', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('last_both_mood_date', sa.Date(), nullable=True),
+        sa.Column('tune_compared', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('tune_matched', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['pair_id'], ['pairs.id'], ),
+        sa.PrimaryKeyConstraint('pair_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('pair_context_snapshots')
@@ -8,6 +8,7 @@ from sqlalchemy import and_, or_
 from app.core.database import get_db
 from app.models import User, Pair, Mood, Appreciation, Ritual, RitualCheck, CalendarEvent, EmotionNote, UserAnswer, PairDailyQuestion, TuneAnswer, PairDailyTuneQuestion
 from app.schemas.pair import PairWeeklyActivity, PairActivityItem
+from app.services.analytics_buffer import analytics_buffer
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -330,3 +331,9 @@ def get_pair_weekly_activity_internal(
         activities=activities,
         summary=summary
     )
+
+
+@router.get("/analytics/metrics")
+def get_analytics_metrics():
+    """Состояние буфера аналитики: глубина очереди, потери, задержка записи"""
+    return analytics_buffer.stats()
@@ -6,6 +6,7 @@ from app.core.database import get_db
 from app.models.invitation import Invitation
 from app.models.user import User
 from app.schemas.invitation import InvitationCreate, InvitationResponse, InvitationLink
+from app.services.pair_context import invalidate_pair_context
 
 router = APIRouter()
 
@@ -82,6 +83,7 @@ def use_invitation(code: str, invitee_telegram_id: int, db: Session = Depends(ge
     invitation.invitee_telegram_id = invitee_telegram_id
     
     db.commit()
+    invalidate_pair_context(invitation.inviter_id, invitee.id)
     
     return {"message": "Пара создана успешно"}
 
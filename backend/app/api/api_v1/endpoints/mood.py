@@ -9,8 +9,9 @@ from app.core.database import get_db
 from app.models import User, Mood, Appreciation, Pair
 from app.schemas.mood import Mood as MoodSchema, MoodCreate, Appreciation as AppreciationSchema, AppreciationCreate
 from app.services.auth import get_current_user
-from app.core.config import settings
-from app.services.notifications import NotificationService
+from app.services.pair_context import PairContext, get_pair_context
+from app.services.pair_snapshot import record_mood
+from app.notifications.events import emit
 
 
 router = APIRouter()
@@ -20,9 +21,10 @@ router = APIRouter()
 async def create_mood(
     mood_data: MoodCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    ctx: PairContext = Depends(get_pair_context)
 ):
     """Сохранить настроение дня"""
+    current_user = ctx.user
     # Проверяем, что настроение за сегодня ещё не было записано
     today = date.today()
     existing_mood = db.query(Mood).filter(
@@ -36,8 +38,6 @@ async def create_mood(
         # Обновляем существующее настроение
         existing_mood.mood_code = mood_data.mood_code
         existing_mood.note = mood_data.note
-        db.commit()
-        db.refresh(existing_mood)
         mood = existing_mood
     else:
         # Создаём новое настроение
@@ -47,17 +47,30 @@ async def create_mood(
             mood_code=mood_data.mood_code,
             note=mood_data.note
         )
-        
         db.add(mood)
-        db.commit()
-        db.refresh(mood)
-    
-    # Отправляем уведомление партнеру
-    try:
-        await send_mood_notification_to_partner(current_user, mood_data.mood_code, was_update, db)
-    except Exception as e:
-        # Логируем ошибку, но не прерываем сохранение настроения
-        print(f"Ошибка отправки уведомления о настроении: {e}")
+
+    # Событие для уведомления партнеру (id берём до коммита, пока объекты не истекли)
+    pair = ctx.active_pair
+    event = {
+        "actor_id": current_user.id,
+        "pair_id": pair.id,
+        "partner_id": ctx.partner_id,
+        "mood_code": mood_data.mood_code,
+        "was_update": was_update,
+    } if pair and ctx.partner_id else None
+
+    # Снимок контекста пары для GPT обновляется в той же транзакции
+    if pair:
+        db.flush()
+        record_mood(db, pair, current_user.id, mood.date.date(), mood.mood_code)
+
+    db.commit()
+    db.refresh(mood)
+
+    # Правило mood.created выполнит фоновый потребитель событий,
+    # быстрые повторные отметки одного пользователя схлопываются в одно уведомление
+    if event:
+        emit("mood.created", event, key=current_user.id)
     
     return mood
 
@@ -67,14 +80,12 @@ def get_moods(
     from_date: Optional[date] = Query(None),
     to_date: Optional[date] = Query(None),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    ctx: PairContext = Depends(get_pair_context)
 ):
     """Получить настроения пользователя и партнёра"""
+    current_user = ctx.user
     # Получаем пару пользователя
-    pair = db.query(Pair).filter(
-        (Pair.user1_id == current_user.id) | (Pair.user2_id == current_user.id),
-        Pair.status == "active"
-    ).first()
+    pair = ctx.active_pair
     
     if not pair:
         raise HTTPException(
@@ -83,7 +94,7 @@ def get_moods(
         )
     
     # Определяем ID партнёра
-    partner_id = pair.user2_id if pair.user1_id == current_user.id else pair.user1_id
+    partner_id = ctx.partner_id
     
     # Строим запрос с join для получения информации о пользователях
     query = db.query(Mood).join(User, Mood.user_id == User.id).filter(
@@ -144,14 +155,12 @@ def get_appreciations(
     from_date: Optional[date] = Query(None),
     to_date: Optional[date] = Query(None),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    ctx: PairContext = Depends(get_pair_context)
 ):
     """Получить признания пользователя и партнёра"""
+    current_user = ctx.user
     # Получаем пару пользователя
-    pair = db.query(Pair).filter(
-        (Pair.user1_id == current_user.id) | (Pair.user2_id == current_user.id),
-        Pair.status == "active"
-    ).first()
+    pair = ctx.active_pair
     
     if not pair:
         raise HTTPException(
@@ -160,7 +169,7 @@ def get_appreciations(
         )
     
     # Определяем ID партнёра
-    partner_id = pair.user2_id if pair.user1_id == current_user.id else pair.user1_id
+    partner_id = ctx.partner_id
     
     # Строим запрос
     query = db.query(Appreciation).filter(
@@ -176,63 +185,3 @@ def get_appreciations(
     appreciations = query.order_by(Appreciation.date.desc()).all()
     
     return appreciations
-
-
-async def send_mood_notification_to_partner(user: User, mood_code: str, was_update: bool, db: Session):
-    """Отправить уведомление партнеру о настроении"""
-    # Получаем пару пользователя
-    pair = db.query(Pair).filter(
-        (Pair.user1_id == user.id) | (Pair.user2_id == user.id),
-        Pair.status == "active"
-    ).first()
-    
-    if not pair:
-        return  # Нет пары - не отправляем уведомление
-    
-    # Определяем ID партнёра
-    partner_id = pair.user2_id if pair.user1_id == user.id else pair.user1_id
-    partner = db.query(User).filter(User.id == partner_id).first()
-    
-    if not partner:
-        return  # Партнер не найден
-    
-    # Маппинг настроений на эмодзи
-    mood_emojis = {
-        'joyful': '😊',
-        'calm': '😌', 
-        'tired': '😴',
-        'anxious': '😰',
-        'sad': '😢',
-        'irritable': '😤',
-        'grateful': '🙏'
-    }
-    
-    mood_emoji = mood_emojis.get(mood_code, '😊')
-    
-    # Формируем текст сообщения
-    action = "обновил" if was_update else "отметил"
-    text = f"{user.first_name or 'Партнер'} {action} настроение дня: {mood_emoji}"
-
-    # Создаём диплинк на страницу настроений
-    webapp_base_url = settings.TELEGRAM_WEBAPP_URL or "https://gallery.homoludens.photos/pulse_of_pair/"
-    webapp_url = f"{webapp_base_url}?tgWebAppStartParam=mood"
-
-    reply_markup = {
-        "inline_keyboard": [[
-            {"text": "Посмотреть настроение", "web_app": {"url": webapp_url}}
-        ]]
-    }
-    # Отправка через универсальный сервис с кулдауном 30 минут
-    service = NotificationService()
-    await service.send(
-        n_type="mood_update",
-        recipient=partner,
-        text=text,
-        reply_markup=reply_markup,
-        pair=pair,
-        actor=user,
-        entity_type="mood",
-        entity_id=None,
-        date_bucket=None,
-        metadata={"mood_code": mood_code, "was_update": was_update}
-    )
@@ -3,12 +3,12 @@ import secrets
 import logging
 from typing import List
 from fastapi import APIRouter, Depends, HTTPException, status, Header
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 
 from app.core.database import get_db
 from app.models import User, Pair, PairInvite
 from app.schemas.pair import Pair as PairSchema, PairInvite as PairInviteSchema, PairInviteCreate
-from app.services.auth import get_current_user
+from app.services.pair_context import PairContext, get_pair_context, invalidate_pair_context
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -17,20 +17,16 @@ logger = logging.getLogger(__name__)
 @router.post("/invite", response_model=PairInviteSchema, deprecated=True)
 def create_invite(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    ctx: PairContext = Depends(get_pair_context)
 ):
     """DEPRECATED. Создать код-приглашение для партнёра.
 
     Используйте флоу приглашений через эндпоинты `invitations.*` и регистрацию с `invite_code`.
     """
     logger.warning("DEPRECATED endpoint used: POST /api/v1/pair/invite")
+    current_user = ctx.user
     # Проверяем, что у пользователя нет активной пары
-    existing_pair = db.query(Pair).filter(
-        (Pair.user1_id == current_user.id) | (Pair.user2_id == current_user.id),
-        Pair.status == "active"
-    ).first()
-    
-    if existing_pair:
+    if ctx.active_pair:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="У вас уже есть активная пара"
@@ -57,13 +53,14 @@ def create_invite(
 def join_pair(
     invite_data: PairInviteCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    ctx: PairContext = Depends(get_pair_context)
 ):
     """DEPRECATED. Присоединиться к паре по коду-приглашению.
 
     Используйте флоу приглашений через эндпоинты `invitations.*` и регистрацию с `invite_code`.
     """
     logger.warning("DEPRECATED endpoint used: POST /api/v1/pair/join")
+    current_user = ctx.user
     # Находим приглашение
     invite = db.query(PairInvite).filter(
         PairInvite.code == invite_data.code,
@@ -84,12 +81,7 @@ def join_pair(
         )
     
     # Проверяем, что у пользователя нет активной пары
-    existing_pair = db.query(Pair).filter(
-        (Pair.user1_id == current_user.id) | (Pair.user2_id == current_user.id),
-        Pair.status == "active"
-    ).first()
-    
-    if existing_pair:
+    if ctx.active_pair:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="У вас уже есть активная пара"
@@ -107,6 +99,7 @@ def join_pair(
     db.add(pair)
     db.commit()
     db.refresh(pair)
+    invalidate_pair_context(pair.user1_id, pair.user2_id)
     
     return pair
 
@@ -125,19 +118,15 @@ def get_pair(
             detail="Пользователь не найден"
         )
     
-    pair = db.query(Pair).filter(
+    # Пара вместе с данными пользователей одним запросом
+    pair = db.query(Pair).options(
+        joinedload(Pair.user1),
+        joinedload(Pair.user2)
+    ).filter(
         (Pair.user1_id == user.id) | (Pair.user2_id == user.id),
         Pair.status == "active"
     ).first()
     
-    if pair:
-        # Загружаем данные пользователей
-        from sqlalchemy.orm import joinedload
-        pair = db.query(Pair).options(
-            joinedload(Pair.user1),
-            joinedload(Pair.user2)
-        ).filter(Pair.id == pair.id).first()
-    
     if not pair:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
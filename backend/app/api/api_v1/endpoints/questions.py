@@ -1,14 +1,15 @@
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, func
+from typing import List, Optional, Tuple
+import base64
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import and_, or_, func, exists
+from sqlalchemy.exc import IntegrityError
 from datetime import date, datetime, timedelta
-import random
 import httpx
 
 from app.core.database import get_db
 from app.models import User, Pair, Question, UserAnswer, UserQuestionStatus, PairDailyQuestion, QuestionNotification
-from app.services.auth import get_current_user
+from app.services.pair_context import PairContext, get_pair_context
 from app.schemas.question import (
     QuestionResponse, 
     UserAnswerCreate, 
@@ -17,7 +18,8 @@ from app.schemas.question import (
     PairAnswersResponse
 )
 from app.core.config import settings
-from app.services.notifications import NotificationService
+from app.services.outbox import INTERACTIVE_PRIORITY, enqueue_notification, outbox_worker
+from app.services.question_stats import record_answer, get_pair_question_stats
 
 router = APIRouter()
 
@@ -25,17 +27,16 @@ router = APIRouter()
 @router.get("/current", response_model=Optional[QuestionResponse])
 async def get_current_question(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    ctx: PairContext = Depends(get_pair_context)
 ):
     """Получить вопрос дня для пары (один на пару в день).
     Если на сегодня ещё не назначен — назначаем первый неотвеченный обоими и возвращаем.
     Пользователь видит только назначенный на сегодня вопрос.
     """
+    current_user = ctx.user
     
     # Проверяем, есть ли у пользователя пара
-    user_pair = db.query(Pair).filter(
-        or_(Pair.user1_id == current_user.id, Pair.user2_id == current_user.id)
-    ).first()
+    user_pair = ctx.pair
     
     if not user_pair:
         raise HTTPException(
@@ -44,49 +45,26 @@ async def get_current_question(
         )
     
     # Партнёр
-    partner_id = user_pair.user2_id if user_pair.user1_id == current_user.id else user_pair.user1_id
+    partner_id = ctx.partner_id
 
-    # Проверяем, назначен ли вопрос на сегодня для пары
+    # Вопрос на сегодня вместе с флагами ответов — одним запросом
     today = date.today()
-    todays = db.query(PairDailyQuestion).filter(
-        PairDailyQuestion.pair_id == user_pair.id,
-        PairDailyQuestion.date == today
-    ).first()
+    todays = _todays_question_with_flags(db, user_pair.id, current_user.id, partner_id, today)
 
     if todays:
-        q = db.query(Question).filter(Question.id == todays.question_id).first()
-        user_answered = db.query(UserAnswer).filter(
-            UserAnswer.user_id == current_user.id,
-            UserAnswer.question_id == q.id
-        ).first() is not None
-        partner_answered = db.query(UserAnswer).filter(
-            UserAnswer.user_id == partner_id,
-            UserAnswer.question_id == q.id
-        ).first() is not None
-        return QuestionResponse(
-            id=q.id,
-            number=q.number,
-            text=q.text,
-            category=q.category,
-            partner_answered=partner_answered,
-            user_answered=user_answered
-        )
+        return _question_response(*todays)
 
-    # Если на сегодня не назначен — найдём случайный вопрос, на который не ответили оба
-    user_answered_ids = db.query(UserAnswer.question_id).filter(UserAnswer.user_id == current_user.id)
-    partner_answered_ids = db.query(UserAnswer.question_id).filter(UserAnswer.user_id == partner_id)
-
-    # Получаем все неотвеченные вопросы и выбираем случайный
-    unanswered_questions = db.query(Question).filter(
-        ~Question.id.in_(user_answered_ids),
-        ~Question.id.in_(partner_answered_ids)
-    ).all()
+    # Если на сегодня не назначен — случайный вопрос, на который не ответил ни один из пары.
+    # Выбор делается в БД, весь банк вопросов в память не загружается
+    answered_ids = db.query(UserAnswer.question_id).filter(
+        UserAnswer.user_id.in_([current_user.id, partner_id])
+    )
+    next_question = db.query(Question).filter(
+        ~Question.id.in_(answered_ids)
+    ).order_by(func.random()).limit(1).first()
     
-    if not unanswered_questions:
+    if not next_question:
         return None
-        
-    # Выбираем случайный вопрос из неотвеченных
-    next_question = random.choice(unanswered_questions)
 
     # Назначаем его как вопрос дня для пары
     assigned = PairDailyQuestion(
@@ -95,25 +73,65 @@ async def get_current_question(
         date=today
     )
     db.add(assigned)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # Партнёр успел назначить вопрос параллельно — возвращаем его
+        db.rollback()
+        todays = _todays_question_with_flags(db, user_pair.id, current_user.id, partner_id, today)
+        if not todays:
+            raise
+        return _question_response(*todays)
+
+    return _question_response(next_question, False, False)
 
+
+def _question_response(question: Question, user_answered: bool, partner_answered: bool) -> QuestionResponse:
     return QuestionResponse(
-        id=next_question.id,
-        number=next_question.number,
-        text=next_question.text,
-        category=next_question.category,
-        partner_answered=False,
-        user_answered=False
+        id=question.id,
+        number=question.number,
+        text=question.text,
+        category=question.category,
+        partner_answered=partner_answered,
+        user_answered=user_answered
     )
 
 
+def _todays_question_with_flags(
+    db: Session, pair_id: int, user_id: int, partner_id: int, today: date
+) -> Optional[Tuple[Question, bool, bool]]:
+    """Назначенный паре на сегодня вопрос и флаги «ответил пользователь / партнёр»"""
+    def answered_by(answer_user_id: int):
+        return exists().where(
+            UserAnswer.question_id == Question.id,
+            UserAnswer.user_id == answer_user_id
+        )
+
+    row = db.query(
+        Question,
+        answered_by(user_id).label("user_answered"),
+        answered_by(partner_id).label("partner_answered"),
+    ).join(
+        PairDailyQuestion, PairDailyQuestion.question_id == Question.id
+    ).filter(
+        PairDailyQuestion.pair_id == pair_id,
+        PairDailyQuestion.date == today
+    ).first()
+
+    if row is None:
+        return None
+    question, user_answered, partner_answered = row
+    return question, bool(user_answered), bool(partner_answered)
+
+
 @router.post("/answer", response_model=UserAnswerResponse)
 async def submit_answer(
     answer_data: UserAnswerCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    ctx: PairContext = Depends(get_pair_context)
 ):
     """Отправить ответ на СЕГОДНЯШНИЙ вопрос пары. Нельзя отвечать на любой произвольный."""
+    current_user = ctx.user
     
     # Проверяем, существует ли вопрос
     question = db.query(Question).filter(Question.id == answer_data.question_id).first()
@@ -124,9 +142,7 @@ async def submit_answer(
         )
 
     # Проверяем, что этот вопрос — назначенный на сегодня для пары
-    user_pair = db.query(Pair).filter(
-        or_(Pair.user1_id == current_user.id, Pair.user2_id == current_user.id)
-    ).first()
+    user_pair = ctx.pair
 
     if not user_pair:
         raise HTTPException(status_code=404, detail="У вас пока нет пары")
@@ -162,6 +178,9 @@ async def submit_answer(
     )
     
     db.add(new_answer)
+    db.flush()
+    # Счётчики статистики обновляются в той же транзакции
+    record_answer(db, user_pair, current_user.id, new_answer.question_id)
     db.commit()
     db.refresh(new_answer)
     
@@ -177,9 +196,10 @@ async def submit_answer(
 async def get_pair_answers(
     question_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    ctx: PairContext = Depends(get_pair_context)
 ):
     """Получить ответы пары на конкретный вопрос"""
+    current_user = ctx.user
     
     # Проверяем, существует ли вопрос
     question = db.query(Question).filter(Question.id == question_id).first()
@@ -190,9 +210,7 @@ async def get_pair_answers(
         )
     
     # Получаем пару пользователя
-    user_pair = db.query(Pair).filter(
-        or_(Pair.user1_id == current_user.id, Pair.user2_id == current_user.id)
-    ).first()
+    user_pair = ctx.pair
     
     if not user_pair:
         raise HTTPException(
@@ -200,8 +218,8 @@ async def get_pair_answers(
             detail="У вас пока нет пары"
         )
     
-    partner_id = user_pair.user2_id if user_pair.user1_id == current_user.id else user_pair.user1_id
-    partner = db.query(User).filter(User.id == partner_id).first()
+    partner_id = ctx.partner_id
+    partner = ctx.partner
     
     # Получаем ответы пользователя и партнера
     user_answer = db.query(UserAnswer).filter(
@@ -251,17 +269,23 @@ async def get_pair_answers(
 
 @router.get("/history", response_model=List[QuestionStatusResponse])
 async def get_questions_history(
+    response: Response,
     skip: int = 0,
     limit: int = 20,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    ctx: PairContext = Depends(get_pair_context)
 ):
-    """История: только вопросы, на которые текущий пользователь уже ответил, отсортированные по дате ответа (от самого недавнего)."""
+    """История: только вопросы, на которые текущий пользователь уже ответил, отсортированные по дате ответа (от самого недавнего).
+
+    Постраничная навигация по курсору: курсор следующей страницы возвращается
+    в заголовке X-Next-Cursor и передаётся в параметре cursor. Параметр skip
+    поддерживается для старых клиентов и игнорируется, если передан cursor.
+    """
+    current_user = ctx.user
     
     # Получаем пару пользователя
-    user_pair = db.query(Pair).filter(
-        or_(Pair.user1_id == current_user.id, Pair.user2_id == current_user.id)
-    ).first()
+    user_pair = ctx.pair
     
     if not user_pair:
         raise HTTPException(
@@ -269,62 +293,80 @@ async def get_questions_history(
             detail="У вас пока нет пары"
         )
     
-    partner_id = user_pair.user2_id if user_pair.user1_id == current_user.id else user_pair.user1_id
+    partner_id = ctx.partner_id
+    partner_answer = aliased(UserAnswer)
     
-    # Только те вопросы, на которые ответил текущий пользователь
-    # Сортируем по дате ответа (от самого недавнего к более старым)
-    answered_questions = db.query(Question, UserAnswer.created_at).join(
-        UserAnswer, Question.id == UserAnswer.question_id
-    ).filter(
-        UserAnswer.user_id == current_user.id
-    ).order_by(UserAnswer.created_at.desc()).offset(skip).limit(limit).all()
-    
-    questions = [item[0] for item in answered_questions]
-    
-    result = []
-    for question in questions:
-        # Проверяем ответы пользователя и партнера
-        user_answer = db.query(UserAnswer).filter(
-            and_(
-                UserAnswer.user_id == current_user.id,
-                UserAnswer.question_id == question.id
-            )
-        ).first()
-        
-        partner_answer = db.query(UserAnswer).filter(
-            and_(
-                UserAnswer.user_id == partner_id,
-                UserAnswer.question_id == question.id
-            )
-        ).first()
-        
-        result.append(QuestionStatusResponse(
+    # Ответы пользователя вместе с ответом партнёра (LEFT JOIN) — один запрос на страницу
+    query = db.query(Question, UserAnswer.created_at, UserAnswer.id, partner_answer.id).join(
+        UserAnswer, and_(
+            UserAnswer.question_id == Question.id,
+            UserAnswer.user_id == current_user.id
+        )
+    ).outerjoin(
+        partner_answer, and_(
+            partner_answer.question_id == Question.id,
+            partner_answer.user_id == partner_id
+        )
+    )
+    
+    if cursor:
+        cursor_created_at, cursor_id = _decode_history_cursor(cursor)
+        query = query.filter(or_(
+            UserAnswer.created_at < cursor_created_at,
+            and_(UserAnswer.created_at == cursor_created_at, UserAnswer.id < cursor_id)
+        ))
+    
+    # Сортируем по дате ответа (от самого недавнего к более старым), id — для стабильного порядка
+    query = query.order_by(UserAnswer.created_at.desc(), UserAnswer.id.desc())
+    if not cursor:
+        query = query.offset(skip)
+    rows = query.limit(limit).all()
+    
+    if rows and len(rows) == limit:
+        _, last_created_at, last_id, _ = rows[-1]
+        response.headers["X-Next-Cursor"] = _encode_history_cursor(last_created_at, last_id)
+    
+    return [
+        QuestionStatusResponse(
             question=QuestionResponse(
                 id=question.id,
                 number=question.number,
                 text=question.text,
                 category=question.category,
-                partner_answered=partner_answer is not None
+                partner_answered=partner_answer_id is not None
             ),
-            user_answered=user_answer is not None,
-            partner_answered=partner_answer is not None,
-            can_view_answers=user_answer is not None
-        ))
-    
-    return result
+            user_answered=True,
+            partner_answered=partner_answer_id is not None,
+            can_view_answers=True
+        )
+        for question, _, _, partner_answer_id in rows
+    ]
+
+
+def _encode_history_cursor(created_at: datetime, answer_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{answer_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_history_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, answer_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(answer_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
 
 
 @router.get("/stats")
 async def get_questions_stats(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    ctx: PairContext = Depends(get_pair_context)
 ):
     """Получить статистику по вопросам"""
+    current_user = ctx.user
     
     # Получаем пару пользователя
-    user_pair = db.query(Pair).filter(
-        or_(Pair.user1_id == current_user.id, Pair.user2_id == current_user.id)
-    ).first()
+    user_pair = ctx.pair
     
     if not user_pair:
         return {
@@ -335,30 +377,12 @@ async def get_questions_stats(
             "completion_percentage": 0
         }
     
-    partner_id = user_pair.user2_id if user_pair.user1_id == current_user.id else user_pair.user1_id
-    
-    # Общее количество вопросов
-    total_questions = db.query(func.count(Question.id)).scalar()
-    
-    # Количество вопросов, на которые ответил пользователь
-    user_answered = db.query(func.count(UserAnswer.id)).filter(
-        UserAnswer.user_id == current_user.id
-    ).scalar()
-    
-    # Количество вопросов, на которые ответил партнер
-    partner_answered = db.query(func.count(UserAnswer.id)).filter(
-        UserAnswer.user_id == partner_id
-    ).scalar()
-    
-    # Количество вопросов, на которые ответили оба
-    both_answered_query = db.query(UserAnswer.question_id).filter(
-        UserAnswer.user_id == current_user.id
-    ).intersect(
-        db.query(UserAnswer.question_id).filter(
-            UserAnswer.user_id == partner_id
-        )
-    )
-    both_answered = len(both_answered_query.all())
+    # Предрассчитанные счётчики пары (pair_question_stats) — одна выборка по ключу
+    stats = get_pair_question_stats(db, user_pair, current_user.id)
+    total_questions = stats["total_questions"]
+    user_answered = stats["user_answered"]
+    partner_answered = stats["partner_answered"]
+    both_answered = stats["both_answered"]
     
     completion_percentage = (both_answered / total_questions * 100) if total_questions > 0 else 0
     
@@ -374,49 +398,33 @@ async def get_questions_stats(
 @router.post("/notify_partner")
 async def notify_partner_to_answer(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    ctx: PairContext = Depends(get_pair_context)
 ):
     """Отправить партнёру уведомление в Telegram: «Партнёр ответил, можно отвечать».
     Доступно, если на сегодня назначен вопрос и текущий пользователь уже ответил, а партнёр — нет.
     """
+    current_user = ctx.user
     # Пара пользователя
-    user_pair = db.query(Pair).filter(
-        or_(Pair.user1_id == current_user.id, Pair.user2_id == current_user.id)
-    ).first()
+    user_pair = ctx.pair
     if not user_pair:
         raise HTTPException(status_code=404, detail="У вас пока нет пары")
 
-    partner_id = user_pair.user2_id if user_pair.user1_id == current_user.id else user_pair.user1_id
-    partner = db.query(User).filter(User.id == partner_id).first()
+    partner_id = ctx.partner_id
+    partner = ctx.partner
     if not partner:
         raise HTTPException(status_code=404, detail="Партнёр не найден")
 
-    # Назначенный на сегодня вопрос
+    # Назначенный на сегодня вопрос и статус ответов
     today = date.today()
-    todays = db.query(PairDailyQuestion).filter(
-        PairDailyQuestion.pair_id == user_pair.id,
-        PairDailyQuestion.date == today
-    ).first()
+    todays = _todays_question_with_flags(db, user_pair.id, current_user.id, partner_id, today)
     if not todays:
         raise HTTPException(status_code=400, detail="На сегодня вопрос не назначен")
 
-    question = db.query(Question).filter(Question.id == todays.question_id).first()
-    if not question:
-        raise HTTPException(status_code=404, detail="Вопрос не найден")
-
-    # Проверяем ответы
-    user_answer = db.query(UserAnswer).filter(
-        UserAnswer.user_id == current_user.id,
-        UserAnswer.question_id == question.id
-    ).first()
-    if not user_answer:
+    question, user_answered, partner_answered = todays
+    if not user_answered:
         raise HTTPException(status_code=400, detail="Сначала ответьте на вопрос")
 
-    partner_answer = db.query(UserAnswer).filter(
-        UserAnswer.user_id == partner_id,
-        UserAnswer.question_id == question.id
-    ).first()
-    if partner_answer:
+    if partner_answered:
         return {"ok": True, "message": "Партнёр уже ответил"}
 
     # Проверяем, не отправляли ли мы уже уведомление за последний час
@@ -454,8 +462,10 @@ async def notify_partner_to_answer(
         ]]
     }
 
-    service = NotificationService()
-    await service.send(
+    # Уведомление уходит через outbox в одной транзакции с записью о нём
+    enqueue_notification(
+        db,
+        priority=INTERACTIVE_PRIORITY,
         n_type="question_reminder",
         recipient=partner,
         text=text,
@@ -477,5 +487,6 @@ async def notify_partner_to_answer(
     )
     db.add(notification_record)
     db.commit()
+    outbox_worker.wake()
 
     return {"ok": True}
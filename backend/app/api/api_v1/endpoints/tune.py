@@ -11,14 +11,15 @@ from app.core.database import get_db
 from app.core.config import settings
 from app.models import User, Pair
 from app.models.tune import PairDailyTuneQuestion, TuneAnswer, TuneQuizQuestion, TuneNotification
-from app.services.auth import get_current_user
+from app.services.pair_context import PairContext, get_pair_context
+from app.services.pair_snapshot import record_tune_answer
 from app.schemas.tune import (
     TuneQuestionResponse,
     TuneAnswerCreate,
     TunePairAnswersResponse,
     TuneAnswerItem,
 )
-from app.services.notifications import NotificationService
+from app.services.outbox import INTERACTIVE_PRIORITY, enqueue_notification, outbox_worker
 
 
 router = APIRouter()
@@ -27,19 +28,18 @@ router = APIRouter()
 @router.get("/current", response_model=Optional[TuneQuestionResponse])
 def get_current_tune_question(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    ctx: PairContext = Depends(get_pair_context)
 ):
     """Получить вопрос дня (Сонастройка) для пары. Если не назначен — назначить случайный неотвеченный обоими.
     Возвращает вопрос и флаги по 4 ответам относительно текущего пользователя.
     """
+    current_user = ctx.user
     # Пара
-    user_pair = db.query(Pair).filter(
-        or_(Pair.user1_id == current_user.id, Pair.user2_id == current_user.id)
-    ).first()
+    user_pair = ctx.pair
     if not user_pair:
         raise HTTPException(status_code=404, detail="У вас пока нет пары. Пригласите партнера!")
 
-    partner_id = user_pair.user2_id if user_pair.user1_id == current_user.id else user_pair.user1_id
+    partner_id = ctx.partner_id
 
     # Назначен ли на сегодня вопрос
     today = date.today()
@@ -130,17 +130,16 @@ def get_current_tune_question(
 def submit_tune_answer(
     payload: TuneAnswerCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    ctx: PairContext = Depends(get_pair_context)
 ):
     """Отправить ответ в режиме Сонастройки. about: me|partner."""
+    current_user = ctx.user
     # Пара
-    user_pair = db.query(Pair).filter(
-        or_(Pair.user1_id == current_user.id, Pair.user2_id == current_user.id)
-    ).first()
+    user_pair = ctx.pair
     if not user_pair:
         raise HTTPException(status_code=404, detail="У вас пока нет пары")
 
-    partner_id = user_pair.user2_id if user_pair.user1_id == current_user.id else user_pair.user1_id
+    partner_id = ctx.partner_id
 
     # Проверяем, что вопрос существует (только квиз Сонастройка)
     quiz = db.query(TuneQuizQuestion).filter(TuneQuizQuestion.id == payload.question_id).first()
@@ -186,6 +185,9 @@ def submit_tune_answer(
 
     answer = TuneAnswer(**answer_kwargs)
     db.add(answer)
+    db.flush()
+    # Совпадения Сонастройки в снимке контекста пары — в той же транзакции
+    record_tune_answer(db, user_pair, answer)
     db.commit()
     db.refresh(answer)
 
@@ -196,18 +198,17 @@ def submit_tune_answer(
 def get_tune_answers(
     question_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    ctx: PairContext = Depends(get_pair_context)
 ):
     """Получить все 4 ответа по вопросу Сонастройки для пары. Доступно обоим."""
+    current_user = ctx.user
     # Пара
-    user_pair = db.query(Pair).filter(
-        or_(Pair.user1_id == current_user.id, Pair.user2_id == current_user.id)
-    ).first()
+    user_pair = ctx.pair
     if not user_pair:
         raise HTTPException(status_code=404, detail="У вас пока нет пары")
 
-    partner_id = user_pair.user2_id if user_pair.user1_id == current_user.id else user_pair.user1_id
-    partner = db.query(User).filter(User.id == partner_id).first()
+    partner_id = ctx.partner_id
+    partner = ctx.partner
 
     # Получаем вопрос квиза Сонастройка
     quiz = db.query(TuneQuizQuestion).filter(TuneQuizQuestion.id == question_id).first()
@@ -270,20 +271,19 @@ def get_tune_answers(
 @router.post("/notify_partner")
 async def notify_partner_to_answer_tune(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    ctx: PairContext = Depends(get_pair_context)
 ):
     """Отправить партнёру уведомление в Telegram о квизе Сонастройка.
     Доступно, если на сегодня назначен вопрос и текущий пользователь уже ответил, а партнёр — нет.
     """
+    current_user = ctx.user
     # Пара пользователя
-    user_pair = db.query(Pair).filter(
-        or_(Pair.user1_id == current_user.id, Pair.user2_id == current_user.id)
-    ).first()
+    user_pair = ctx.pair
     if not user_pair:
         raise HTTPException(status_code=404, detail="У вас пока нет пары")
 
-    partner_id = user_pair.user2_id if user_pair.user1_id == current_user.id else user_pair.user1_id
-    partner = db.query(User).filter(User.id == partner_id).first()
+    partner_id = ctx.partner_id
+    partner = ctx.partner
     if not partner:
         raise HTTPException(status_code=404, detail="Партнёр не найден")
 
@@ -358,8 +358,10 @@ async def notify_partner_to_answer_tune(
         ]]
     }
 
-    service = NotificationService()
-    await service.send(
+    # Уведомление уходит через outbox в одной транзакции с записью о нём
+    enqueue_notification(
+        db,
+        priority=INTERACTIVE_PRIORITY,
         n_type="tune_reminder",
         recipient=partner,
         text=text,
@@ -381,5 +383,6 @@ async def notify_partner_to_answer_tune(
     )
     db.add(notification)
     db.commit()
+    outbox_worker.wake()
 
     return {"ok": True, "message": "Уведомление отправлено"}
\ No newline at end of file
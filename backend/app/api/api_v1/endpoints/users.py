@@ -5,6 +5,7 @@ from typing import List
 from app.core.database import get_db
 from app.models.user import User
 from app.schemas.user import UserCreate, UserRegister, UserUpdate, User as UserSchema
+from app.services.pair_context import invalidate_pair_context
 
 router = APIRouter()
 
@@ -40,6 +41,7 @@ def register_user(user_data: UserRegister, db: Session = Depends(get_db)):
                     invitation.invitee_telegram_id = user_data.telegram_id
                     
                     db.commit()
+                    invalidate_pair_context(invitation.inviter_id, existing_user.id)
         
         return existing_user
     
@@ -88,6 +90,7 @@ def register_user(user_data: UserRegister, db: Session = Depends(get_db)):
                 invitation.invitee_telegram_id = user_data.telegram_id
                 
                 db.commit()
+                invalidate_pair_context(invitation.inviter_id, db_user.id)
     
     return db_user
 
@@ -133,6 +136,7 @@ def update_user(user_id: int, user_data: UserUpdate, db: Session = Depends(get_d
     
     db.commit()
     db.refresh(user)
+    invalidate_pair_context(user.id)
     return user
 
 
@@ -148,5 +152,6 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
     
     user.is_active = False
     db.commit()
+    invalidate_pair_context(user.id)
     
     return {"message": "Пользователь успешно удален"}
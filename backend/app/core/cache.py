@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+from sqlalchemy.orm import make_transient_to_detached
+
+V = TypeVar("V")
+T = TypeVar("T")
+
+
+def detached_copy(instance: T) -> T:
+    """Отсоединённая копия ORM-объекта (только колонки).
+
+    Копию можно хранить в кеше между запросами и подключать к новой сессии
+    через session.merge(copy, load=False) — без SELECT в БД.
+    """
+    model = type(instance)
+    copy = model(**{column.key: getattr(instance, column.key) for column in model.__table__.columns})
+    make_transient_to_detached(copy)
+    return copy
+
+
+class TTLCache(Generic[V]):
+    """Ограниченный по размеру LRU-кеш с индивидуальным временем жизни записей.
+
+    Потокобезопасен: синхронные эндпоинты FastAPI выполняются в пуле потоков,
+    поэтому доступ к словарю защищён блокировкой. Просроченные записи удаляются
+    лениво — при обращении к ним или при вытеснении.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[V]:
+        now = self._clock()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at <= now:
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: V, ttl: Optional[float] = None) -> None:
+        """Сохраняет значение. ttl переопределяет время жизни по умолчанию (но не превышает его)."""
+        lifetime = self.ttl if ttl is None else min(ttl, self.ttl)
+        if lifetime <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (self._clock() + lifetime, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def discard_where(self, predicate: Callable[[Hashable, V], bool]) -> int:
+        """Удаляет все записи, для которых predicate(key, value) истинно. Возвращает их число."""
+        with self._lock:
+            keys = [k for k, (_, v) in self._data.items() if predicate(k, v)]
+            for k in keys:
+                del self._data[k]
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,145 @@
+import heapq
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple
+
+from sqlalchemy import Column, Float, MetaData, String, Table, create_engine, func, select
+from sqlalchemy.pool import StaticPool
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitBackend(ABC):
+    """Хранилище состояния лимитера по алгоритму GCRA.
+
+    На каждый ключ хранится одно число — теоретическое время прибытия (TAT)
+    следующего запроса, поэтому память на ключ постоянна. Запрос пропускается,
+    если TAT - period <= now; тогда TAT сдвигается на period / calls.
+    """
+
+    # Вызов блокирует поток (ходит в БД) — middleware выносит его в пул потоков
+    blocking = False
+
+    @abstractmethod
+    def acquire(self, key: str, calls: int, period: float, now: float) -> float:
+        """Учитывает запрос. Возвращает 0, если он разрешён, иначе — сколько секунд ждать."""
+
+
+def _gcra(tat: float, calls: int, period: float, now: float) -> Tuple[float, float]:
+    """Новый TAT и время ожидания (0 — запрос разрешён)"""
+    new_tat = max(tat, now) + period / calls
+    allow_at = new_tat - period
+    if now < allow_at:
+        return tat, allow_at - now
+    return new_tat, 0.0
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """Состояние в памяти процесса; устаревшие ключи удаляются лениво через кучу"""
+
+    def __init__(self):
+        self._tat: Dict[str, float] = {}
+        self._expiry: List[Tuple[float, str]] = []  # (TAT, ключ) — по одной записи на ключ
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, calls: int, period: float, now: float) -> float:
+        with self._lock:
+            self._expire(now)
+            known = key in self._tat
+            tat, retry_after = _gcra(self._tat.get(key, now), calls, period, now)
+            self._tat[key] = tat
+            if not known:
+                heapq.heappush(self._expiry, (tat, key))
+            return retry_after
+
+    def _expire(self, now: float) -> None:
+        # Ключ, чей TAT уже прошёл, неотличим от нового — его можно забыть
+        while self._expiry and self._expiry[0][0] <= now:
+            _, key = heapq.heappop(self._expiry)
+            tat = self._tat.get(key)
+            if tat is not None and tat > now:
+                heapq.heappush(self._expiry, (tat, key))
+            else:
+                self._tat.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+
+rate_limit_metadata = MetaData()
+
+rate_limit_buckets = Table(
+    "rate_limit_buckets",
+    rate_limit_metadata,
+    Column("key", String(128), primary_key=True),
+    Column("tat", Float, nullable=False, index=True),
+)
+
+
+class DatabaseRateLimitBackend(RateLimitBackend):
+    """Общее для всех воркеров состояние в SQLite или Postgres.
+
+    Каждый запрос — один атомарный UPSERT: TAT обновляется, только если запрос
+    укладывается в лимит, поэтому параллельные воркеры не превышают его.
+    """
+
+    blocking = True
+
+    def __init__(self, url: str, cleanup_every: int = 1000):
+        if url in ("sqlite://", "sqlite:///:memory:"):
+            self.engine = create_engine(url, poolclass=StaticPool, connect_args={"check_same_thread": False})
+        elif url.startswith("sqlite"):
+            # Файл SQLite общий для воркеров на одной машине
+            self.engine = create_engine(url, connect_args={"check_same_thread": False})
+        else:
+            self.engine = create_engine(url, pool_pre_ping=True)
+        if self.engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        elif self.engine.dialect.name == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            raise ValueError(f"Unsupported rate limit storage: {self.engine.dialect.name}")
+        self._insert = insert
+        self._greatest = func.greatest if self.engine.dialect.name == "postgresql" else func.max
+        self.cleanup_every = cleanup_every
+        self._calls_since_cleanup = 0
+        rate_limit_metadata.create_all(self.engine)
+
+    def acquire(self, key: str, calls: int, period: float, now: float) -> float:
+        interval = period / calls
+        current = self._greatest(rate_limit_buckets.c.tat, now)
+        stmt = self._insert(rate_limit_buckets).values(key=key, tat=now + interval)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[rate_limit_buckets.c.key],
+            set_={"tat": current + interval},
+            where=current + interval - period <= now,
+        ).returning(rate_limit_buckets.c.tat)
+
+        with self.engine.begin() as conn:
+            if conn.execute(stmt).first() is not None:
+                retry_after = 0.0
+            else:
+                tat = conn.execute(
+                    select(rate_limit_buckets.c.tat).where(rate_limit_buckets.c.key == key)
+                ).scalar()
+                retry_after = max(tat + interval - period - now, 0.0) if tat is not None else 0.0
+
+        self._calls_since_cleanup += 1
+        if self._calls_since_cleanup >= self.cleanup_every:
+            self._calls_since_cleanup = 0
+            self.cleanup(now)
+        return retry_after
+
+    def cleanup(self, now: float) -> int:
+        """Удаляет ключи с прошедшим TAT"""
+        with self.engine.begin() as conn:
+            return conn.execute(rate_limit_buckets.delete().where(rate_limit_buckets.c.tat <= now)).rowcount
+
+
+def create_rate_limit_backend(storage_url: str) -> RateLimitBackend:
+    """Пустой URL — состояние в памяти процесса, иначе — общее хранилище в БД"""
+    if not storage_url:
+        return MemoryRateLimitBackend()
+    return DatabaseRateLimitBackend(storage_url)
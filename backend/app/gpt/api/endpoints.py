@@ -1,10 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+import json
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
 
 from app.core.database import get_db
 from app.core.config import settings
-from ..services.gpt_service import GPTService
+from ..services.gpt_service import GPTService, task_type_for
+from ..services.task_worker import gpt_task_worker
+from ..services.response_cache import response_cache
 from ..schemas.gpt_schemas import (
     GPTTaskCreate, GPTTaskResponse, GPTTaskList,
     AnalysisRequest, AnalysisResponse,
@@ -86,21 +91,11 @@ async def list_tasks(
 @router.post("/analyze", response_model=AnalysisResponse)
 async def analyze_data(
     request: AnalysisRequest,
-    background_tasks: BackgroundTasks,
     gpt_service: GPTService = Depends(get_gpt_service)
 ):
-    """Анализ данных (создает задачу и запускает обработку в фоне)"""
+    """Анализ данных (создает задачу, обработает её воркер очереди)"""
     try:
-        # Определяем тип задачи
-        task_type = TaskType.CUSTOM_ANALYSIS
-        if request.analysis_type == "relationship":
-            task_type = TaskType.RELATIONSHIP_ANALYSIS
-        elif request.analysis_type == "mood":
-            task_type = TaskType.MOOD_ANALYSIS
-        elif request.analysis_type == "questions":
-            task_type = TaskType.QUESTION_GENERATION
-        elif request.analysis_type == "feedback":
-            task_type = TaskType.FEEDBACK_ANALYSIS
+        task_type = task_type_for(request.analysis_type)
         
         # Создаем задачу
         task = await gpt_service.create_task(
@@ -108,8 +103,8 @@ async def analyze_data(
             input_data=request.data
         )
         
-        # Запускаем обработку в фоне
-        background_tasks.add_task(gpt_service.process_task, task.id)
+        # Задачу заберёт воркер очереди
+        gpt_task_worker.wake()
         
         return AnalysisResponse(
             success=True,
@@ -128,25 +123,17 @@ async def analyze_data_sync(
 ):
     """Синхронный анализ данных (создает задачу и сразу обрабатывает)"""
     try:
-        # Определяем тип задачи
-        task_type = TaskType.CUSTOM_ANALYSIS
-        if request.analysis_type == "relationship":
-            task_type = TaskType.RELATIONSHIP_ANALYSIS
-        elif request.analysis_type == "mood":
-            task_type = TaskType.MOOD_ANALYSIS
-        elif request.analysis_type == "questions":
-            task_type = TaskType.QUESTION_GENERATION
-        elif request.analysis_type == "feedback":
-            task_type = TaskType.FEEDBACK_ANALYSIS
+        task_type = task_type_for(request.analysis_type)
         
-        # Создаем задачу
+        # Создаем задачу уже взятой в работу, чтобы её не забрал воркер очереди
         task = await gpt_service.create_task(
             task_type=task_type,
-            input_data=request.data
+            input_data=request.data,
+            claimed=True
         )
         
         # Сразу обрабатываем
-        result = await gpt_service.process_task(task.id)
+        result = await gpt_service.process_task(task.id, claimed=True)
         
         return result
         
@@ -154,10 +141,45 @@ async def analyze_data_sync(
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@router.post("/analyze/stream")
+async def analyze_data_stream(
+    request: AnalysisRequest,
+    gpt_service: GPTService = Depends(get_gpt_service)
+):
+    """Анализ с потоковым ответом (server-sent events).
+    
+    События: data {"text": ...} — очередной фрагмент ответа; в конце
+    event: done с task_id или event: error с текстом ошибки. Результат
+    сохраняется в задаче, как у /analyze/sync.
+    """
+    try:
+        task = await gpt_service.create_task(
+            task_type=task_type_for(request.analysis_type),
+            input_data=request.data,
+            claimed=True
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    async def events():
+        try:
+            async for chunk in gpt_service.stream_task(task.id, claimed=True):
+                yield f"data: {json.dumps({'text': chunk}, ensure_ascii=False)}\n\n"
+            yield f"event: done\ndata: {json.dumps({'task_id': task.id})}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'task_id': task.id, 'error': str(e)}, ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Без буферизации в nginx, иначе первые токены придут только в конце
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.post("/batch", response_model=BatchAnalysisResponse)
 async def batch_analyze(
     request: BatchAnalysisRequest,
-    background_tasks: BackgroundTasks,
     gpt_service: GPTService = Depends(get_gpt_service)
 ):
     """Пакетный анализ данных"""
@@ -165,31 +187,20 @@ async def batch_analyze(
         # Создаем задачи для всех запросов
         tasks = []
         for analysis_request in request.tasks:
-            task_type = TaskType.CUSTOM_ANALYSIS
-            if analysis_request.analysis_type == "relationship":
-                task_type = TaskType.RELATIONSHIP_ANALYSIS
-            elif analysis_request.analysis_type == "mood":
-                task_type = TaskType.MOOD_ANALYSIS
-            elif analysis_request.analysis_type == "questions":
-                task_type = TaskType.QUESTION_GENERATION
-            elif analysis_request.analysis_type == "feedback":
-                task_type = TaskType.FEEDBACK_ANALYSIS
-            
             task = await gpt_service.create_task(
-                task_type=task_type,
+                task_type=task_type_for(analysis_request.analysis_type),
                 input_data=analysis_request.data
             )
             tasks.append(task)
         
-        # Запускаем обработку всех задач в фоне
-        for task in tasks:
-            background_tasks.add_task(gpt_service.process_task, task.id)
+        # Задачи заберёт воркер очереди (не больше GPT_WORKER_CONCURRENCY сразу)
+        gpt_task_worker.wake()
         
         return BatchAnalysisResponse(
             batch_id=f"batch_{tasks[0].id}_{tasks[-1].id}",
             total_tasks=len(tasks),
             submitted_tasks=len(tasks),
-            estimated_time=len(tasks) * 30,  # Примерно 30 секунд на задачу
+            estimated_time=len(tasks) * 30 / settings.GPT_WORKER_CONCURRENCY,  # Примерно 30 секунд на задачу
             message=f"Created {len(tasks)} tasks for batch processing"
         )
         
@@ -234,5 +245,6 @@ async def health_check():
     return {
         "status": "healthy",
         "module": "gpt",
-        "anthropic_configured": bool(settings.ANTHROPIC_API_KEY)
+        "anthropic_configured": bool(settings.ANTHROPIC_API_KEY),
+        "cache": {"enabled": settings.GPT_CACHE_ENABLED, **response_cache.stats()}
     }
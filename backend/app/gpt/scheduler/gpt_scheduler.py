@@ -3,11 +3,13 @@ import logging
 from datetime import datetime, timedelta
 from typing import List, Optional
 from sqlalchemy.orm import Session
+from apscheduler.triggers.cron import CronTrigger
 
 from app.core.database import SessionLocal
 from app.services.scheduler import scheduler
 from app.models.gpt_task import GPTTask, TaskStatus, TaskType
 from ..services.gpt_service import GPTService
+from ..services.task_worker import gpt_task_worker
 
 logger = logging.getLogger(__name__)
 
@@ -25,8 +27,8 @@ class GPTScheduler:
         db = SessionLocal()
         try:
             # Получаем все активные пары
-            from app.models.pair import Pair
-            active_pairs = db.query(Pair).filter(Pair.is_active == True).all()
+            from app.models.pair import Pair, PairStatus
+            active_pairs = db.query(Pair).filter(Pair.status == PairStatus.ACTIVE).all()
             
             logger.info(f"Найдено {len(active_pairs)} активных пар для анализа")
             
@@ -35,8 +37,9 @@ class GPTScheduler:
                     # Создаем задачу анализа отношений
                     await self.gpt_service.create_task(
                         task_type=TaskType.RELATIONSHIP_ANALYSIS,
+                        # Без даты запуска: при неизменных данных пары промпт
+                        # тот же и ответ берётся из кеша LLM
                         input_data={
-                            "analysis_date": datetime.utcnow().isoformat(),
                             "pair_id": pair.id
                         },
                         pair_id=pair.id
@@ -47,8 +50,8 @@ class GPTScheduler:
                 except Exception as e:
                     logger.error(f"Ошибка создания задачи для пары {pair.id}: {e}")
             
-            # Запускаем обработку задач в фоне
-            await self._process_pending_tasks()
+            # Задачи заберёт воркер очереди
+            gpt_task_worker.wake()
             
         except Exception as e:
             logger.error(f"Ошибка в ежедневном анализе: {e}")
@@ -149,31 +152,6 @@ class GPTScheduler:
         except Exception as e:
             logger.error(f"Ошибка в генерации вопросов: {e}")
     
-    async def _process_pending_tasks(self):
-        """Обработка ожидающих задач"""
-        db = SessionLocal()
-        try:
-            # Получаем все ожидающие задачи
-            pending_tasks = db.query(GPTTask).filter(
-                GPTTask.status == TaskStatus.PENDING
-            ).limit(10).all()  # Ограничиваем количество одновременно обрабатываемых задач
-            
-            logger.info(f"Найдено {len(pending_tasks)} ожидающих задач")
-            
-            for task in pending_tasks:
-                try:
-                    # Запускаем обработку в фоне
-                    asyncio.create_task(self.gpt_service.process_task(task.id))
-                    logger.info(f"Запущена обработка задачи {task.id}")
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка запуска задачи {task.id}: {e}")
-            
-        except Exception as e:
-            logger.error(f"Ошибка обработки ожидающих задач: {e}")
-        finally:
-            db.close()
-    
     async def cleanup_old_tasks(self):
         """Очистка старых задач"""
         logger.info("🧹 Запуск очистки старых задач...")
@@ -210,54 +188,64 @@ def register_gpt_jobs():
     """Регистрация GPT задач в планировщике"""
     
     # Ежедневный анализ отношений (каждый день в 6:00)
-    scheduler.scheduler.add_job(
-        gpt_scheduler.schedule_daily_analysis,
-        'cron',
-        hour=6,
-        minute=0,
+    scheduler.ensure_job(
+        f"{__name__}:gpt_scheduler.schedule_daily_analysis",
+        CronTrigger(
+            hour=6,
+            minute=0,
+            timezone='UTC'
+        ),
         id='gpt_daily_analysis',
         name='Ежедневный GPT анализ отношений'
     )
     
     # Еженедельный анализ обратной связи (каждый понедельник в 8:00)
-    scheduler.scheduler.add_job(
-        gpt_scheduler.schedule_weekly_feedback_analysis,
-        'cron',
-        day_of_week='mon',
-        hour=8,
-        minute=0,
+    scheduler.ensure_job(
+        f"{__name__}:gpt_scheduler.schedule_weekly_feedback_analysis",
+        CronTrigger(
+            day_of_week='mon',
+            hour=8,
+            minute=0,
+            timezone='UTC'
+        ),
         id='gpt_weekly_feedback',
         name='Еженедельный анализ обратной связи'
     )
     
     # Анализ трендов настроений (каждую неделю в воскресенье в 10:00)
-    scheduler.scheduler.add_job(
-        gpt_scheduler.schedule_mood_trend_analysis,
-        'cron',
-        day_of_week='sun',
-        hour=10,
-        minute=0,
+    scheduler.ensure_job(
+        f"{__name__}:gpt_scheduler.schedule_mood_trend_analysis",
+        CronTrigger(
+            day_of_week='sun',
+            hour=10,
+            minute=0,
+            timezone='UTC'
+        ),
         id='gpt_mood_analysis',
         name='Анализ трендов настроений'
     )
     
     # Генерация вопросов (каждые 3 дня в 12:00)
-    scheduler.scheduler.add_job(
-        gpt_scheduler.schedule_question_generation,
-        'cron',
-        hour=12,
-        minute=0,
+    scheduler.ensure_job(
+        f"{__name__}:gpt_scheduler.schedule_question_generation",
+        CronTrigger(
+            hour=12,
+            minute=0,
+            timezone='UTC'
+        ),
         id='gpt_question_generation',
         name='Генерация новых вопросов'
     )
     
     # Очистка старых задач (каждую неделю в воскресенье в 2:00)
-    scheduler.scheduler.add_job(
-        gpt_scheduler.cleanup_old_tasks,
-        'cron',
-        day_of_week='sun',
-        hour=2,
-        minute=0,
+    scheduler.ensure_job(
+        f"{__name__}:gpt_scheduler.cleanup_old_tasks",
+        CronTrigger(
+            day_of_week='sun',
+            hour=2,
+            minute=0,
+            timezone='UTC'
+        ),
         id='gpt_cleanup',
         name='Очистка старых GPT задач'
     )
@@ -3,7 +3,7 @@ from typing import Optional, Dict, Any, List
 from datetime import datetime
 from enum import Enum
 
-from ..models.gpt_task import TaskStatus, TaskType
+from app.models.gpt_task import TaskStatus, TaskType
 
 
 class TaskStatusEnum(str, Enum):
@@ -0,0 +1,170 @@
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session, aliased
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models import User, Pair, Mood, PairContextSnapshot, PairQuestionStats
+from app.models.pair import PairStatus
+from app.services.pair_snapshot import current_streak, ensure_pair_snapshot, mood_days_in_window
+from app.services.question_stats import ensure_pair_question_stats
+
+
+@dataclass
+class UserContext:
+    """Данные пользователя для промпта: профиль, настроения по дням, число ответов"""
+    id: int
+    first_name: str
+    last_name: Optional[str] = None
+    moods: Dict[str, str] = field(default_factory=dict)  # {"YYYY-MM-DD": mood_code}
+    answered: int = 0
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.first_name} {self.last_name or ''}".strip()
+
+    @property
+    def mood_counts(self) -> Dict[str, int]:
+        """Сколько дней отмечено каждое настроение, по убыванию"""
+        counts: Dict[str, int] = {}
+        for code in self.moods.values():
+            counts[code] = counts.get(code, 0) + 1
+        return dict(sorted(counts.items(), key=lambda item: -item[1]))
+
+    def mood_lines(self) -> List[str]:
+        return [f"{day}: {code}" for day, code in sorted(self.moods.items())]
+
+
+@dataclass
+class RelationshipContext:
+    """Контекст пары для анализа отношений (из pair_context_snapshots)"""
+    pair_id: int
+    user1: UserContext
+    user2: UserContext
+    both_answered: int = 0
+    mood_streak: int = 0
+    mood_streak_best: int = 0
+    tune_compared: int = 0
+    tune_matched: int = 0
+
+    @property
+    def tune_agreement(self) -> Optional[int]:
+        """Процент совпадений в Сонастройке; None, если сравнивать пока нечего"""
+        if not self.tune_compared:
+            return None
+        return round(100 * self.tune_matched / self.tune_compared)
+
+    def mood_lines(self) -> List[str]:
+        """Строки «дата: настроение 1 / настроение 2» по дням, где отметился хотя бы один"""
+        days = sorted(set(self.user1.moods) | set(self.user2.moods))
+        return [f"{day}: {self.user1.moods.get(day, '—')} / {self.user2.moods.get(day, '—')}" for day in days]
+
+
+def _since() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(days=settings.GPT_CONTEXT_DAYS)
+
+
+class GPTDataLoader:
+    """Загрузка данных для GPT задач напрямую из БД.
+
+    Контекст пары читается из готового снимка pair_context_snapshots
+    (поддерживается при записи настроений и ответов) одним запросом, поэтому
+    размер промпта и время загрузки не зависят от длины истории. Запросы
+    выполняются в отдельной сессии в пуле потоков, не блокируя цикл событий.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal):
+        self.session_factory = session_factory
+
+    async def relationship_context(self, pair_id: int) -> RelationshipContext:
+        """Пара, оба партнёра, снимок контекста и счётчики ответов — один запрос"""
+        return await asyncio.to_thread(self._load_relationship, pair_id)
+
+    async def user_context(self, user_id: int) -> UserContext:
+        """Пользователь и его настроения из снимка активной пары — один запрос"""
+        return await asyncio.to_thread(self._load_user, user_id)
+
+    def _load_relationship(self, pair_id: int) -> RelationshipContext:
+        db = self.session_factory()
+        try:
+            row = self._relationship_row(db, pair_id)
+            if row is None:
+                raise ValueError(f"Pair {pair_id} not found")
+            if row[3] is None or row[4] is None:
+                # Снимка ещё нет (пара до миграции) — строим по исходным данным
+                if row[3] is None:
+                    ensure_pair_snapshot(db, pair_id)
+                if row[4] is None:
+                    ensure_pair_question_stats(db, pair_id)
+                db.commit()
+                row = self._relationship_row(db, pair_id)
+
+            _, first, second, snapshot, stats = row
+            days = mood_days_in_window(snapshot)
+            contexts = []
+            for user, slot, answered in ((first, "user1", stats.user1_answered), (second, "user2", stats.user2_answered)):
+                contexts.append(UserContext(
+                    id=user.id,
+                    first_name=user.first_name,
+                    last_name=user.last_name,
+                    moods={day: slots[slot] for day, slots in days.items() if slot in slots},
+                    answered=answered,
+                ))
+            return RelationshipContext(
+                pair_id=pair_id,
+                user1=contexts[0],
+                user2=contexts[1],
+                both_answered=stats.both_answered,
+                mood_streak=current_streak(snapshot),
+                mood_streak_best=snapshot.mood_streak_best,
+                tune_compared=snapshot.tune_compared,
+                tune_matched=snapshot.tune_matched,
+            )
+        finally:
+            db.close()
+
+    def _relationship_row(self, db: Session, pair_id: int):
+        user1, user2 = aliased(User), aliased(User)
+        return db.execute(
+            select(Pair.id, user1, user2, PairContextSnapshot, PairQuestionStats)
+            .join(user1, user1.id == Pair.user1_id)
+            .join(user2, user2.id == Pair.user2_id)
+            .outerjoin(PairContextSnapshot, PairContextSnapshot.pair_id == Pair.id)
+            .outerjoin(PairQuestionStats, PairQuestionStats.pair_id == Pair.id)
+            .where(Pair.id == pair_id)
+        ).first()
+
+    def _load_user(self, user_id: int) -> UserContext:
+        db = self.session_factory()
+        try:
+            row = db.execute(
+                select(User, Pair, PairContextSnapshot)
+                .outerjoin(Pair, (Pair.status == PairStatus.ACTIVE)
+                           & or_(Pair.user1_id == User.id, Pair.user2_id == User.id))
+                .outerjoin(PairContextSnapshot, PairContextSnapshot.pair_id == Pair.id)
+                .where(User.id == user_id)
+            ).first()
+            if row is None:
+                raise ValueError(f"User {user_id} not found")
+            user, pair, snapshot = row
+            context = UserContext(id=user.id, first_name=user.first_name, last_name=user.last_name)
+            if snapshot is not None:
+                slot = "user1" if pair.user1_id == user.id else "user2"
+                context.moods = {
+                    day: slots[slot] for day, slots in mood_days_in_window(snapshot).items() if slot in slots
+                }
+            else:
+                # Без активной пары снимка нет — настроения за то же окно из таблицы moods
+                for mood_date, mood_code in db.execute(
+                    select(Mood.date, Mood.mood_code)
+                    .where(Mood.user_id == user_id, Mood.date >= _since())
+                    .order_by(Mood.date, Mood.id)
+                ):
+                    context.moods[mood_date.date().isoformat()] = mood_code
+            return context
+        finally:
+            db.close()
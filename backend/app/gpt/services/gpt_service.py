@@ -1,28 +1,182 @@
 import asyncio
 import httpx
+import json
 import logging
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
 from datetime import datetime
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
 from app.core.database import SessionLocal
 from app.models.gpt_task import GPTTask, TaskStatus, TaskType
+from app.services.telegram import AsyncTokenBucket
 from ..schemas.gpt_schemas import AnalysisRequest, AnalysisResponse
+from .data_loader import GPTDataLoader
+from .response_cache import ResponseCache, cache_key, response_cache
 
 logger = logging.getLogger(__name__)
 
 
+def _estimate_tokens(payload: Dict[str, Any]) -> int:
+    """Грубая оценка входных токенов до запроса (≈3 символа на токен для кириллицы)"""
+    chars = len(payload.get("system") or "") + sum(len(m["content"]) for m in payload["messages"])
+    return chars // 3 + 1
+
+
+class AnthropicClient:
+    """Долгоживущий клиент Anthropic API с пулом соединений и лимитами.
+
+    Один httpx.AsyncClient на процесс (keep-alive) создаётся при первом
+    запросе и закрывается на shutdown приложения. Одновременных запросов не
+    больше max_concurrency, расход токенов ограничен token bucket на
+    tokens_per_minute: перед запросом списывается оценка входных токенов,
+    после ответа — разница с фактическим usage (вход + выход). 0 — без лимита
+    токенов.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        tokens_per_minute: int = 0,
+        timeout: float = 30.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.timeout = timeout
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._budget: Optional[AsyncTokenBucket] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            # Соединения пула привязаны к циклу событий — в новом цикле нужен новый клиент
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+                transport=self.transport,
+            )
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            if self.tokens_per_minute > 0:
+                self._budget = AsyncTokenBucket(self.tokens_per_minute / 60, self.tokens_per_minute)
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def create(self, url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> str:
+        """Запрос /messages целиком; возвращает текст ответа"""
+        client = self._get_client()
+        estimate = _estimate_tokens(payload)
+        async with self._semaphore:
+            if self._budget is not None:
+                await self._budget.acquire(estimate)
+            response = await client.post(url, headers=headers, json=payload)
+            response.raise_for_status()
+            result = response.json()
+        self._charge(estimate, result.get("usage") or {})
+        return result["content"][0]["text"]
+
+    async def stream(self, url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> AsyncIterator[str]:
+        """Запрос /messages со stream=true; отдаёт фрагменты текста по мере генерации"""
+        client = self._get_client()
+        estimate = _estimate_tokens(payload)
+        usage: Dict[str, int] = {}
+        async with self._semaphore:
+            if self._budget is not None:
+                await self._budget.acquire(estimate)
+            async with client.stream("POST", url, headers=headers, json={**payload, "stream": True}) as response:
+                if response.is_error:
+                    await response.aread()
+                    response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    event = json.loads(line[5:])
+                    if event.get("type") == "content_block_delta" and event["delta"].get("type") == "text_delta":
+                        yield event["delta"]["text"]
+                    elif event.get("type") == "message_start":
+                        usage.update(event["message"].get("usage") or {})
+                    elif event.get("type") == "message_delta":
+                        usage.update(event.get("usage") or {})
+                    elif event.get("type") == "error":
+                        raise RuntimeError(f"Anthropic stream error: {event.get('error')}")
+        self._charge(estimate, usage)
+
+    def _charge(self, estimate: int, usage: Dict[str, int]) -> None:
+        if self._budget is None:
+            return
+        actual = usage.get("input_tokens", estimate) + usage.get("output_tokens", 0)
+        self._budget.consume(actual - estimate)
+
+
+# Общий клиент процесса (закрывается в shutdown приложения)
+anthropic_client = AnthropicClient(
+    max_concurrency=settings.ANTHROPIC_MAX_CONCURRENCY,
+    tokens_per_minute=settings.ANTHROPIC_TOKENS_PER_MINUTE,
+)
+
+
 class AnthropicService:
     """Сервис для работы с Anthropic API"""
     
-    def __init__(self):
+    def __init__(self, cache: Optional[ResponseCache] = None, client: Optional[AnthropicClient] = None):
         self.api_key = settings.ANTHROPIC_API_KEY
         self.base_url = "https://api.anthropic.com/v1"
         self.model = "claude-3-5-sonnet-20241022"
+        self.cache = cache if cache is not None else (response_cache if settings.GPT_CACHE_ENABLED else None)
+        self.client = client or anthropic_client
         
-    async def analyze_text(self, prompt: str, system_prompt: str = None) -> str:
+    async def analyze_text(self, prompt: str, system_prompt: str = None, use_cache: bool = True) -> str:
         """Анализ текста через Anthropic API"""
+        result, _ = await self.complete(prompt, system_prompt, use_cache)
+        return result
+    
+    async def cached(self, prompt: str, system_prompt: str = None) -> Optional[str]:
+        """Ответ из кеша, если он есть"""
+        if self.cache is None:
+            return None
+        return await self.cache.get(cache_key(self.model, system_prompt, prompt))
+    
+    async def complete(self, prompt: str, system_prompt: str = None, use_cache: bool = True) -> Tuple[str, bool]:
+        """Ответ модели и признак, что он взят из кеша (без запроса к API)"""
+        if use_cache:
+            cached = await self.cached(prompt, system_prompt)
+            if cached is not None:
+                return cached, True
+        try:
+            result = await self.client.create(*self._request(prompt, system_prompt))
+        except Exception as e:
+            logger.error(f"Anthropic API error: {e}")
+            raise
+        if use_cache:
+            await self._store(prompt, system_prompt, result)
+        return result, False
+    
+    async def stream(self, prompt: str, system_prompt: str = None, use_cache: bool = True) -> AsyncIterator[str]:
+        """Потоковый ответ модели (кеш не читается — это делает вызывающий через cached)"""
+        chunks = []
+        try:
+            async for chunk in self.client.stream(*self._request(prompt, system_prompt)):
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            logger.error(f"Anthropic API error: {e}")
+            raise
+        if use_cache:
+            await self._store(prompt, system_prompt, "".join(chunks))
+    
+    async def _store(self, prompt: str, system_prompt: Optional[str], result: str) -> None:
+        if self.cache is not None:
+            await self.cache.set(cache_key(self.model, system_prompt, prompt), self.model, result)
+    
+    def _request(self, prompt: str, system_prompt: str = None) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
         if not self.api_key:
             raise ValueError("ANTHROPIC_API_KEY not configured")
             
@@ -45,75 +199,31 @@ class AnthropicService:
         
         if system_prompt:
             data["system"] = system_prompt
-            
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                    f"{self.base_url}/messages",
-                    headers=headers,
-                    json=data,
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                
-                result = response.json()
-                return result["content"][0]["text"]
-                
-            except Exception as e:
-                logger.error(f"Anthropic API error: {e}")
-                raise
+        
+        return f"{self.base_url}/messages", headers, data
     
     async def batch_analyze(self, prompts: List[str], system_prompt: str = None) -> List[str]:
-        """Пакетный анализ текстов"""
+        """Пакетный анализ текстов (параллельность ограничивает AnthropicClient)"""
         tasks = [self.analyze_text(prompt, system_prompt) for prompt in prompts]
         return await asyncio.gather(*tasks, return_exceptions=True)
 
 
-class InternalAPIService:
-    """Сервис для вызова внутренних API"""
-    
-    def __init__(self):
-        self.base_url = "http://localhost:8000/api/v1"
-        
-    async def get_user_data(self, user_id: int) -> Dict[str, Any]:
-        """Получение данных пользователя"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{self.base_url}/users/{user_id}")
-            response.raise_for_status()
-            return response.json()
-    
-    async def get_pair_data(self, pair_id: int) -> Dict[str, Any]:
-        """Получение данных пары"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{self.base_url}/pairs/{pair_id}")
-            response.raise_for_status()
-            return response.json()
-    
-    async def get_mood_history(self, user_id: int, days: int = 30) -> List[Dict[str, Any]]:
-        """Получение истории настроений"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{self.base_url}/mood/history?user_id={user_id}&days={days}")
-            response.raise_for_status()
-            return response.json()
-    
-    async def get_question_answers(self, user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
-        """Получение ответов на вопросы"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{self.base_url}/questions/answers?user_id={user_id}&limit={limit}")
-            response.raise_for_status()
-            return response.json()
-
-
 class GPTService:
     """Основной сервис для работы с GPT задачами"""
     
-    def __init__(self):
+    def __init__(self, data_loader: Optional[GPTDataLoader] = None):
         self.anthropic = AnthropicService()
-        self.internal_api = InternalAPIService()
+        self.data = data_loader or GPTDataLoader()
         
     async def create_task(self, task_type: TaskType, input_data: Dict[str, Any], 
-                         user_id: Optional[int] = None, pair_id: Optional[int] = None) -> GPTTask:
-        """Создание новой GPT задачи"""
+                         user_id: Optional[int] = None, pair_id: Optional[int] = None,
+                         claimed: bool = False) -> GPTTask:
+        """Создание новой GPT задачи.
+        
+        claimed=True — задача для обработки в текущем запросе (process_task /
+        stream_task с claimed=True): вставляется сразу взятой в работу, иначе
+        между коммитом PENDING и захватом её успел бы забрать воркер очереди.
+        """
         db = SessionLocal()
         try:
             task = GPTTask(
@@ -121,8 +231,15 @@ class GPTService:
                 input_data=input_data,
                 user_id=user_id,
                 pair_id=pair_id,
-                status=TaskStatus.PENDING
+                status=TaskStatus.PENDING,
+                max_attempts=settings.GPT_TASK_MAX_ATTEMPTS
             )
+            if claimed:
+                now = datetime.utcnow()
+                task.status = TaskStatus.PROCESSING
+                task.started_at = now
+                task.locked_at = now
+                task.attempts = 1
             db.add(task)
             db.commit()
             db.refresh(task)
@@ -130,38 +247,28 @@ class GPTService:
         finally:
             db.close()
     
-    async def process_task(self, task_id: int) -> AnalysisResponse:
-        """Обработка GPT задачи"""
+    async def process_task(self, task_id: int, claimed: bool = False) -> AnalysisResponse:
+        """Обработка GPT задачи сразу, в текущем запросе (без повторов).
+        
+        claimed=True — задача создана через create_task(claimed=True) и уже взята.
+        """
         db = SessionLocal()
         try:
-            task = db.query(GPTTask).filter(GPTTask.id == task_id).first()
-            if not task:
-                return AnalysisResponse(success=False, error="Task not found")
-            
-            # Обновляем статус
-            task.status = TaskStatus.PROCESSING
-            task.started_at = datetime.utcnow()
-            db.commit()
+            task, error = self._claim(db, task_id, claimed)
+            if error:
+                return AnalysisResponse(success=False, error=error, task_id=task.id if task else None)
             
             start_time = datetime.utcnow()
             
             try:
-                # Обрабатываем задачу в зависимости от типа
-                if task.task_type == TaskType.RELATIONSHIP_ANALYSIS:
-                    result = await self._analyze_relationship(task, db)
-                elif task.task_type == TaskType.MOOD_ANALYSIS:
-                    result = await self._analyze_mood(task, db)
-                elif task.task_type == TaskType.QUESTION_GENERATION:
-                    result = await self._generate_questions(task, db)
-                elif task.task_type == TaskType.FEEDBACK_ANALYSIS:
-                    result = await self._analyze_feedback(task, db)
-                else:
-                    result = await self._custom_analysis(task, db)
+                result = await self.run_task(task, db)
                 
                 # Обновляем результат
                 task.status = TaskStatus.COMPLETED
                 task.result = result
+                task.error_message = None
                 task.completed_at = datetime.utcnow()
+                task.locked_at = None
                 db.commit()
                 
                 processing_time = (datetime.utcnow() - start_time).total_seconds()
@@ -178,6 +285,7 @@ class GPTService:
                 task.status = TaskStatus.FAILED
                 task.error_message = str(e)
                 task.completed_at = datetime.utcnow()
+                task.locked_at = None
                 db.commit()
                 
                 logger.error(f"Task {task_id} failed: {e}")
@@ -190,34 +298,127 @@ class GPTService:
         finally:
             db.close()
     
-    async def _analyze_relationship(self, task: GPTTask, db: Session) -> str:
-        """Анализ отношений пары"""
+    async def stream_task(self, task_id: int, claimed: bool = False) -> AsyncIterator[str]:
+        """Обработка задачи с потоковым ответом: фрагменты текста по мере генерации.
+        
+        Итоговый результат сохраняется в задаче, как у process_task. Ответ из
+        кеша отдаётся одним фрагментом.
+        """
+        db = SessionLocal()
+        try:
+            task, error = self._claim(db, task_id, claimed)
+            if error:
+                raise ValueError(error)
+            chunks = []
+            try:
+                prompt, system_prompt = await self.build_prompt(task, db)
+                use_cache = self._use_cache(task)
+                cached = await self.anthropic.cached(prompt, system_prompt) if use_cache else None
+                if cached is not None:
+                    chunks.append(cached)
+                    yield cached
+                else:
+                    task.anthropic_calls += 1
+                    async for chunk in self.anthropic.stream(prompt, system_prompt, use_cache=use_cache):
+                        chunks.append(chunk)
+                        yield chunk
+            except BaseException as e:
+                # В том числе отключение клиента (отмена генератора)
+                task.status = TaskStatus.FAILED
+                task.error_message = str(e) or e.__class__.__name__
+                task.completed_at = datetime.utcnow()
+                task.locked_at = None
+                db.commit()
+                raise
+            task.status = TaskStatus.COMPLETED
+            task.result = "".join(chunks)
+            task.error_message = None
+            task.completed_at = datetime.utcnow()
+            task.locked_at = None
+            db.commit()
+        finally:
+            db.close()
+    
+    def _claim(self, db: Session, task_id: int, claimed: bool = False) -> Tuple[Optional[GPTTask], Optional[str]]:
+        """Забирает задачу атомарно: её не должен параллельно выполнять воркер"""
+        task = db.query(GPTTask).filter(GPTTask.id == task_id).first()
+        if not task:
+            return None, "Task not found"
+        if claimed:
+            # Вставлена уже взятой (create_task(claimed=True)) — воркер её не трогает
+            return task, None
+        claimed = db.query(GPTTask).filter(
+            GPTTask.id == task_id,
+            GPTTask.status != TaskStatus.PROCESSING
+        ).update({
+            GPTTask.status: TaskStatus.PROCESSING,
+            GPTTask.started_at: datetime.utcnow(),
+            GPTTask.locked_at: datetime.utcnow(),
+            GPTTask.attempts: GPTTask.attempts + 1
+        }, synchronize_session=False)
+        db.commit()
+        if not claimed:
+            return task, "Task is already processing"
+        db.refresh(task)
+        return task, None
+    
+    async def run_task(self, task: GPTTask, db: Session) -> str:
+        """Выполняет задачу по её типу и возвращает результат; статус не меняет"""
+        prompt, system_prompt = await self.build_prompt(task, db)
+        return await self._complete(task, prompt, system_prompt)
+    
+    async def build_prompt(self, task: GPTTask, db: Session) -> Tuple[str, Optional[str]]:
+        """Промпт и системный промпт задачи по её типу"""
+        if task.task_type == TaskType.RELATIONSHIP_ANALYSIS:
+            return await self._relationship_prompt(task, db)
+        elif task.task_type == TaskType.MOOD_ANALYSIS:
+            return await self._mood_prompt(task, db)
+        elif task.task_type == TaskType.QUESTION_GENERATION:
+            return await self._questions_prompt(task, db)
+        elif task.task_type == TaskType.FEEDBACK_ANALYSIS:
+            return await self._feedback_prompt(task, db)
+        else:
+            return await self._custom_prompt(task, db)
+    
+    @staticmethod
+    def _use_cache(task: GPTTask) -> bool:
+        return task.task_type.value not in settings.GPT_CACHE_DISABLED_TASK_TYPES
+    
+    async def _complete(self, task: GPTTask, prompt: str, system_prompt: str = None) -> str:
+        """Запрос к модели для задачи; кеш ответов — если тип задачи не исключён"""
+        result, cached = await self.anthropic.complete(prompt, system_prompt, use_cache=self._use_cache(task))
+        if not cached:
+            task.anthropic_calls += 1
+        return result
+    
+    async def _relationship_prompt(self, task: GPTTask, db: Session) -> Tuple[str, Optional[str]]:
+        """Промпт анализа отношений пары"""
         if not task.pair_id:
             raise ValueError("Pair ID required for relationship analysis")
         
-        # Получаем данные пары
-        pair_data = await self.internal_api.get_pair_data(task.pair_id)
-        task.internal_api_calls += 1
-        
-        # Получаем данные пользователей
-        user1_data = await self.internal_api.get_user_data(pair_data["user1_id"])
-        user2_data = await self.internal_api.get_user_data(pair_data["user2_id"])
-        task.internal_api_calls += 2
-        
-        # Получаем историю настроений
-        user1_moods = await self.internal_api.get_mood_history(user1_data["id"])
-        user2_moods = await self.internal_api.get_mood_history(user2_data["id"])
-        task.internal_api_calls += 2
+        # Снимок контекста пары: настроения по дням, серии, счётчики ответов
+        context = await self.data.relationship_context(task.pair_id)
+        moods = "\n        ".join(context.mood_lines()) or "нет отметок"
+        agreement = (
+            f"совпало {context.tune_matched} из {context.tune_compared} ({context.tune_agreement}%)"
+            if context.tune_agreement is not None else "ещё нет сравнений"
+        )
         
         # Формируем промпт для анализа
         prompt = f"""
         Проанализируй отношения пары на основе следующих данных:
         
-        Пользователь 1: {user1_data['first_name']} {user1_data.get('last_name', '')}
-        Пользователь 2: {user2_data['first_name']} {user2_data.get('last_name', '')}
+        Пользователь 1: {context.user1.full_name}
+        Пользователь 2: {context.user2.full_name}
+        
+        Настроения по дням (пользователь 1 / пользователь 2):
+        {moods}
+        Частота настроений пользователя 1: {context.user1.mood_counts}
+        Частота настроений пользователя 2: {context.user2.mood_counts}
+        Дней подряд, когда настроение отметили оба: {context.mood_streak} (рекорд {context.mood_streak_best})
         
-        История настроений пользователя 1: {user1_moods}
-        История настроений пользователя 2: {user2_moods}
+        Ответов на вопросы дня: пользователь 1 — {context.user1.answered}, пользователь 2 — {context.user2.answered}, оба — {context.both_answered}
+        Сонастройка (угадывание ответов партнёра): {agreement}
         
         Дополнительные данные: {task.input_data}
         
@@ -230,25 +431,23 @@ class GPTService:
         
         system_prompt = "Ты эксперт по отношениям. Анализируй данные объективно и давай конструктивные рекомендации."
         
-        # Вызываем Anthropic API
-        result = await self.anthropic.analyze_text(prompt, system_prompt)
-        task.anthropic_calls += 1
-        
-        return result
+        return prompt, system_prompt
     
-    async def _analyze_mood(self, task: GPTTask, db: Session) -> str:
-        """Анализ настроения пользователя"""
+    async def _mood_prompt(self, task: GPTTask, db: Session) -> Tuple[str, Optional[str]]:
+        """Промпт анализа настроения пользователя"""
         if not task.user_id:
             raise ValueError("User ID required for mood analysis")
         
-        # Получаем историю настроений
-        moods = await self.internal_api.get_mood_history(task.user_id)
-        task.internal_api_calls += 1
+        # Настроения по дням из снимка пары (или за то же окно без пары)
+        user = await self.data.user_context(task.user_id)
+        moods = "\n        ".join(user.mood_lines()) or "нет отметок"
         
         prompt = f"""
         Проанализируй настроение пользователя на основе истории:
         
-        История настроений: {moods}
+        Настроения по дням:
+        {moods}
+        Частота настроений: {user.mood_counts}
         Дополнительные данные: {task.input_data}
         
         Предоставь анализ:
@@ -259,13 +458,10 @@ class GPTService:
         
         system_prompt = "Ты психолог-аналитик. Анализируй настроения и давай полезные рекомендации."
         
-        result = await self.anthropic.analyze_text(prompt, system_prompt)
-        task.anthropic_calls += 1
-        
-        return result
+        return prompt, system_prompt
     
-    async def _generate_questions(self, task: GPTTask, db: Session) -> str:
-        """Генерация вопросов для пары"""
+    async def _questions_prompt(self, task: GPTTask, db: Session) -> Tuple[str, Optional[str]]:
+        """Промпт генерации вопросов для пары"""
         prompt = f"""
         Сгенерируй интересные вопросы для пары на основе данных:
         
@@ -281,13 +477,10 @@ class GPTService:
         
         system_prompt = "Ты эксперт по отношениям. Создавай глубокие, интересные вопросы для пар."
         
-        result = await self.anthropic.analyze_text(prompt, system_prompt)
-        task.anthropic_calls += 1
-        
-        return result
+        return prompt, system_prompt
     
-    async def _analyze_feedback(self, task: GPTTask, db: Session) -> str:
-        """Анализ обратной связи"""
+    async def _feedback_prompt(self, task: GPTTask, db: Session) -> Tuple[str, Optional[str]]:
+        """Промпт анализа обратной связи"""
         prompt = f"""
         Проанализируй обратную связь пользователей:
         
@@ -302,13 +495,10 @@ class GPTService:
         
         system_prompt = "Ты аналитик обратной связи. Выделяй ключевые инсайты и давай actionable рекомендации."
         
-        result = await self.anthropic.analyze_text(prompt, system_prompt)
-        task.anthropic_calls += 1
-        
-        return result
+        return prompt, system_prompt
     
-    async def _custom_analysis(self, task: GPTTask, db: Session) -> str:
-        """Пользовательский анализ"""
+    async def _custom_prompt(self, task: GPTTask, db: Session) -> Tuple[str, Optional[str]]:
+        """Промпт пользовательского анализа"""
         prompt = f"""
         Выполни пользовательский анализ:
         
@@ -317,31 +507,26 @@ class GPTService:
         Опции: {task.input_data.get('options', {})}
         """
         
-        result = await self.anthropic.analyze_text(prompt)
-        task.anthropic_calls += 1
-        
-        return result
+        return prompt, None
     
     async def batch_process(self, requests: List[AnalysisRequest]) -> List[AnalysisResponse]:
-        """Пакетная обработка запросов"""
-        results = []
-        
-        for request in requests:
-            # Создаем задачу
-            task_type = TaskType.CUSTOM_ANALYSIS
-            if request.analysis_type == "relationship":
-                task_type = TaskType.RELATIONSHIP_ANALYSIS
-            elif request.analysis_type == "mood":
-                task_type = TaskType.MOOD_ANALYSIS
-            elif request.analysis_type == "questions":
-                task_type = TaskType.QUESTION_GENERATION
-            elif request.analysis_type == "feedback":
-                task_type = TaskType.FEEDBACK_ANALYSIS
-            
-            task = await self.create_task(task_type, request.data)
-            
-            # Обрабатываем задачу
-            result = await self.process_task(task.id)
-            results.append(result)
+        """Пакетная обработка запросов: параллельно, не больше GPT_WORKER_CONCURRENCY сразу"""
+        semaphore = asyncio.Semaphore(settings.GPT_WORKER_CONCURRENCY)
+        
+        async def process(request: AnalysisRequest) -> AnalysisResponse:
+            async with semaphore:
+                # Задача создаётся уже взятой, когда до неё дошла очередь
+                task = await self.create_task(task_type_for(request.analysis_type), request.data, claimed=True)
+                return await self.process_task(task.id, claimed=True)
         
-        return results
+        return await asyncio.gather(*(process(request) for request in requests))
+
+
+def task_type_for(analysis_type: str) -> TaskType:
+    """Тип задачи по analysis_type запроса (неизвестный — пользовательский анализ)"""
+    return {
+        "relationship": TaskType.RELATIONSHIP_ANALYSIS,
+        "mood": TaskType.MOOD_ANALYSIS,
+        "questions": TaskType.QUESTION_GENERATION,
+        "feedback": TaskType.FEEDBACK_ANALYSIS,
+    }.get(analysis_type, TaskType.CUSTOM_ANALYSIS)
@@ -0,0 +1,105 @@
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models import LLMResponseCache
+
+logger = logging.getLogger(__name__)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def normalize_prompt(text: Optional[str]) -> str:
+    """Промпт без различий в отступах и переносах (f-строки с отступами кода)"""
+    return " ".join((text or "").split())
+
+
+def cache_key(model: str, system_prompt: Optional[str], prompt: str) -> str:
+    payload = "\x1f".join([model, normalize_prompt(system_prompt), normalize_prompt(prompt)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Кеш ответов LLM в таблице llm_response_cache.
+
+    Ключ адресуется содержимым: одинаковые модель, системный промпт и промпт
+    (с точностью до пробелов) дают тот же ответ без платного запроса к API —
+    например, ежедневный анализ пары, у которой данные не менялись. Запись
+    живёт ttl секунд; сверх max_entries вытесняются давно не использованные.
+    Таблица общая для всех процессов, счётчики hits/misses — этого процесса.
+    Ошибки БД не мешают запросу к LLM: кеш просто пропускается.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal, ttl: int = 7 * 24 * 3600,
+                 max_entries: int = 10000):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        try:
+            response = await asyncio.to_thread(self._get, key)
+        except Exception as e:
+            logger.warning(f"⚠️ Кеш LLM недоступен: {e}")
+            response = None
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    async def set(self, key: str, model: str, response: str) -> None:
+        try:
+            await asyncio.to_thread(self._set, key, model, response)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось сохранить ответ LLM в кеш: {e}")
+
+    def _get(self, key: str) -> Optional[str]:
+        table = LLMResponseCache.__table__
+        now = _utcnow()
+        with self.session_factory() as session:
+            response = session.execute(
+                update(table)
+                .where(table.c.key == key, table.c.expires_at > now)
+                .values(hits=table.c.hits + 1, last_hit_at=now)
+                .returning(table.c.response)
+            ).scalar()
+            session.commit()
+            return response
+
+    def _set(self, key: str, model: str, response: str) -> None:
+        table = LLMResponseCache.__table__
+        now = _utcnow()
+        with self.session_factory() as session:
+            if session.get_bind().dialect.name == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            values = {"model": model, "response": response, "created_at": now,
+                      "expires_at": now + timedelta(seconds=self.ttl), "last_hit_at": now}
+            session.execute(
+                insert(table).values(key=key, hits=0, **values)
+                .on_conflict_do_update(index_elements=[table.c.key], set_=values)
+            )
+            # Вытеснение: просроченные и всё, что сверх max_entries
+            session.execute(delete(table).where(table.c.expires_at <= now))
+            overflow = select(table.c.key).order_by(table.c.last_hit_at.desc()).offset(self.max_entries)
+            session.execute(delete(table).where(table.c.key.in_(overflow)))
+            session.commit()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+response_cache = ResponseCache(ttl=settings.GPT_CACHE_TTL_SECONDS, max_entries=settings.GPT_CACHE_MAX_ENTRIES)
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional, Set
+
+import httpx
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.gpt_task import GPTTask, TaskStatus
+from .gpt_service import GPTService
+
+logger = logging.getLogger(__name__)
+
+# HTTP статусы Anthropic API, после которых имеет смысл повторить запрос
+_TRANSIENT_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """Временная ошибка (сеть, таймаут, перегрузка API) — задачу стоит повторить"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in _TRANSIENT_STATUSES
+    return isinstance(exc, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class GPTTaskWorker:
+    """Фоновый воркер очереди gpt_tasks.
+
+    Задачи забираются атомарно (SELECT ... FOR UPDATE SKIP LOCKED, pending →
+    processing): воркеры всех процессов работают с одной таблицей и не берут
+    одну задачу дважды. Одновременно выполняется не больше concurrency задач —
+    этим и настраивается нагрузка на LLM; забирается ровно столько задач,
+    сколько свободных слотов, остальные ждут в pending и достаются другим
+    процессам. Временная ошибка возвращает задачу в pending с экспоненциальной
+    задержкой до max_attempts попыток, прочие ошибки — сразу failed. Задача,
+    зависшая в processing дольше lease_seconds (процесс упал), забирается
+    снова.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        service: Optional[GPTService] = None,
+        concurrency: int = 4,
+        poll_interval: float = 10.0,
+        lease_seconds: int = 600,
+        retry_base: float = 30.0,
+    ):
+        self.session_factory = session_factory
+        self.service = service
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.retry_base = retry_base
+        self._running: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def _get_service(self) -> GPTService:
+        if self.service is None:
+            self.service = GPTService()
+        return self.service
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает опрос и ждёт выполняющиеся задачи"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+        self._wakeup = None
+
+    def wake(self) -> None:
+        """Будит воркер после создания задач (иначе — ближайший опрос)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            free = self.concurrency - len(self._running)
+            if free > 0:
+                claimed: List[int] = []
+                try:
+                    claimed = await asyncio.to_thread(self._claim, free)
+                    for task_id in claimed:
+                        self._spawn(task_id)
+                except Exception as e:
+                    logger.error(f"❌ GPT worker: {e}")
+                if len(self._running) >= self.concurrency:
+                    # Все слоты заняты: ждём завершения любой задачи
+                    await asyncio.wait(self._running, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                if len(claimed) == free:
+                    # Пока шёл захват, освободились ещё слоты, а очередь может быть не пуста
+                    continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _spawn(self, task_id: int) -> None:
+        task = asyncio.create_task(self._execute(task_id))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def process_batch(self) -> int:
+        """Забирает до concurrency задач и выполняет их. Возвращает число задач."""
+        claimed = await asyncio.to_thread(self._claim, self.concurrency)
+        await asyncio.gather(*(self._execute(task_id) for task_id in claimed))
+        return len(claimed)
+
+    def _claim(self, limit: int) -> List[int]:
+        session = self.session_factory()
+        try:
+            now = _utcnow()
+            tasks = session.query(GPTTask).filter(or_(
+                and_(
+                    GPTTask.status == TaskStatus.PENDING,
+                    or_(GPTTask.available_at.is_(None), GPTTask.available_at <= now),
+                ),
+                and_(
+                    GPTTask.status == TaskStatus.PROCESSING,
+                    GPTTask.locked_at < now - timedelta(seconds=self.lease_seconds),
+                ),
+            )).order_by(GPTTask.id).limit(limit).with_for_update(skip_locked=True).all()
+
+            claimed = []
+            for task in tasks:
+                if task.status == TaskStatus.PROCESSING:
+                    logger.warning(f"⚠️ GPT задача {task.id} зависла в processing, забираем снова")
+                if task.attempts >= task.max_attempts:
+                    # Зависла на последней попытке — больше не пробуем
+                    task.status = TaskStatus.FAILED
+                    task.error_message = task.error_message or "lease expired"
+                    task.completed_at = datetime.now(timezone.utc)
+                    task.locked_at = None
+                    continue
+                task.status = TaskStatus.PROCESSING
+                task.started_at = datetime.now(timezone.utc)
+                task.locked_at = now
+                task.attempts += 1
+                claimed.append(task.id)
+            session.commit()
+            return claimed
+        finally:
+            session.close()
+
+    async def _execute(self, task_id: int) -> None:
+        db = self.session_factory()
+        try:
+            task = db.get(GPTTask, task_id)
+            if task is None:
+                return
+            try:
+                result = await self._get_service().run_task(task, db)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._fail(task, e)
+            else:
+                task.status = TaskStatus.COMPLETED
+                task.result = result
+                task.error_message = None
+                task.completed_at = datetime.now(timezone.utc)
+                task.locked_at = None
+            db.commit()
+        except Exception as e:
+            logger.error(f"❌ GPT задача {task_id}: не удалось сохранить результат: {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+    def _fail(self, task: GPTTask, exc: Exception) -> None:
+        task.error_message = str(exc) or exc.__class__.__name__
+        task.locked_at = None
+        if is_transient_error(exc) and task.attempts < task.max_attempts:
+            delay = min(self.retry_base * 2 ** (task.attempts - 1), 3600)
+            task.status = TaskStatus.PENDING
+            task.available_at = _utcnow() + timedelta(seconds=delay)
+            logger.warning(f"⚠️ GPT задача {task.id}: {exc}, повтор через {delay:.0f} с")
+        else:
+            task.status = TaskStatus.FAILED
+            task.completed_at = datetime.now(timezone.utc)
+            logger.error(f"❌ GPT задача {task.id} не выполнена за {task.attempts} попыток: {exc}")
+
+
+gpt_task_worker = GPTTaskWorker(
+    concurrency=settings.GPT_WORKER_CONCURRENCY,
+    poll_interval=settings.GPT_WORKER_POLL_INTERVAL,
+    lease_seconds=settings.GPT_TASK_LEASE_SECONDS,
+    retry_base=settings.GPT_TASK_RETRY_BASE,
+)
@@ -1,21 +1,21 @@
 import os
 import logging
-import fnmatch
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi import FastAPI
 
 from app.core.config import settings
 from app.api.api_v1.api import api_router
 from app.core.database import engine
 from app.models import Base
-from app.middleware.security import RateLimitMiddleware, SecurityHeadersMiddleware, TelegramValidationMiddleware, ProxyHeadersMiddleware, TelegramIdMiddleware
-from app.middleware.usage_analytics import UsageAnalyticsMiddleware
-from app.middleware.internal_api import InternalAPIMiddleware
+from app.middleware.stack import setup_middlewares
+from app.services.analytics_buffer import analytics_buffer
 from app.notifications import rules as _notification_rules  # noqa: F401
 from app.notifications.engine import NotificationEngine
+from app.notifications.events import event_bus
 from app.services.scheduler import scheduler
+from app.services.outbox import outbox_worker
+from app.gpt.services.task_worker import gpt_task_worker
+from app.gpt.services.gpt_service import anthropic_client
+from app.services.telegram import telegram_client
 
 # Информация о билде
 BUILD_DATE = os.getenv("BUILD_DATE", "unknown")
@@ -26,38 +26,6 @@ BUILD_MARKER = os.getenv("BUILD_MARKER", "unknown")
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Кастомный middleware для проверки хостов с поддержкой wildcards
-class CustomTrustedHostMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app, allowed_hosts):
-        super().__init__(app)
-        self.allowed_hosts = allowed_hosts
-
-    async def dispatch(self, request: Request, call_next):
-        host = request.headers.get("host", "")
-        
-        # Проверяем разрешенные хосты
-        if self._is_host_allowed(host):
-            return await call_next(request)
-        
-        # Логируем отклоненный хост для отладки
-        logger.warning(f"Host not allowed: {host}")
-        raise HTTPException(status_code=400, detail="Invalid host header")
-    
-    def _is_host_allowed(self, host: str) -> bool:
-        for allowed_host in self.allowed_hosts:
-            # Убираем протокол из allowed_host если есть
-            clean_allowed = allowed_host.replace("https://", "").replace("http://", "")
-            
-            # Проверка с wildcards
-            if fnmatch.fnmatch(host, clean_allowed):
-                return True
-            
-            # Точное совпадение
-            if host == clean_allowed:
-                return True
-        
-        return False
-
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
@@ -68,31 +36,8 @@ app = FastAPI(
     openapi_url=f"{settings.API_V1_STR}/openapi.json"
 )
 
-# Настройка для работы за прокси (nginx) - кастомный middleware с поддержкой wildcards
-app.add_middleware(
-    CustomTrustedHostMiddleware,
-    allowed_hosts=settings.ALLOWED_HOSTS
-)
-
-# Set up CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=settings.ALLOWED_HOSTS,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Trusted hosts middleware уже добавлен выше
-
-# Security middlewares (порядок важен!)
-app.add_middleware(SecurityHeadersMiddleware)
-app.add_middleware(ProxyHeadersMiddleware)  # Первым - для правильного получения IP
-app.add_middleware(InternalAPIMiddleware)  # Защита внутренних API
-app.add_middleware(RateLimitMiddleware, calls=100, period=60)  # 100 запросов в минуту
-app.add_middleware(TelegramValidationMiddleware)
-app.add_middleware(UsageAnalyticsMiddleware)  # Должен быть после TelegramIdMiddleware
-app.add_middleware(TelegramIdMiddleware)  # Устанавливает telegram_id в request.state (выполняется первым)
+# Middleware: проверка хоста, CORS, безопасность, аналитика
+setup_middlewares(app)
 
 # Include API router
 app.include_router(api_router, prefix=settings.API_V1_STR)
@@ -101,7 +46,6 @@ app.include_router(api_router, prefix=settings.API_V1_STR)
 async def startup_event():
     """Событие при запуске приложения"""
     from datetime import datetime, timezone
-    from app.notifications.base import iter_rules
     
     logger.info(f"🚀 Пульс ваших отношений Backend запущен!")
     logger.info(f"📦 Build ID: {BUILD_ID}")
@@ -115,32 +59,23 @@ async def startup_event():
     logger.info(f"   UTC: {now_utc.strftime('%Y-%m-%d %H:%M:%S')}")
     logger.info(f"   MSK: {now_msk.strftime('%Y-%m-%d %H:%M:%S')}")
     
-    # Логирование расписания уведомлений
-    logger.info(f"📅 Расписание уведомлений:")
-    scheduled_rules = list(iter_rules("schedule"))
-    for rule in scheduled_rules:
-        utc_time = rule.trigger.cron
-        # Парсим cron для получения времени
-        parts = utc_time.split()
-        if len(parts) >= 2:
-            minute, hour = parts[0], parts[1]
-            if hour != "*":
-                hour_utc = int(hour)
-                hour_msk = hour_utc + 3  # MSK = UTC + 3
-                logger.info(f"   {rule.id}: {hour_msk:02d}:{minute} MSK ({hour_utc:02d}:{minute} UTC)")
-            else:
-                logger.info(f"   {rule.id}: {utc_time} (каждый час)")
-        else:
-            logger.info(f"   {rule.id}: {utc_time}")
+    # Фоновая пакетная запись событий аналитики
+    await analytics_buffer.start()
     
-    logger.info(f"⏰ Планировщик запускается каждый час в :00 (03:00 MSK)")
+    # Воркеры доставки уведомлений из outbox
+    await outbox_worker.start()
     
-    # Аналитика на Postgres не требует специальной инициализации
+    # Воркер очереди GPT задач
+    await gpt_task_worker.start()
     
     # Инициализация движка уведомлений (правила регистрируются при импорте)
     app.state.notification_engine = NotificationEngine()
     
+    # Фоновый потребитель событий (правила с EventTrigger)
+    await event_bus.start(app.state.notification_engine)
+    
     # Запуск планировщика уведомлений
+    # (задачи выполняет только процесс-лидер, см. NotificationScheduler)
     scheduler.start(app.state.notification_engine)
 
 
@@ -148,7 +83,13 @@ async def startup_event():
 async def shutdown_event():
     """Событие при завершении работы приложения"""
     logger.info("🛑 Завершение работы приложения...")
-    scheduler.stop()
+    await scheduler.stop()
+    await event_bus.stop()
+    await outbox_worker.stop()
+    await gpt_task_worker.stop()
+    await analytics_buffer.stop()
+    await telegram_client.aclose()
+    await anthropic_client.aclose()
 
 
 @app.get("/")
@@ -1,19 +1,20 @@
 import logging
-from fastapi import Request, HTTPException, status
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
+from fastapi import status
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 logger = logging.getLogger(__name__)
 
 
-class InternalAPIMiddleware(BaseHTTPMiddleware):
+class InternalAPIMiddleware:
     """
     Middleware для защиты внутренних API от внешнего доступа.
     Разрешает доступ только с локальных адресов и внутренних сетей.
     """
     
-    def __init__(self, app, allowed_networks=None):
-        super().__init__(app)
+    def __init__(self, app: ASGIApp, allowed_networks=None):
+        self.app = app
         self.allowed_networks = allowed_networks or [
             "127.0.0.1",      # localhost
             "::1",            # localhost IPv6
@@ -24,37 +25,40 @@ class InternalAPIMiddleware(BaseHTTPMiddleware):
             "172.18.",        # Docker compose
         ]
     
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         # Проверяем, является ли это внутренним API
-        if request.url.path.startswith("/api/v1/internal"):
-            client_ip = self._get_client_ip(request)
+        if scope["type"] == "http" and scope["path"].startswith("/api/v1/internal"):
+            client_ip = self._get_client_ip(scope)
             
             if not self._is_ip_allowed(client_ip):
                 logger.warning(f"Попытка доступа к внутреннему API с неразрешенного IP: {client_ip}")
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="Доступ к внутреннему API запрещен"
+                response = JSONResponse(
+                    {"detail": "Доступ к внутреннему API запрещен"},
+                    status_code=status.HTTP_403_FORBIDDEN
                 )
+                await response(scope, receive, send)
+                return
             
             logger.info(f"Доступ к внутреннему API с IP: {client_ip}")
         
-        return await call_next(request)
+        await self.app(scope, receive, send)
     
-    def _get_client_ip(self, request: Request) -> str:
+    def _get_client_ip(self, scope: Scope) -> str:
         """Получает реальный IP клиента с учетом прокси"""
+        headers = Headers(scope=scope)
         # Проверяем заголовки прокси
-        forwarded_for = request.headers.get("X-Forwarded-For")
+        forwarded_for = headers.get("X-Forwarded-For")
         if forwarded_for:
             # Берем первый IP из списка
             return forwarded_for.split(",")[0].strip()
         
-        real_ip = request.headers.get("X-Real-IP")
+        real_ip = headers.get("X-Real-IP")
         if real_ip:
             return real_ip
         
         # Если нет заголовков прокси, используем прямой IP
-        if request.client:
-            return request.client.host
+        if scope.get("client"):
+            return scope["client"][0]
         
         return "unknown"
     
@@ -1,86 +1,22 @@
-import hashlib
-import hmac
 import json
+import math
 import time
-from typing import Dict, Optional
+from typing import Optional
 from urllib.parse import parse_qsl
-from fastapi import Request, HTTPException, status
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
+from fastapi import status
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 import logging
 
 from app.core.config import settings
+from app.core.rate_limit import MemoryRateLimitBackend, RateLimitBackend
+from app.services.auth import cached_telegram_id
 
 logger = logging.getLogger(__name__)
 
 
-def verify_telegram_webapp_data(init_data: str) -> dict:
-    """Проверяет подпись данных от Telegram Web App"""
-    try:
-        # Разбираем init_data (URL-decoded пары key=value)
-        pairs = dict(parse_qsl(init_data, keep_blank_values=True))
-        data_dict = dict(pairs)
-        
-        # Проверяем время подписи (не старше 60 минут)
-        auth_date = data_dict.get('auth_date')
-        if auth_date:
-            try:
-                auth_timestamp = int(auth_date)
-                if time.time() - auth_timestamp > 3600:  # 60 минут
-                    raise HTTPException(
-                        status_code=status.HTTP_401_UNAUTHORIZED,
-                        detail="Данные аутентификации устарели"
-                    )
-            except ValueError:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Неверный формат времени аутентификации"
-                )
-        
-        # Убираем hash из данных для проверки
-        data_check_string = '\n'.join(
-            f"{k}={pairs[k]}" for k in sorted(pairs.keys()) if k != 'hash'
-        )
-        
-        # Получаем секретный ключ бота
-        bot_token = settings.TELEGRAM_BOT_TOKEN
-        if not bot_token:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Bot token не настроен"
-            )
-        
-        # Вычисляем секретный ключ
-        secret_key = hmac.new(
-            "WebAppData".encode(),
-            bot_token.encode(),
-            hashlib.sha256
-        ).digest()
-        
-        # Проверяем подпись
-        data_hash = hmac.new(
-            secret_key,
-            data_check_string.encode(),
-            hashlib.sha256
-        ).hexdigest()
-        
-        if data_hash != data_dict.get('hash'):
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Неверная подпись данных"
-            )
-        
-        return data_dict
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error verifying Telegram data: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Ошибка проверки данных Telegram"
-        )
-
-
 def extract_telegram_id_from_data(init_data: str) -> Optional[int]:
     """Извлекает telegram_id из данных Telegram без полной валидации"""
     try:
@@ -109,177 +45,197 @@ def extract_telegram_id_from_data(init_data: str) -> Optional[int]:
         return None
 
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    """Middleware для ограничения количества запросов"""
+def _error_response(status_code: int, detail: str) -> JSONResponse:
+    """Ответ в формате HTTPException FastAPI"""
+    return JSONResponse({"detail": detail}, status_code=status_code)
+
+
+class RateLimitMiddleware:
+    """Middleware для ограничения количества запросов (GCRA: calls запросов за period секунд).
+
+    Ключ — IP клиента или, при key="telegram_id", проверенный telegram_id
+    (пока initData не проверена, используется IP). Состояние хранится в
+    backend: в памяти процесса или в общей БД для нескольких воркеров.
+    """
     
-    def __init__(self, app, calls: int = 100, period: int = 60):
-        super().__init__(app)
+    def __init__(
+        self,
+        app: ASGIApp,
+        calls: int = 100,
+        period: int = 60,
+        backend: Optional[RateLimitBackend] = None,
+        key: str = "ip",
+    ):
+        self.app = app
         self.calls = calls  # Максимум запросов
         self.period = period  # Период в секундах
-        self.clients: Dict[str, Dict] = {}
+        self.backend = backend or MemoryRateLimitBackend()
+        self.key = key
     
-    async def dispatch(self, request: Request, call_next):
-        # Получаем IP клиента
-        client_ip = request.client.host
-        current_time = time.time()
-        
-        # Очищаем старые записи
-        self.cleanup_old_entries(current_time)
-        
-        # Проверяем лимит для клиента
-        if client_ip not in self.clients:
-            self.clients[client_ip] = {
-                'requests': [],
-                'blocked_until': 0
-            }
-        
-        client_data = self.clients[client_ip]
-        
-        # Проверяем, не заблокирован ли клиент
-        if current_time < client_data['blocked_until']:
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="Слишком много запросов. Попробуйте позже."
-            )
-        
-        # Фильтруем запросы за последний период
-        recent_requests = [
-            req_time for req_time in client_data['requests']
-            if current_time - req_time < self.period
-        ]
-        
-        # Проверяем лимит
-        if len(recent_requests) >= self.calls:
-            # Блокируем клиента на период
-            client_data['blocked_until'] = current_time + self.period
-            logger.warning(f"Rate limit exceeded for IP: {client_ip}")
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail=f"Превышен лимит запросов ({self.calls} за {self.period} сек)"
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        key = self._client_key(scope)
+        now = time.time()
+        if self.backend.blocking:
+            retry_after = await run_in_threadpool(self.backend.acquire, key, self.calls, self.period, now)
+        else:
+            retry_after = self.backend.acquire(key, self.calls, self.period, now)
+
+        if retry_after > 0:
+            logger.warning(f"Rate limit exceeded for {key}")
+            response = _error_response(
+                status.HTTP_429_TOO_MANY_REQUESTS,
+                f"Превышен лимит запросов ({self.calls} за {self.period} сек)"
             )
-        
-        # Добавляем текущий запрос
-        recent_requests.append(current_time)
-        client_data['requests'] = recent_requests
-        
-        response = await call_next(request)
-        return response
-    
-    def cleanup_old_entries(self, current_time: float):
-        """Удаляем старые записи для экономии памяти"""
-        for client_ip in list(self.clients.keys()):
-            client_data = self.clients[client_ip]
-            
-            # Удаляем старые запросы
-            client_data['requests'] = [
-                req_time for req_time in client_data['requests']
-                if current_time - req_time < self.period * 2
-            ]
-            
-            # Удаляем клиента если нет активности
-            if (not client_data['requests'] and 
-                current_time > client_data['blocked_until']):
-                del self.clients[client_ip]
+            response.headers["Retry-After"] = str(math.ceil(retry_after))
+            await response(scope, receive, send)
+            return
+        
+        await self.app(scope, receive, send)
+
+    def _client_key(self, scope: Scope) -> str:
+        if self.key == "telegram_id":
+            init_data = Headers(scope=scope).get("X-Telegram-Init-Data")
+            # Только проверенный id: непроверенным клиент мог бы подменять ключ
+            telegram_id = cached_telegram_id(init_data) if init_data else None
+            if telegram_id:
+                return f"tg:{telegram_id}"
+        # Получаем IP клиента
+        client = scope.get("client")
+        return f"ip:{client[0] if client else 'unknown'}"
+
+
+CONTENT_SECURITY_POLICY = (
+    "default-src 'self'; "
+    "script-src 'self' 'unsafe-inline' https://telegram.org; "
+    "style-src 'self' 'unsafe-inline'; "
+    "img-src 'self' data: https:; "
+    "connect-src 'self' https://api.telegram.org"
+)
 
 
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
+class SecurityHeadersMiddleware:
     """Middleware для добавления заголовков безопасности"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
     
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
-        
-        # Добавляем заголовки безопасности
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
         # HSTS только если запрос пришел через HTTPS (проверяем заголовок от nginx)
-        if request.headers.get("x-forwarded-proto") == "https":
-            response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        response.headers["Content-Security-Policy"] = (
-            "default-src 'self'; "
-            "script-src 'self' 'unsafe-inline' https://telegram.org; "
-            "style-src 'self' 'unsafe-inline'; "
-            "img-src 'self' data: https:; "
-            "connect-src 'self' https://api.telegram.org"
-        )
-        
-        return response
+        https = Headers(scope=scope).get("x-forwarded-proto") == "https"
 
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                # Добавляем заголовки безопасности
+                headers = MutableHeaders(scope=message)
+                headers["X-Content-Type-Options"] = "nosniff"
+                headers["X-Frame-Options"] = "DENY"
+                headers["X-XSS-Protection"] = "1; mode=block"
+                if https:
+                    headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
+                headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
+                headers["Content-Security-Policy"] = CONTENT_SECURITY_POLICY
+            await send(message)
 
-class ProxyHeadersMiddleware(BaseHTTPMiddleware):
+        await self.app(scope, receive, send_with_headers)
+
+
+class ProxyHeadersMiddleware:
     """Middleware для обработки заголовков от nginx прокси"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
     
-    async def dispatch(self, request: Request, call_next):
-        # Получаем реальный IP из заголовков nginx
-        forwarded_for = request.headers.get("x-forwarded-for")
-        if forwarded_for:
-            # Берем первый IP (реальный клиент)
-            real_ip = forwarded_for.split(",")[0].strip()
-            # Обновляем информацию о клиенте
-            request.scope["client"] = (real_ip, 0)
-        
-        # Обрабатываем протокол
-        forwarded_proto = request.headers.get("x-forwarded-proto")
-        if forwarded_proto:
-            request.scope["scheme"] = forwarded_proto
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            headers = Headers(scope=scope)
+
+            # Получаем реальный IP из заголовков nginx
+            forwarded_for = headers.get("x-forwarded-for")
+            if forwarded_for:
+                # Берем первый IP (реальный клиент)
+                real_ip = forwarded_for.split(",")[0].strip()
+                # Обновляем информацию о клиенте
+                scope["client"] = (real_ip, 0)
+            
+            # Обрабатываем протокол
+            forwarded_proto = headers.get("x-forwarded-proto")
+            if forwarded_proto:
+                scope["scheme"] = forwarded_proto
         
-        response = await call_next(request)
-        return response
+        await self.app(scope, receive, send)
 
 
-class TelegramValidationMiddleware(BaseHTTPMiddleware):
+class TelegramValidationMiddleware:
     """Middleware для дополнительной валидации Telegram запросов"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
     
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         # Проверяем только API эндпоинты
-        if request.url.path.startswith("/api/"):
+        if scope["type"] == "http" and scope["path"].startswith("/api/"):
             # Проверяем наличие Telegram заголовков
-            telegram_data = request.headers.get("X-Telegram-Init-Data")
+            telegram_data = Headers(scope=scope).get("X-Telegram-Init-Data")
             if telegram_data:
                 # Дополнительные проверки
                 if len(telegram_data) > 4096:  # Максимальный размер
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail="Данные Telegram слишком большие"
+                    response = _error_response(
+                        status.HTTP_400_BAD_REQUEST,
+                        "Данные Telegram слишком большие"
                     )
+                    await response(scope, receive, send)
+                    return
                 
                 # Проверяем на подозрительные символы
                 if any(char in telegram_data for char in ['<', '>', '"', "'"]):
-                    logger.warning(f"Suspicious characters in Telegram data from {request.client.host}")
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail="Некорректные данные"
-                    )
+                    client = scope.get("client")
+                    logger.warning(f"Suspicious characters in Telegram data from {client[0] if client else 'unknown'}")
+                    response = _error_response(status.HTTP_400_BAD_REQUEST, "Некорректные данные")
+                    await response(scope, receive, send)
+                    return
         
-        response = await call_next(request)
-        return response
+        await self.app(scope, receive, send)
 
 
-class TelegramIdMiddleware(BaseHTTPMiddleware):
+class TelegramIdMiddleware:
     """Middleware для установки telegram_id в request.state"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
     
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
         # Проверяем только API эндпоинты
-        if request.url.path.startswith("/api/"):
+        if path.startswith("/api/"):
             # Получаем данные Telegram
-            telegram_data = request.headers.get("X-Telegram-Init-Data")
+            telegram_data = Headers(scope=scope).get("X-Telegram-Init-Data")
             if telegram_data:
                 try:
-                    # Извлекаем telegram_id без полной валидации
-                    telegram_id = extract_telegram_id_from_data(telegram_data)
+                    # Берём telegram_id из кеша проверенных initData, иначе извлекаем без полной валидации
+                    telegram_id = cached_telegram_id(telegram_data) or extract_telegram_id_from_data(telegram_data)
                     if telegram_id:
                         # Устанавливаем telegram_id в request.state
-                        request.state.telegram_id = telegram_id
-                        logger.info(f"✅ TelegramIdMiddleware: Set telegram_id {telegram_id} in request.state for {request.url.path}")
+                        scope.setdefault("state", {})["telegram_id"] = telegram_id
+                        logger.info(f"✅ TelegramIdMiddleware: Set telegram_id {telegram_id} in request.state for {path}")
                     else:
                         logger.warning(f"⚠️ TelegramIdMiddleware: Failed to extract telegram_id from data: {telegram_data[:100]}...")
                 except Exception as e:
                     logger.warning(f"❌ TelegramIdMiddleware: Failed to extract telegram_id: {e}")
             else:
-                logger.debug(f"ℹ️ TelegramIdMiddleware: No X-Telegram-Init-Data header for {request.url.path}")
+                logger.debug(f"ℹ️ TelegramIdMiddleware: No X-Telegram-Init-Data header for {path}")
         else:
-            logger.debug(f"ℹ️ TelegramIdMiddleware: Skipping non-API path {request.url.path}")
+            logger.debug(f"ℹ️ TelegramIdMiddleware: Skipping non-API path {path}")
         
-        response = await call_next(request)
-        return response
+        await self.app(scope, receive, send)
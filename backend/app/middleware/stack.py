@@ -0,0 +1,83 @@
+import logging
+from typing import Iterable, Optional
+
+from fastapi import FastAPI
+
+from app.core.config import settings
+from app.core.rate_limit import create_rate_limit_backend
+from app.middleware.internal_api import InternalAPIMiddleware
+from app.middleware.security import (
+    ProxyHeadersMiddleware,
+    RateLimitMiddleware,
+    SecurityHeadersMiddleware,
+    TelegramIdMiddleware,
+    TelegramValidationMiddleware,
+)
+from app.middleware.trusted_host import AllowListCORSMiddleware, CustomTrustedHostMiddleware
+from app.middleware.usage_analytics import UsageAnalyticsMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Имена слоёв для DISABLED_MIDDLEWARES, в порядке подключения.
+# Starlette вызывает middleware в обратном порядке: последний добавленный — внешний.
+MIDDLEWARE_NAMES = (
+    "trusted_host",
+    "cors",
+    "security_headers",
+    "proxy_headers",
+    "internal_api",
+    "rate_limit",
+    "telegram_validation",
+    "usage_analytics",
+    "telegram_id",
+)
+
+
+def setup_middlewares(app: FastAPI, disabled: Optional[Iterable[str]] = None) -> None:
+    """Подключает стек middleware приложения.
+
+    Все слои — чистые ASGI-классы (без BaseHTTPMiddleware), поэтому запрос
+    проходит стек без лишних задач и обёрток ответа. Отдельные слои можно
+    отключить по имени через настройку DISABLED_MIDDLEWARES.
+    """
+    disabled = set(settings.DISABLED_MIDDLEWARES if disabled is None else disabled)
+    unknown = disabled - set(MIDDLEWARE_NAMES)
+    if unknown:
+        logger.warning(f"Неизвестные middleware в DISABLED_MIDDLEWARES: {sorted(unknown)}")
+
+    def add(name: str, middleware_class, **options) -> None:
+        if name in disabled:
+            logger.warning(f"Middleware {name} отключён настройками")
+            return
+        app.add_middleware(middleware_class, **options)
+
+    # Настройка для работы за прокси (nginx) - кастомный middleware с поддержкой wildcards
+    add("trusted_host", CustomTrustedHostMiddleware, allowed_hosts=settings.ALLOWED_HOSTS)
+
+    # Set up CORS
+    add(
+        "cors",
+        AllowListCORSMiddleware,
+        allow_origins=settings.ALLOWED_HOSTS,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor"],  # Курсор истории вопросов
+    )
+
+    # Security middlewares (порядок важен!)
+    add("security_headers", SecurityHeadersMiddleware)
+    add("proxy_headers", ProxyHeadersMiddleware)  # Первым - для правильного получения IP
+    add("internal_api", InternalAPIMiddleware)  # Защита внутренних API
+    if "rate_limit" not in disabled:
+        add(
+            "rate_limit",
+            RateLimitMiddleware,
+            calls=settings.RATE_LIMIT_CALLS,
+            period=settings.RATE_LIMIT_PERIOD,
+            backend=create_rate_limit_backend(settings.RATE_LIMIT_STORAGE_URL),
+            key=settings.RATE_LIMIT_KEY,
+        )
+    add("telegram_validation", TelegramValidationMiddleware)
+    add("usage_analytics", UsageAnalyticsMiddleware)  # Должен быть после TelegramIdMiddleware
+    add("telegram_id", TelegramIdMiddleware)  # Устанавливает telegram_id в request.state (выполняется первым)
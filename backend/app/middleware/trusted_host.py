@@ -0,0 +1,90 @@
+import fnmatch
+import logging
+import re
+from functools import lru_cache
+from typing import Iterable
+
+from starlette.datastructures import Headers
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+WILDCARD_CHARS = ("*", "?", "[")
+
+
+class HostMatcher:
+    """Список разрешённых хостов, скомпилированный один раз.
+
+    Шаблоны без wildcards попадают в множество точных значений, остальные —
+    в одно объединённое регулярное выражение (семантика fnmatch). Вердикты
+    по конкретным значениям кешируются в LRU.
+    """
+
+    def __init__(self, patterns: Iterable[str], cache_size: int = 1024):
+        exact = set()
+        wildcard = []
+        for pattern in patterns:
+            # Убираем протокол из шаблона если есть
+            pattern = pattern.replace("https://", "").replace("http://", "")
+            if any(char in pattern for char in WILDCARD_CHARS):
+                wildcard.append(fnmatch.translate(pattern))
+            else:
+                exact.add(pattern)
+        self.exact = frozenset(exact)
+        self.regex = re.compile("|".join(wildcard)) if wildcard else None
+        self.matches = lru_cache(maxsize=cache_size)(self._matches)
+
+    def _matches(self, value: str) -> bool:
+        if value in self.exact:
+            return True
+        return self.regex is not None and self.regex.match(value) is not None
+
+
+class CustomTrustedHostMiddleware:
+    """Проверка заголовка Host по списку разрешённых хостов с поддержкой wildcards"""
+
+    def __init__(self, app: ASGIApp, allowed_hosts):
+        self.app = app
+        self.allowed_hosts = allowed_hosts
+        self.matcher = HostMatcher(allowed_hosts)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        host = Headers(scope=scope).get("host", "")
+        
+        # Проверяем разрешенные хосты
+        if self.matcher.matches(host):
+            await self.app(scope, receive, send)
+            return
+        
+        # Логируем отклоненный хост для отладки
+        logger.warning(f"Host not allowed: {host}")
+        response = JSONResponse({"detail": "Invalid host header"}, status_code=400)
+        await response(scope, receive, send)
+
+
+class AllowListCORSMiddleware(CORSMiddleware):
+    """CORS с проверкой Origin по множеству разрешённых источников.
+
+    Origin сравнивается только на точное совпадение (вместе с протоколом), как
+    в стандартном CORSMiddleware: шаблоны с wildcards из ALLOWED_HOSTS
+    рассчитаны на заголовок Host и для CORS не действуют. Отличие лишь в
+    поиске по frozenset вместо перебора списка.
+    """
+
+    def __init__(self, app: ASGIApp, allow_origins: Iterable[str] = (), **options):
+        allow_origins = list(allow_origins)
+        super().__init__(app, allow_origins=allow_origins, **options)
+        self.exact_origins = frozenset(allow_origins)
+
+    def is_allowed_origin(self, origin: str) -> bool:
+        if self.allow_all_origins:
+            return True
+        if self.allow_origin_regex is not None and self.allow_origin_regex.fullmatch(origin):
+            return True
+        return origin in self.exact_origins
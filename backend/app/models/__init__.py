@@ -1,7 +1,7 @@
 from app.core.database import Base
 from .user import User
-from .pair import Pair, PairInvite
-from .question import Question, UserAnswer, UserQuestionStatus, PairDailyQuestion, QuestionNotification
+from .pair import Pair, PairInvite, PairContextSnapshot
+from .question import Question, UserAnswer, UserQuestionStatus, PairDailyQuestion, QuestionNotification, PairQuestionStats
 from .mood import Mood, Appreciation
 from .ritual import Ritual, RitualCheck
 from .calendar import CalendarEvent
@@ -11,20 +11,23 @@ from .invitation import Invitation
 from .feedback import Feedback, FeedbackType, FeedbackStatus
 from .tune import PairDailyTuneQuestion, TuneAnswer, TuneQuizQuestion, TuneQuestionType, TuneNotification
 from .analytics import UsageEvent
-from .notification import Notification
+from .notification import Notification, NotificationOutbox, OutboxStatus
 from .announcement import Announcement
-from .gpt_task import GPTTask, TaskStatus, TaskType
+from .gpt_task import GPTTask, TaskStatus, TaskType, LLMResponseCache
+from .scheduler_lease import SchedulerLease
 
 __all__ = [
     "Base",
     "User",
     "Pair", 
     "PairInvite",
+    "PairContextSnapshot",
     "Question",
     "UserAnswer",
     "UserQuestionStatus",
     "PairDailyQuestion",
     "QuestionNotification",
+    "PairQuestionStats",
     "Mood",
     "Appreciation",
     "Ritual",
@@ -46,8 +49,12 @@ __all__ = [
     "TuneNotification",
     "UsageEvent",
     "Notification",
+    "NotificationOutbox",
+    "OutboxStatus",
     "Announcement",
     "GPTTask",
     "TaskStatus",
-    "TaskType"
+    "TaskType",
+    "LLMResponseCache",
+    "SchedulerLease"
 ]
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, BigInteger, DateTime
+from sqlalchemy import Column, Integer, String, BigInteger, DateTime, Index
 
 from app.core.database import Base
 
@@ -14,6 +14,11 @@ class UsageEvent(Base):
 	duration_ms = Column(Integer, nullable=False)
 	telegram_id = Column(BigInteger, nullable=True, index=True)
 
+	__table_args__ = (
+		# Проверка недавней активности пользователей при выборе получателей уведомлений
+		Index('ix_usage_events_telegram_ts', 'telegram_id', 'ts'),
+	)
+
 	def __repr__(self) -> str:
 		return (
 			f"<UsageEvent(id={self.id}, ts={self.ts}, method='{self.method}', route='{self.route}', "
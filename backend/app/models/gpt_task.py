@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, JSON, Text, Enum
+from sqlalchemy import Column, Integer, String, DateTime, JSON, Text, Enum, Index
 from sqlalchemy.sql import func
 from enum import Enum as PyEnum
 
@@ -46,6 +46,37 @@ class GPTTask(Base):
     # Внешние API вызовы
     anthropic_calls = Column(Integer, default=0)
     internal_api_calls = Column(Integer, default=0)
+
+    # Очередь воркера: повторы и аренда задачи в processing
+    attempts = Column(Integer, nullable=False, default=0, server_default='0')
+    max_attempts = Column(Integer, nullable=False, default=3, server_default='3')
+    available_at = Column(DateTime, nullable=True)  # naive UTC, NULL — сразу; отложенный повтор
+    locked_at = Column(DateTime, nullable=True)  # naive UTC, когда воркер взял задачу
+
+    __table_args__ = (
+        Index('ix_gpt_tasks_claim', 'status', 'available_at'),
+    )
     
     def __repr__(self):
         return f"<GPTTask(id={self.id}, type={self.task_type}, status={self.status})>"
+
+
+class LLMResponseCache(Base):
+    """Кеш ответов LLM: ключ — sha256 от модели, системного и нормализованного промпта"""
+    __tablename__ = "llm_response_cache"
+
+    key = Column(String(64), primary_key=True)
+    model = Column(String, nullable=False)
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False)  # naive UTC
+    expires_at = Column(DateTime, nullable=False)  # naive UTC
+    last_hit_at = Column(DateTime, nullable=False)  # naive UTC, для вытеснения по размеру
+    hits = Column(Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        Index('ix_llm_response_cache_expires_at', 'expires_at'),
+        Index('ix_llm_response_cache_last_hit_at', 'last_hit_at'),
+    )
+
+    def __repr__(self):
+        return f"<LLMResponseCache(key={self.key[:12]}, model={self.model}, hits={self.hits})>"
@@ -1,4 +1,7 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON
+from datetime import datetime
+from enum import Enum as PyEnum
+
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON, Index, Text, Enum
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 
@@ -24,6 +27,10 @@ class Notification(Base):
     entity_type = Column(String, nullable=True)
     entity_id = Column(Integer, nullable=True)
 
+    # Ключ идемпотентности (тип:получатель[:сущность][:дата]); задаётся для уведомлений
+    # с date_bucket — уникальный индекс не даёт отправить такое уведомление дважды
+    dedupe_key = Column(String, nullable=True, unique=True, index=True)
+
     # Дополнительные данные для аналитики и отладки
     metadata_json = Column(JSON, default={})
 
@@ -34,4 +41,60 @@ class Notification(Base):
     actor = relationship("User", foreign_keys=[actor_user_id])
     pair = relationship("Pair")
 
+    __table_args__ = (
+        Index('ix_notifications_recipient_type_sent', 'recipient_user_id', 'type', 'sent_at'),
+    )
+
+
+class OutboxStatus(PyEnum):
+    PENDING = "pending"
+    PROCESSING = "processing"
+    SENT = "sent"
+    SKIPPED = "skipped"  # Кулдаун, дубликат или нет telegram_id
+    DEAD = "dead"  # Исчерпаны попытки
+
+
+class NotificationOutbox(Base):
+    """Очередь исходящих уведомлений.
+
+    Запись добавляется в той же транзакции, что и изменение, вызвавшее
+    уведомление; доставку выполняют фоновые воркеры (app/services/outbox.py).
+    """
+    __tablename__ = "notification_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(Enum(OutboxStatus), nullable=False, default=OutboxStatus.PENDING)
+    priority = Column(Integer, nullable=False, default=0)  # Больше — раньше (Rule.priority)
+
+    # Параметры NotificationService.send
+    type = Column(String, nullable=False)
+    recipient_user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    pair_id = Column(Integer, ForeignKey("pairs.id"), nullable=True)
+    actor_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    entity_type = Column(String, nullable=True)
+    entity_id = Column(Integer, nullable=True)
+    date_bucket = Column(String, nullable=True)
+    cooldown_seconds = Column(Integer, nullable=True)
+    text = Column(Text, nullable=False)
+    reply_markup = Column(JSON, nullable=True)
+    metadata_json = Column(JSON, default={})
+
+    # Доставка
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)  # naive UTC
+    locked_at = Column(DateTime, nullable=True)  # naive UTC, аренда воркера
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+
+    recipient = relationship("User", foreign_keys=[recipient_user_id])
+
+    __table_args__ = (
+        # Выборка воркером: готовые к отправке по приоритету
+        Index('ix_notification_outbox_claim', 'status', 'available_at', 'priority'),
+    )
+
+    def __repr__(self):
+        return f"<NotificationOutbox(id={self.id}, type='{self.type}', status={self.status}, attempts={self.attempts})>"
 
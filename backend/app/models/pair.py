@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Enum, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Date, Enum, ForeignKey, Boolean, JSON
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 import enum
@@ -52,3 +52,29 @@ class PairInvite(Base):
 
     def __repr__(self):
         return f"<PairInvite(id={self.id}, code='{self.code}', owner_user_id={self.owner_user_id})>"
+
+
+class PairContextSnapshot(Base):
+    """Сжатый скользящий контекст пары для GPT промптов.
+
+    Поддерживается инкрементально при записи настроений и ответов Сонастройки
+    (см. app.services.pair_snapshot), полностью пересчитывается скриптом
+    scripts/rebuild_pair_snapshots.py. Счётчики ответов на вопросы дня — в
+    pair_question_stats.
+    """
+    __tablename__ = "pair_context_snapshots"
+
+    pair_id = Column(Integer, ForeignKey("pairs.id"), primary_key=True)
+    # {"YYYY-MM-DD": {"user1": mood_code, "user2": mood_code}} за последние GPT_CONTEXT_DAYS дней
+    mood_days = Column(JSON, nullable=False, default=dict)
+    mood_streak = Column(Integer, nullable=False, default=0)  # Дней подряд, когда настроение отметили оба
+    mood_streak_best = Column(Integer, nullable=False, default=0)
+    last_both_mood_date = Column(Date, nullable=True)
+    tune_compared = Column(Integer, nullable=False, default=0)  # Пар «ответ о себе» / «догадка партнёра»
+    tune_matched = Column(Integer, nullable=False, default=0)  # Из них совпавших
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    pair = relationship("Pair")
+
+    def __repr__(self) -> str:
+        return f"<PairContextSnapshot(pair_id={self.pair_id}, days={len(self.mood_days or {})}, streak={self.mood_streak})>"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, UniqueConstraint, Date
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, UniqueConstraint, Date, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 
@@ -34,8 +34,12 @@ class UserAnswer(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
-    # Уникальность: один пользователь может ответить на вопрос только один раз
-    __table_args__ = (UniqueConstraint('user_id', 'question_id', name='unique_user_question'),)
+    # Уникальность: один пользователь может ответить на вопрос только один раз.
+    # Индекс (user_id, created_at, id) — для постраничной истории по курсору
+    __table_args__ = (
+        UniqueConstraint('user_id', 'question_id', name='unique_user_question'),
+        Index('ix_user_answers_user_created', 'user_id', 'created_at', 'id'),
+    )
 
     # Relationships
     user = relationship("User", back_populates="question_answers")
@@ -113,3 +117,26 @@ class QuestionNotification(Base):
     def __repr__(self) -> str:
         return f"<QuestionNotification(pair_id={self.pair_id}, q={self.question_id}, sender={self.sender_user_id}, recipient={self.recipient_user_id})>"
 
+
+
+class PairQuestionStats(Base):
+    """Счётчики ответов пары на вопросы дня.
+
+    Поддерживаются инкрементально при сохранении ответа (см. app.services.question_stats),
+    полностью пересчитываются скриптом scripts/rebuild_question_stats.py.
+    """
+    __tablename__ = "pair_question_stats"
+
+    pair_id = Column(Integer, ForeignKey("pairs.id"), primary_key=True)
+    user1_answered = Column(Integer, nullable=False, default=0)
+    user2_answered = Column(Integer, nullable=False, default=0)
+    both_answered = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    pair = relationship("Pair")
+
+    def __repr__(self) -> str:
+        return (
+            f"<PairQuestionStats(pair_id={self.pair_id}, user1={self.user1_answered}, "
+            f"user2={self.user2_answered}, both={self.both_answered})>"
+        )
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, String, DateTime
+
+from app.core.database import Base
+
+
+class SchedulerLease(Base):
+    """Аренда лидерства: фоновые задачи выполняет только процесс-держатель"""
+    __tablename__ = "scheduler_leases"
+
+    name = Column(String, primary_key=True)  # Что арендуется, например "scheduler"
+    holder = Column(String, nullable=False)  # host:pid:случайный суффикс
+    expires_at = Column(DateTime, nullable=False)  # naive UTC
+
+    def __repr__(self):
+        return f"<SchedulerLease(name='{self.name}', holder='{self.holder}', expires_at={self.expires_at})>"
@@ -15,6 +15,7 @@ class User(Base):
     username = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     settings_json = Column(JSON, default={})
+    timezone = Column(String, nullable=True)  # IANA, например Europe/Moscow; NULL — settings.DEFAULT_TIMEZONE
     is_active = Column(Boolean, default=True)
 
     # Relationships
@@ -4,6 +4,9 @@ from dataclasses import dataclass
 from typing import Protocol, Iterable, Optional, Dict, Any, List
 from datetime import timedelta
 
+from apscheduler.triggers.cron import CronTrigger
+
+from app.core.config import settings
 from app.models import User
 
 
@@ -13,8 +16,27 @@ class Trigger(Protocol):
 
 @dataclass
 class ScheduledTrigger:
-    cron: str  # для будущего, сейчас может быть строка описания
+    cron: str = ""  # crontab (UTC): "минута час день месяц день_недели" (дни недели как в APScheduler: mon-sun)
     kind: str = "schedule"
+    # "ЧЧ:ММ" по местному времени получателя (User.timezone) вместо cron:
+    # правило запускается каждый слот и берёт тех, у кого сейчас это время
+    local_time: Optional[str] = None
+    # Окно (сек), по которому размазываются отправки одного запуска; None — из настроек
+    jitter_seconds: Optional[int] = None
+    # Сколько секунд после пропущенного запуска (рестарт, занятый цикл) его ещё можно выполнить
+    misfire_grace_time: Optional[int] = 3600
+    # Несколько пропущенных запусков выполняются один раз
+    # (у правил по местному времени — нет: у каждого слота свои пояса)
+    coalesce: bool = True
+
+    def cron_trigger(self, timezone: str = "UTC") -> CronTrigger:
+        if self.local_time:
+            return CronTrigger(minute=f"*/{settings.NOTIFICATION_SLOT_MINUTES}", timezone=timezone)
+        return CronTrigger.from_crontab(self.cron, timezone=timezone)
+
+    @property
+    def jitter(self) -> int:
+        return settings.NOTIFICATION_JITTER_SECONDS if self.jitter_seconds is None else self.jitter_seconds
 
 
 @dataclass
@@ -34,6 +56,11 @@ class Rule(Protocol):
     def is_allowed(self, ctx: Dict[str, Any], user: User) -> bool:
         ...
 
+    def select_eligible(self, ctx: Dict[str, Any]) -> List[User]:
+        # Необязательный пакетный вариант select_targets + is_allowed:
+        # получатели с учётом всех проверок одним запросом
+        ...
+
     def cooldown(self) -> Optional[timedelta]:
         ...
 
@@ -44,18 +71,23 @@ class Rule(Protocol):
         # returns {"text": str, "reply_markup": Optional[dict]}
         ...
 
+    def render_many(self, ctx: Dict[str, Any], users: List[User]) -> Dict[int, Optional[Dict[str, Any]]]:
+        # Необязательный пакетный вариант render: {user.id: render или None}
+        ...
+
 
 # Registry для правил
 _RULES: Dict[str, list[Rule]] = {"schedule": [], "event": []}
+# Правила событий по event_name: поиск при emit без перебора всех правил
+_EVENT_RULES: Dict[str, list[Rule]] = {}
 
 
-def msk_to_utc_cron(hour: int, minute: int = 0) -> str:
-    """
-    Конвертирует московское время в UTC cron выражение.
-    MSK = UTC + 3, поэтому UTC = MSK - 3
-    """
-    utc_hour = (hour - 3) % 24  # MSK - 3, с учетом перехода через полночь
-    return f"{minute} {utc_hour} * * *"
+def local_time_trigger(hour: int, minute: int = 0, **kwargs: Any) -> ScheduledTrigger:
+    """Триггер на hour:minute по местному времени каждого получателя"""
+    if minute % settings.NOTIFICATION_SLOT_MINUTES:
+        raise ValueError(f"minute должна быть кратна {settings.NOTIFICATION_SLOT_MINUTES}")
+    kwargs.setdefault("coalesce", False)
+    return ScheduledTrigger(local_time=f"{hour:02d}:{minute:02d}", **kwargs)
 
 
 def register_rule(rule: Rule) -> None:
@@ -64,6 +96,7 @@ def register_rule(rule: Rule) -> None:
         _RULES["schedule"].append(rule)
     elif isinstance(rule.trigger, EventTrigger):
         _RULES["event"].append(rule)
+        _EVENT_RULES.setdefault(rule.trigger.event_name, []).append(rule)
 
 
 def iter_rules(kind: str) -> Iterable[Rule]:
@@ -71,3 +104,16 @@ def iter_rules(kind: str) -> Iterable[Rule]:
     return _RULES.get(kind, [])
 
 
+def rules_for_event(event_name: str) -> List[Rule]:
+    """Правила, срабатывающие на событие event_name"""
+    return _EVENT_RULES.get(event_name, [])
+
+
+def get_rule(rule_id: str, kind: str = "schedule") -> Optional[Rule]:
+    """Правило по id (для задач планировщика, которые хранят только id)"""
+    for rule in _RULES.get(kind, []):
+        if rule.id == rule_id:
+            return rule
+    return None
+
+
@@ -1,45 +1,126 @@
 from __future__ import annotations
 
-from typing import Dict, Any
+import asyncio
+import logging
+from datetime import datetime
+from typing import Callable, Dict, Any, List, Optional
+
+from sqlalchemy.orm import Session
 
-from app.models import User
 from app.core.database import SessionLocal
-from app.services.notifications import NotificationService
-from .base import iter_rules
+from app.models import User, Pair
+from app.services.notifications import NotificationRequest
+from app.services.outbox import OutboxWorker, enqueue_many, outbox_worker
+from .base import rules_for_event
+from .targets import due_timezones
+
+logger = logging.getLogger(__name__)
+
+
+def select_eligible(rule, ctx: Dict[str, Any]) -> List[User]:
+    """Получатели правила: пакетно, если правило это умеет, иначе по одному"""
+    batch = getattr(rule, "select_eligible", None)
+    if batch is not None:
+        return list(batch(ctx))
+    users = [user for user in rule.select_targets(ctx) if rule.is_allowed(ctx, user)]
+    if ctx.get("timezones") is not None:
+        users = [user for user in users if user.timezone in ctx["timezones"]]
+    return users
+
+
+def render_all(rule, ctx: Dict[str, Any], users: List[User]) -> Dict[int, Optional[Dict[str, Any]]]:
+    """Рендер всех получателей: пакетно, если правило это умеет, иначе по одному"""
+    batch = getattr(rule, "render_many", None)
+    if batch is not None:
+        return batch(ctx, users)
+    return {user.id: rule.render(ctx, user) for user in users}
 
 
 class NotificationEngine:
-    def __init__(self, service: NotificationService | None = None) -> None:
-        self.service = service or NotificationService()
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        outbox: OutboxWorker | None = None,
+    ) -> None:
+        self.session_factory = session_factory
+        self.outbox = outbox or outbox_worker
+
+    async def run_rule(self, rule, ctx: Dict[str, Any] = None, scheduled_at: Optional[datetime] = None) -> None:
+        """Выполняет одно правило по расписанию (время запуска определяет планировщик).
 
-    async def run_scheduled(self, ctx: Dict[str, Any] = None) -> None:
+        scheduled_at — плановое время запуска: по нему, а не по текущему
+        времени, выбирается слот правила по местному времени, поэтому
+        запоздавший запуск (рестарт, смена лидера) достаётся своим поясам.
+        """
         if ctx is None:
             ctx = {}
-        
-        # Проверяем текущее время
-        from datetime import datetime, timezone
-        now_utc = datetime.now(timezone.utc)
-        current_hour_utc = now_utc.hour
-        
-        async def handle_rule(rule, user: User):
-            # Проверяем, что правило должно сработать в текущий час
-            rule_cron = rule.trigger.cron
-            parts = rule_cron.split()
-            if len(parts) >= 2:
-                rule_hour = int(parts[1])
-                if rule_hour != current_hour_utc:
-                    return  # Не время для этого правила
-            
-            if not rule.is_allowed(ctx, user):
+        if scheduled_at is not None:
+            # По нему же правила считают дату получателя для date_bucket
+            ctx = {**ctx, "scheduled_at": scheduled_at}
+        local_time = getattr(rule.trigger, "local_time", None)
+        if local_time and "timezones" not in ctx:
+            # Правило по местному времени: только пояса, где в этот слот его время
+            # (ctx["timezones"] = None — принудительно все пользователи)
+            timezones = await asyncio.to_thread(self._due_timezones, local_time, scheduled_at)
+            ctx = {**ctx, "timezones": timezones}
+            if not ctx["timezones"]:
                 return
+        # Выборка в потоке, чтобы не блокировать event loop
+        users = await asyncio.to_thread(select_eligible, rule, ctx)
+        await self._dispatch(rule, ctx, users, spread=getattr(rule.trigger, "jitter", 0))
+
+    def _due_timezones(self, local_time: str, now: Optional[datetime] = None) -> List[Optional[str]]:
+        session = self.session_factory()
+        try:
+            return due_timezones(session, local_time, now)
+        finally:
+            session.close()
+
+    async def handle_event(self, event_name: str, ctx: Dict[str, Any]) -> None:
+        """Выполняет правила события. ctx может нести actor_id/pair_id вместо
+        объектов — они загружаются здесь, в своей сессии."""
+        rules = rules_for_event(event_name)
+        if not rules:
+            return
+        ctx = await asyncio.to_thread(self._resolve_ctx, ctx)
+        for rule in rules:
+            users = await asyncio.to_thread(select_eligible, rule, ctx)
+            await self._dispatch(rule, ctx, users)
+
+    def _resolve_ctx(self, ctx: Dict[str, Any]) -> Dict[str, Any]:
+        models = {"actor": User, "pair": Pair}
+        missing = {
+            name: ctx[f"{name}_id"] for name in models
+            if ctx.get(name) is None and ctx.get(f"{name}_id") is not None
+        }
+        if not missing:
+            return ctx
+        session = self.session_factory()
+        try:
+            ctx = dict(ctx)
+            for name, object_id in missing.items():
+                ctx[name] = session.get(models[name], object_id)
+            session.expunge_all()
+        finally:
+            session.close()
+        return ctx
+
+    async def _dispatch(self, rule, ctx: Dict[str, Any], users: List[User], spread: float = 0) -> None:
+        """Рендерит уведомления правила и ставит их в outbox одной пачкой (priority правила).
+
+        spread > 0 распределяет время доставки по окну в spread секунд.
+        """
+        renders = await asyncio.to_thread(render_all, rule, ctx, users)
+        requests = []
+        for user in users:
             dedupe = rule.make_dedupe(ctx, user)
-            render = rule.render(ctx, user)
+            render = renders.get(user.id)
             
             # Проверяем, что render не None
             if render is None:
-                return
-                
-            await self.service.send(
+                continue
+
+            requests.append(NotificationRequest(
                 n_type=rule.id,
                 recipient=user,
                 text=render.get("text", ""),
@@ -51,36 +132,18 @@ class NotificationEngine:
                 date_bucket=dedupe.get("date_bucket"),
                 cooldown=rule.cooldown(),
                 metadata=render.get("meta") or {},
-            )
+            ))
 
-        for rule in iter_rules("schedule"):
-            for user in rule.select_targets(ctx):
-                await handle_rule(rule, user)
+        if not requests:
+            return
+        await asyncio.to_thread(self._enqueue, requests, rule.priority, spread)
+        self.outbox.wake()
+        logger.info(f"📨 {rule.id}: в очередь поставлено {len(requests)}")
 
-    async def handle_event(self, event_name: str, ctx: Dict[str, Any]) -> None:
-        for rule in iter_rules("event"):
-            if getattr(rule.trigger, "event_name", None) != event_name:
-                continue
-            for user in rule.select_targets(ctx):
-                if not rule.is_allowed(ctx, user):
-                    continue
-                dedupe = rule.make_dedupe(ctx, user)
-                render = rule.render(ctx, user)
-                
-                # Проверяем, что render не None
-                if render is None:
-                    continue
-                    
-                await self.service.send(
-                    n_type=rule.id,
-                    recipient=user,
-                    text=render.get("text", ""),
-                    reply_markup=render.get("reply_markup"),
-                    pair=ctx.get("pair"),
-                    actor=ctx.get("actor"),
-                    entity_type=dedupe.get("entity_type"),
-                    entity_id=dedupe.get("entity_id"),
-                    date_bucket=dedupe.get("date_bucket"),
-                    cooldown=rule.cooldown(),
-                    metadata=render.get("meta") or {},
-                )
+    def _enqueue(self, requests: List[NotificationRequest], priority: int, spread: float = 0) -> None:
+        session = self.session_factory()
+        try:
+            enqueue_many(session, requests, priority=priority, spread=spread)
+            session.commit()
+        finally:
+            session.close()
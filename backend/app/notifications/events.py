@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from app.core.config import settings
+from .base import rules_for_event
+
+logger = logging.getLogger(__name__)
+
+EventKey = Tuple[str, Hashable]
+
+
+class EventBus:
+    """Шина событий процесса: эндпоинты вызывают emit после коммита, правила
+    с EventTrigger выполняет фоновый потребитель.
+
+    События с одинаковым (event_name, key) в пределах coalesce_window секунд
+    схлопываются в одно выполнение с последним ctx — например, несколько
+    быстрых обновлений настроения дают одно уведомление. События без key не
+    схлопываются. emit не ждёт ни БД, ни Telegram; события без правил
+    отбрасываются сразу. Очередь живёт в памяти процесса: отложенные события
+    теряются только при аварийном завершении (на штатной остановке stop их
+    выполняет).
+    """
+
+    def __init__(self, coalesce_window: float = 5.0, max_pending: int = 10000):
+        self.coalesce_window = coalesce_window
+        self.max_pending = max_pending
+        self.engine = None
+        self._pending: Dict[EventKey, Dict[str, Any]] = {}
+        self._due: List[Tuple[float, int, EventKey]] = []
+        self._seq = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.emitted = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.handled = 0
+
+    async def start(self, engine) -> None:
+        self.engine = engine
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает потребителя и выполняет все отложенные события"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._due:
+            await self._handle(heapq.heappop(self._due)[2])
+
+    def emit(self, event_name: str, ctx: Dict[str, Any], key: Optional[Hashable] = None) -> bool:
+        """Публикует событие. False — событие никому не нужно или очередь переполнена."""
+        if not rules_for_event(event_name):
+            return False
+        if self._loop is not None and _running_loop() is not self._loop:
+            # Вызов из пула потоков (sync эндпоинт)
+            self._loop.call_soon_threadsafe(self._enqueue, event_name, ctx, key)
+            return True
+        return self._enqueue(event_name, ctx, key)
+
+    def _enqueue(self, event_name: str, ctx: Dict[str, Any], key: Optional[Hashable]) -> bool:
+        event_key = (event_name, key if key is not None else ("seq", next(self._seq)))
+        self.emitted += 1
+        if event_key in self._pending:
+            self._pending[event_key] = ctx
+            self.coalesced += 1
+            return True
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            logger.warning(f"⚠️ Очередь событий переполнена, {event_name} отброшено")
+            return False
+        self._pending[event_key] = ctx
+        heapq.heappush(self._due, (time.monotonic() + self.coalesce_window, next(self._seq), event_key))
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            timeout = self._due[0][0] - time.monotonic() if self._due else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            await self._handle(heapq.heappop(self._due)[2])
+
+    async def _handle(self, event_key: EventKey) -> None:
+        ctx = self._pending.pop(event_key, None)
+        if ctx is None or self.engine is None:
+            return
+        try:
+            await self.engine.handle_event(event_key[0], ctx)
+            self.handled += 1
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки события {event_key[0]}: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._pending),
+            "emitted": self.emitted,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "handled": self.handled,
+        }
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+event_bus = EventBus(coalesce_window=settings.NOTIFICATION_EVENT_COALESCE_SECONDS)
+
+
+def emit(event_name: str, ctx: Dict[str, Any], key: Optional[Hashable] = None) -> bool:
+    """Публикует событие в шину процесса (см. EventBus.emit)"""
+    return event_bus.emit(event_name, ctx, key)
@@ -1,3 +1,4 @@
 # from .daily_checkin import DailyCheckinRule  # noqa: F401 - отключено
 from .morning_reminder import MorningReminderRule  # noqa: F401
 from .evening_reminder import EveningReminderRule  # noqa: F401
+from .mood_update import MoodUpdateRule  # noqa: F401
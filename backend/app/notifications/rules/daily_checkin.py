@@ -1,12 +1,13 @@
 from __future__ import annotations
 
-from datetime import timedelta, date
-from typing import Dict, Any, Iterable
+from datetime import timedelta
+from typing import Dict, Any, Iterable, List
 
 from app.core.config import settings
 from app.core.database import SessionLocal
-from app.models import User, Pair
+from app.models import User
 from ..base import ScheduledTrigger, Rule, register_rule
+from ..targets import active_pair_users, local_date
 
 
 class DailyCheckinRule:
@@ -18,12 +19,7 @@ class DailyCheckinRule:
         session = SessionLocal()
         try:
             # Получаем только пользователей с парами
-            from sqlalchemy import or_
-            users_with_pairs = session.query(User).join(
-                Pair, 
-                or_(User.id == Pair.user1_id, User.id == Pair.user2_id)
-            ).filter(Pair.status == "active").all()
-            return users_with_pairs
+            return active_pair_users(session)
         finally:
             session.close()
 
@@ -31,11 +27,15 @@ class DailyCheckinRule:
         # Здесь можно читать user.settings_json для тихих часов и отключения типа
         return True
 
+    def select_eligible(self, ctx: Dict[str, Any]) -> List[User]:
+        return list(self.select_targets(ctx))
+
     def cooldown(self):
         return timedelta(hours=24)
 
     def make_dedupe(self, ctx: Dict[str, Any], user: User) -> Dict[str, Any]:
-        return {"entity_type": None, "entity_id": None, "date_bucket": date.today().isoformat()}
+        # День по местному времени получателя, а не сервера
+        return {"entity_type": None, "entity_id": None, "date_bucket": local_date(user, ctx.get("scheduled_at")).isoformat()}
 
     def render(self, ctx: Dict[str, Any], user: User) -> Dict[str, Any]:
         webapp_base_url = settings.TELEGRAM_WEBAPP_URL or "https://gallery.homoludens.photos/pulse_of_pair/"
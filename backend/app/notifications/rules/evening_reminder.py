@@ -1,32 +1,26 @@
 from __future__ import annotations
 
 from datetime import timedelta, date, datetime, timezone
-from typing import Dict, Any, Iterable, Optional, Tuple
+from typing import Dict, Any, Iterable, List, Optional
 
 from app.core.config import settings
 from app.core.database import SessionLocal
 from app.models import User, Pair, Mood, UserAnswer, UsageEvent, Question, PairDailyQuestion
 from app.models.tune import PairDailyTuneQuestion, TuneAnswer, TuneQuizQuestion
-from ..base import ScheduledTrigger, Rule, register_rule, msk_to_utc_cron
+from ..base import Rule, register_rule, local_time_trigger
+from ..targets import active_pair_users, local_date
 
 
 class EveningReminderRule:
     id = "evening_reminder"
-    trigger = ScheduledTrigger(cron=msk_to_utc_cron(20, 0))  # Каждый день в 20:00 MSK
+    trigger = local_time_trigger(20, 0)  # Каждый день в 20:00 по времени пользователя
     priority = 85
 
     def select_targets(self, ctx: Dict[str, Any]) -> Iterable[User]:
         session = SessionLocal()
         try:
             # Получаем всех пользователей, у которых есть активная пара
-            from sqlalchemy import or_
-            
-            users_with_pairs = session.query(User).join(
-                Pair, 
-                or_(User.id == Pair.user1_id, User.id == Pair.user2_id)
-            ).filter(Pair.status == "active").all()
-            
-            return users_with_pairs
+            return active_pair_users(session, timezones=ctx.get("timezones"))
         finally:
             session.close()
 
@@ -34,7 +28,7 @@ class EveningReminderRule:
         # Проверяем, заходил ли пользователь в приложение за последние 4 часа
         session = SessionLocal()
         try:
-            four_hours_ago = datetime.now(timezone.utc) - timedelta(hours=4)
+            four_hours_ago = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=4)
             
             recent_activity = session.query(UsageEvent).filter(
                 UsageEvent.telegram_id == user.telegram_id,
@@ -47,211 +41,193 @@ class EveningReminderRule:
         finally:
             session.close()
 
+    def select_eligible(self, ctx: Dict[str, Any]) -> List[User]:
+        """Получатели с учётом активности: один запрос вместо проверки по каждому"""
+        session = SessionLocal()
+        try:
+            return active_pair_users(session, inactive_for=timedelta(hours=4), timezones=ctx.get("timezones"))
+        finally:
+            session.close()
+
     def cooldown(self):
         return timedelta(hours=24)
 
     def make_dedupe(self, ctx: Dict[str, Any], user: User) -> Dict[str, Any]:
-        return {"entity_type": None, "entity_id": None, "date_bucket": date.today().isoformat()}
+        # День по местному времени получателя, а не сервера
+        return {"entity_type": None, "entity_id": None, "date_bucket": local_date(user, ctx.get("scheduled_at")).isoformat()}
 
-    def _get_partner_info(self, session, user: User) -> Tuple[Optional[User], Optional[Pair]]:
-        """Получить информацию о партнере и паре"""
-        pair = session.query(Pair).filter(
-            (Pair.user1_id == user.id) | (Pair.user2_id == user.id),
-            Pair.status == "active"
-        ).first()
-        
-        if not pair:
-            return None, None
-            
-        partner_id = pair.user2_id if pair.user1_id == user.id else pair.user1_id
-        partner = session.query(User).filter(User.id == partner_id).first()
-        
-        return partner, pair
-
-    def _check_daily_question_status(self, session, user: User, partner: User, pair: Pair) -> Tuple[bool, bool, Optional[Question]]:
-        """Проверить статус вопроса дня"""
+    def render_many(self, ctx: Dict[str, Any], users: List[User]) -> Dict[int, Optional[Dict[str, Any]]]:
+        """Рендер для всех получателей сразу: состояние всех пар загружается
+        несколькими сгруппированными запросами, тексты собираются в памяти.
+        Возвращает {user.id: render или None}.
+        """
+        if not users:
+            return {}
         today = date.today()
-        
-        # Получаем вопрос дня для пары
-        daily_question = session.query(PairDailyQuestion).filter(
-            PairDailyQuestion.pair_id == pair.id,
-            PairDailyQuestion.date == today
-        ).first()
-        
-        if not daily_question:
-            return False, False, None
-            
-        question = session.query(Question).filter(Question.id == daily_question.question_id).first()
-        if not question:
-            return False, False, None
-            
-        # Проверяем ответы
-        user_answered = session.query(UserAnswer).filter(
-            UserAnswer.user_id == user.id,
-            UserAnswer.question_id == question.id
-        ).first() is not None
-        
-        partner_answered = session.query(UserAnswer).filter(
-            UserAnswer.user_id == partner.id,
-            UserAnswer.question_id == question.id
-        ).first() is not None
-        
-        return user_answered, partner_answered, question
+        user_ids = [user.id for user in users]
+        session = SessionLocal()
+        try:
+            # Активные пары получателей и их партнёры
+            pair_by_user: Dict[int, Pair] = {}
+            for pair in session.query(Pair).filter(
+                (Pair.user1_id.in_(user_ids)) | (Pair.user2_id.in_(user_ids)),
+                Pair.status == "active"
+            ).order_by(Pair.id):
+                for member_id in (pair.user1_id, pair.user2_id):
+                    pair_by_user.setdefault(member_id, pair)
+            partner_ids = {
+                pair.user2_id if pair.user1_id == user_id else pair.user1_id
+                for user_id, pair in pair_by_user.items() if user_id in user_ids
+            }
+            partners = {u.id: u for u in session.query(User).filter(User.id.in_(partner_ids))} if partner_ids else {}
+            pair_ids = {pair.id for pair in pair_by_user.values()}
+            member_ids = set(user_ids) | partner_ids
 
-    def _check_tune_status(self, session, user: User, partner: User, pair: Pair) -> Tuple[bool, bool, Optional[TuneQuizQuestion]]:
-        """Проверить статус сонастройки"""
-        today = date.today()
-        
-        # Получаем вопрос сонастройки для пары
-        tune_question = session.query(PairDailyTuneQuestion).filter(
-            PairDailyTuneQuestion.pair_id == pair.id,
-            PairDailyTuneQuestion.date == today
-        ).first()
-        
-        if not tune_question:
-            return False, False, None
-            
-        question = session.query(TuneQuizQuestion).filter(TuneQuizQuestion.id == tune_question.question_id).first()
-        if not question:
-            return False, False, None
-            
-        # Проверяем ответы каждого пользователя
-        # Каждый должен ответить 2 раза: о себе и о партнере
-        
-        # Мои ответы
-        my_about_me = session.query(TuneAnswer).filter(
-            TuneAnswer.pair_id == pair.id,
-            TuneAnswer.question_id == question.id,
-            TuneAnswer.author_user_id == user.id,
-            TuneAnswer.subject_user_id == user.id
-        ).first()
-        
-        my_about_partner = session.query(TuneAnswer).filter(
-            TuneAnswer.pair_id == pair.id,
-            TuneAnswer.question_id == question.id,
-            TuneAnswer.author_user_id == user.id,
-            TuneAnswer.subject_user_id == partner.id
-        ).first()
+            # Вопрос дня и ответы на него
+            daily = dict(session.query(PairDailyQuestion.pair_id, Question.id).join(
+                Question, Question.id == PairDailyQuestion.question_id
+            ).filter(
+                PairDailyQuestion.pair_id.in_(pair_ids),
+                PairDailyQuestion.date == today
+            ).all()) if pair_ids else {}
+            answered = set(session.query(UserAnswer.user_id, UserAnswer.question_id).filter(
+                UserAnswer.user_id.in_(member_ids),
+                UserAnswer.question_id.in_(set(daily.values()))
+            ).all()) if daily else set()
+
+            # Сонастройка и матрица ответов (автор, о ком)
+            tune = dict(session.query(PairDailyTuneQuestion.pair_id, TuneQuizQuestion.id).join(
+                TuneQuizQuestion, TuneQuizQuestion.id == PairDailyTuneQuestion.question_id
+            ).filter(
+                PairDailyTuneQuestion.pair_id.in_(pair_ids),
+                PairDailyTuneQuestion.date == today
+            ).all()) if pair_ids else {}
+            tune_answers = set(session.query(
+                TuneAnswer.pair_id, TuneAnswer.question_id, TuneAnswer.author_user_id, TuneAnswer.subject_user_id
+            ).filter(
+                TuneAnswer.pair_id.in_(set(tune)),
+                TuneAnswer.question_id.in_(set(tune.values()))
+            ).all()) if tune else set()
+
+            # Активность партнёров за последние 4 часа
+            four_hours_ago = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=4)
+            partner_telegram_ids = {p.telegram_id for p in partners.values()}
+            active_telegram_ids = {row[0] for row in session.query(UsageEvent.telegram_id).filter(
+                UsageEvent.telegram_id.in_(partner_telegram_ids),
+                UsageEvent.ts >= four_hours_ago
+            ).distinct()} if partner_telegram_ids else set()
+        finally:
+            session.close()
+
+        renders: Dict[int, Optional[Dict[str, Any]]] = {}
+        for user in users:
+            pair = pair_by_user.get(user.id)
+            partner = partners.get(pair.user2_id if pair and pair.user1_id == user.id else pair.user1_id) if pair else None
+            if not pair or not partner:
+                renders[user.id] = None  # Нет пары - не отправляем
+                continue
+
+            daily_question_id = daily.get(pair.id)
+            tune_question_id = tune.get(pair.id)
+
+            def tune_completed(author_id: int, other_id: int) -> bool:
+                # Завершил сонастройку, если ответил о себе И о партнере
+                return all(
+                    (pair.id, tune_question_id, author_id, subject_id) in tune_answers
+                    for subject_id in (author_id, other_id)
+                )
+
+            renders[user.id] = self._render_message(
+                partner,
+                user_answered_daily=(user.id, daily_question_id) in answered,
+                partner_answered_daily=(partner.id, daily_question_id) in answered,
+                has_daily_question=daily_question_id is not None,
+                user_answered_tune=tune_question_id is not None and tune_completed(user.id, partner.id),
+                partner_answered_tune=tune_question_id is not None and tune_completed(partner.id, user.id),
+                has_tune_question=tune_question_id is not None,
+                partner_active=partner.telegram_id in active_telegram_ids,
+            )
+        return renders
+
+    def render(self, ctx: Dict[str, Any], user: User) -> Dict[str, Any]:
+        return self.render_many(ctx, [user]).get(user.id)
+
+    def _render_message(
+        self,
+        partner: User,
+        *,
+        user_answered_daily: bool,
+        partner_answered_daily: bool,
+        has_daily_question: bool,
+        user_answered_tune: bool,
+        partner_answered_tune: bool,
+        has_tune_question: bool,
+        partner_active: bool,
+    ) -> Optional[Dict[str, Any]]:
+        """Текст и кнопки напоминания по уже загруженному состоянию пары"""
+        webapp_base_url = settings.TELEGRAM_WEBAPP_URL or "https://gallery.homoludens.photos/pulse_of_pair/"
+        
+        # Формируем текст в зависимости от ситуации
+        text_parts = []
+        buttons = []
+        
+        # Если оба ответили на все - не отправляем
+        if (user_answered_daily and partner_answered_daily and 
+            user_answered_tune and partner_answered_tune):
+            return None
+        
+        # Анализ вопроса дня
+        if has_daily_question:
+            if not user_answered_daily and partner_answered_daily:
+                text_parts.append(f"💬 {partner.first_name} ответил(а) на вопрос дня, а вы ещё нет!")
+                buttons.append({
+                    "text": "Ответить на вопрос дня", 
+                    "web_app": {"url": f"{webapp_base_url}?tgWebAppStartParam=questions"}
+                })
+            elif not user_answered_daily and not partner_answered_daily:
+                text_parts.append("💬 Вопрос дня ждёт ваших ответов!")
+                buttons.append({
+                    "text": "Ответить на вопрос дня", 
+                    "web_app": {"url": f"{webapp_base_url}?tgWebAppStartParam=questions"}
+                })
         
-        # Ответы партнера
-        partner_about_himself = session.query(TuneAnswer).filter(
-            TuneAnswer.pair_id == pair.id,
-            TuneAnswer.question_id == question.id,
-            TuneAnswer.author_user_id == partner.id,
-            TuneAnswer.subject_user_id == partner.id
-        ).first()
+        # Анализ сонастройки
+        if has_tune_question:
+            if not user_answered_tune and partner_answered_tune:
+                text_parts.append(f"🎯 {partner.first_name} прошёл(а) сонастройку, а вы ещё нет!")
+                buttons.append({
+                    "text": "Пройти сонастройку", 
+                    "web_app": {"url": f"{webapp_base_url}?tgWebAppStartParam=tune"}
+                })
+            elif not user_answered_tune and not partner_answered_tune:
+                text_parts.append("🎯 Сонастройка ждёт вас обоих!")
+                buttons.append({
+                    "text": "Пройти сонастройку", 
+                    "web_app": {"url": f"{webapp_base_url}?tgWebAppStartParam=tune"}
+                })
         
-        partner_about_me = session.query(TuneAnswer).filter(
-            TuneAnswer.pair_id == pair.id,
-            TuneAnswer.question_id == question.id,
-            TuneAnswer.author_user_id == partner.id,
-            TuneAnswer.subject_user_id == user.id
-        ).first()
+        # Если партнер не активен и нет конкретных задач
+        if not partner_active and not text_parts:
+            text_parts.append(f"🌙 {partner.first_name} тоже не проявлял(а) активности. Может, стоит вместе заглянуть в приложение?")
+            buttons.extend([
+                {"text": "Отметить настроение", "web_app": {"url": f"{webapp_base_url}?tgWebAppStartParam=mood"}},
+                {"text": "Открыть приложение", "web_app": {"url": f"{webapp_base_url}?tgWebAppStartParam=main"}}
+            ])
         
-        # Пользователь завершил сонастройку если ответил о себе И о партнере
-        user_completed = my_about_me is not None and my_about_partner is not None
-        partner_completed = partner_about_himself is not None and partner_about_me is not None
+        # Если есть конкретные задачи, добавляем общую кнопку
+        if text_parts and len(buttons) < 2:
+            buttons.append({
+                "text": "Открыть приложение", 
+                "web_app": {"url": f"{webapp_base_url}?tgWebAppStartParam=main"}
+            })
         
-        return user_completed, partner_completed, question
-
-    def _check_partner_activity(self, session, partner: User) -> bool:
-        """Проверить активность партнера за последние 4 часа"""
-        four_hours_ago = datetime.now(timezone.utc) - timedelta(hours=4)
+        text = " ".join(text_parts)
         
-        # Проверяем активность через UsageEvent
-        recent_activity = session.query(UsageEvent).filter(
-            UsageEvent.telegram_id == partner.telegram_id,
-            UsageEvent.ts >= four_hours_ago
-        ).first()
+        reply_markup = {
+            "inline_keyboard": [buttons] if len(buttons) == 1 else [buttons[:2], buttons[2:]] if len(buttons) > 2 else [buttons]
+        }
         
-        return recent_activity is not None
-
-    def render(self, ctx: Dict[str, Any], user: User) -> Dict[str, Any]:
-        session = SessionLocal()
-        try:
-            partner, pair = self._get_partner_info(session, user)
-            if not partner or not pair:
-                return None  # Нет пары - не отправляем
-            
-            webapp_base_url = settings.TELEGRAM_WEBAPP_URL or "https://gallery.homoludens.photos/pulse_of_pair/"
-            
-            # Проверяем статус вопроса дня
-            user_answered_daily, partner_answered_daily, daily_question = self._check_daily_question_status(
-                session, user, partner, pair
-            )
-            
-            # Проверяем статус сонастройки
-            user_answered_tune, partner_answered_tune, tune_question = self._check_tune_status(
-                session, user, partner, pair
-            )
-            
-            # Проверяем активность партнера
-            partner_active = self._check_partner_activity(session, partner)
-            
-            # Формируем текст в зависимости от ситуации
-            text_parts = []
-            buttons = []
-            
-            # Если оба ответили на все - не отправляем
-            if (user_answered_daily and partner_answered_daily and 
-                user_answered_tune and partner_answered_tune):
-                return None
-            
-            # Анализ вопроса дня
-            if daily_question:
-                if not user_answered_daily and partner_answered_daily:
-                    text_parts.append(f"💬 {partner.first_name} ответил(а) на вопрос дня, а вы ещё нет!")
-                    buttons.append({
-                        "text": "Ответить на вопрос дня", 
-                        "web_app": {"url": f"{webapp_base_url}?tgWebAppStartParam=questions"}
-                    })
-                elif not user_answered_daily and not partner_answered_daily:
-                    text_parts.append("💬 Вопрос дня ждёт ваших ответов!")
-                    buttons.append({
-                        "text": "Ответить на вопрос дня", 
-                        "web_app": {"url": f"{webapp_base_url}?tgWebAppStartParam=questions"}
-                    })
-            
-            # Анализ сонастройки
-            if tune_question:
-                if not user_answered_tune and partner_answered_tune:
-                    text_parts.append(f"🎯 {partner.first_name} прошёл(а) сонастройку, а вы ещё нет!")
-                    buttons.append({
-                        "text": "Пройти сонастройку", 
-                        "web_app": {"url": f"{webapp_base_url}?tgWebAppStartParam=tune"}
-                    })
-                elif not user_answered_tune and not partner_answered_tune:
-                    text_parts.append("🎯 Сонастройка ждёт вас обоих!")
-                    buttons.append({
-                        "text": "Пройти сонастройку", 
-                        "web_app": {"url": f"{webapp_base_url}?tgWebAppStartParam=tune"}
-                    })
-            
-            # Если партнер не активен и нет конкретных задач
-            if not partner_active and not text_parts:
-                text_parts.append(f"🌙 {partner.first_name} тоже не проявлял(а) активности. Может, стоит вместе заглянуть в приложение?")
-                buttons.extend([
-                    {"text": "Отметить настроение", "web_app": {"url": f"{webapp_base_url}?tgWebAppStartParam=mood"}},
-                    {"text": "Открыть приложение", "web_app": {"url": f"{webapp_base_url}?tgWebAppStartParam=main"}}
-                ])
-            
-            # Если есть конкретные задачи, добавляем общую кнопку
-            if text_parts and len(buttons) < 2:
-                buttons.append({
-                    "text": "Открыть приложение", 
-                    "web_app": {"url": f"{webapp_base_url}?tgWebAppStartParam=main"}
-                })
-            
-            text = " ".join(text_parts)
-            
-            reply_markup = {
-                "inline_keyboard": [buttons] if len(buttons) == 1 else [buttons[:2], buttons[2:]] if len(buttons) > 2 else [buttons]
-            }
-            
-            return {"text": text, "reply_markup": reply_markup}
-            
-        finally:
-            session.close()
+        return {"text": text, "reply_markup": reply_markup}
 
 
 # Регистрация правила при импорте модуля
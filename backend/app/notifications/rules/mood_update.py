@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+from datetime import timedelta
+from typing import Dict, Any, Iterable, List, Optional
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models import User
+from app.services.outbox import INTERACTIVE_PRIORITY
+from ..base import EventTrigger, Rule, register_rule
+
+# Маппинг настроений на эмодзи
+MOOD_EMOJIS = {
+    'joyful': '😊',
+    'calm': '😌',
+    'tired': '😴',
+    'anxious': '😰',
+    'sad': '😢',
+    'irritable': '😤',
+    'grateful': '🙏'
+}
+
+
+class MoodUpdateRule:
+    """Уведомление партнеру об отмеченном настроении.
+
+    ctx события mood.created: actor_id, pair_id, partner_id, mood_code, was_update.
+    """
+    id = "mood_update"
+    trigger = EventTrigger(event_name="mood.created")
+    priority = INTERACTIVE_PRIORITY  # Действие пользователя — раньше рассылок по расписанию
+
+    def select_targets(self, ctx: Dict[str, Any]) -> Iterable[User]:
+        return self.select_eligible(ctx)
+
+    def is_allowed(self, ctx: Dict[str, Any], user: User) -> bool:
+        return True
+
+    def select_eligible(self, ctx: Dict[str, Any]) -> List[User]:
+        if not ctx.get("pair_id") or not ctx.get("partner_id"):
+            return []  # Нет пары - не отправляем уведомление
+        session = SessionLocal()
+        try:
+            partner = session.get(User, ctx["partner_id"])
+            if partner is None:
+                return []  # Партнер не найден
+            session.expunge(partner)
+            return [partner]
+        finally:
+            session.close()
+
+    def cooldown(self) -> Optional[timedelta]:
+        return timedelta(minutes=30)
+
+    def make_dedupe(self, ctx: Dict[str, Any], user: User) -> Dict[str, Any]:
+        return {"entity_type": "mood", "entity_id": None, "date_bucket": None}
+
+    def render(self, ctx: Dict[str, Any], user: User) -> Dict[str, Any]:
+        actor = ctx.get("actor")
+        mood_code = ctx.get("mood_code")
+        was_update = bool(ctx.get("was_update"))
+        mood_emoji = MOOD_EMOJIS.get(mood_code, '😊')
+
+        # Формируем текст сообщения
+        action = "обновил" if was_update else "отметил"
+        text = f"{(actor.first_name if actor else None) or 'Партнер'} {action} настроение дня: {mood_emoji}"
+
+        # Создаём диплинк на страницу настроений
+        webapp_base_url = settings.TELEGRAM_WEBAPP_URL or "https://gallery.homoludens.photos/pulse_of_pair/"
+        webapp_url = f"{webapp_base_url}?tgWebAppStartParam=mood"
+
+        reply_markup = {
+            "inline_keyboard": [[
+                {"text": "Посмотреть настроение", "web_app": {"url": webapp_url}}
+            ]]
+        }
+        return {
+            "text": text,
+            "reply_markup": reply_markup,
+            "meta": {"mood_code": mood_code, "was_update": was_update},
+        }
+
+
+# Регистрация правила при импорте модуля
+register_rule(MoodUpdateRule())
@@ -1,33 +1,25 @@
 from __future__ import annotations
 
-from datetime import timedelta, date, datetime, timezone
-from typing import Dict, Any, Iterable
+from datetime import timedelta, datetime, timezone
+from typing import Dict, Any, Iterable, List
 
 from app.core.config import settings
 from app.core.database import SessionLocal
-from app.models import User, Pair, Mood, UserAnswer, UsageEvent
-from ..base import ScheduledTrigger, Rule, register_rule, msk_to_utc_cron
+from app.models import User, UsageEvent
+from ..base import Rule, register_rule, local_time_trigger
+from ..targets import active_pair_users, local_date
 
 
 class MorningReminderRule:
     id = "morning_reminder"
-    trigger = ScheduledTrigger(cron=msk_to_utc_cron(10, 0))  # Каждый день в 10:00 MSK
+    trigger = local_time_trigger(10, 0)  # Каждый день в 10:00 по времени пользователя
     priority = 90
 
     def select_targets(self, ctx: Dict[str, Any]) -> Iterable[User]:
         session = SessionLocal()
         try:
-            # Получаем всех пользователей, у которых есть пара
-            # Используем UNION для объединения user1 и user2 из пар
-            from sqlalchemy import or_
-            
             # Получаем всех пользователей, которые являются user1 или user2 в активных парах
-            users_with_pairs = session.query(User).join(
-                Pair, 
-                or_(User.id == Pair.user1_id, User.id == Pair.user2_id)
-            ).filter(Pair.status == "active").all()
-            
-            return users_with_pairs
+            return active_pair_users(session, timezones=ctx.get("timezones"))
         finally:
             session.close()
 
@@ -35,7 +27,7 @@ class MorningReminderRule:
         # Проверяем, заходил ли пользователь в приложение за последние 4 часа
         session = SessionLocal()
         try:
-            four_hours_ago = datetime.now(timezone.utc) - timedelta(hours=4)
+            four_hours_ago = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=4)
             
             # Проверяем активность через UsageEvent за последние 4 часа
             recent_activity = session.query(UsageEvent).filter(
@@ -49,11 +41,20 @@ class MorningReminderRule:
         finally:
             session.close()
 
+    def select_eligible(self, ctx: Dict[str, Any]) -> List[User]:
+        """Получатели с учётом активности: один запрос вместо проверки по каждому"""
+        session = SessionLocal()
+        try:
+            return active_pair_users(session, inactive_for=timedelta(hours=4), timezones=ctx.get("timezones"))
+        finally:
+            session.close()
+
     def cooldown(self):
         return timedelta(hours=24)
 
     def make_dedupe(self, ctx: Dict[str, Any], user: User) -> Dict[str, Any]:
-        return {"entity_type": None, "entity_id": None, "date_bucket": date.today().isoformat()}
+        # День по местному времени получателя, а не сервера
+        return {"entity_type": None, "entity_id": None, "date_bucket": local_date(user, ctx.get("scheduled_at")).isoformat()}
 
     def render(self, ctx: Dict[str, Any], user: User) -> Dict[str, Any]:
         webapp_base_url = settings.TELEGRAM_WEBAPP_URL or "https://gallery.homoludens.photos/pulse_of_pair/"
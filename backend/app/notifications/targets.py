@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Collection, List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy import and_, exists, or_
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models import User, Pair, UsageEvent
+from app.models.pair import PairStatus
+
+logger = logging.getLogger(__name__)
+
+
+def local_slot(tz_name: str, now: datetime, slot_minutes: int) -> Optional[str]:
+    """Слот "ЧЧ:ММ" местного времени для момента now (UTC), None для неизвестной зоны"""
+    try:
+        local = now.astimezone(ZoneInfo(tz_name))
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+    minute = local.minute - local.minute % slot_minutes
+    return f"{local.hour:02d}:{minute:02d}"
+
+
+def local_date(user: User, now: Optional[datetime] = None) -> date:
+    """Дата по местному времени пользователя (User.timezone или DEFAULT_TIMEZONE)"""
+    now = now or datetime.now(timezone.utc)
+    try:
+        zone = ZoneInfo(user.timezone or settings.DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        zone = ZoneInfo(settings.DEFAULT_TIMEZONE)
+    return now.astimezone(zone).date()
+
+
+def due_timezones(session: Session, local_time: str, now: Optional[datetime] = None) -> List[Optional[str]]:
+    """Часовые пояса пользователей, у которых сейчас слот local_time.
+
+    Один запрос DISTINCT по User.timezone; None в ответе — пользователи без
+    пояса (для них действует settings.DEFAULT_TIMEZONE).
+    """
+    now = now or datetime.now(timezone.utc)
+    slot_minutes = settings.NOTIFICATION_SLOT_MINUTES
+    due: List[Optional[str]] = []
+    for (tz_name,) in session.query(User.timezone).distinct():
+        slot = local_slot(tz_name or settings.DEFAULT_TIMEZONE, now, slot_minutes)
+        if slot is None:
+            logger.warning(f"⚠️ Неизвестный часовой пояс пользователя: {tz_name}")
+        elif slot == local_time:
+            due.append(tz_name)
+    return due
+
+
+def active_pair_users(
+    session: Session,
+    inactive_for: Optional[timedelta] = None,
+    timezones: Optional[Collection[Optional[str]]] = None,
+) -> List[User]:
+    """Пользователи с активной парой одним запросом.
+
+    inactive_for отсекает тех, кто заходил в приложение за указанный период
+    (по UsageEvent) — проверка идёт в том же запросе через NOT EXISTS.
+    timezones оставляет только пользователей из этих поясов (None в списке —
+    пользователи без пояса), см. due_timezones.
+    """
+    query = session.query(User).filter(
+        exists().where(
+            Pair.status == PairStatus.ACTIVE,
+            or_(Pair.user1_id == User.id, Pair.user2_id == User.id),
+        )
+    )
+    if timezones is not None:
+        named = [tz for tz in timezones if tz is not None]
+        conditions = [User.timezone.in_(named)] if named else []
+        if None in timezones:
+            conditions.append(User.timezone.is_(None))
+        if not conditions:
+            return []
+        query = query.filter(or_(*conditions))
+    if inactive_for is not None:
+        # UsageEvent.ts хранится в UTC без таймзоны
+        since = datetime.now(timezone.utc).replace(tzinfo=None) - inactive_for
+        query = query.filter(
+            ~exists().where(
+                and_(UsageEvent.telegram_id == User.telegram_id, UsageEvent.ts >= since)
+            )
+        )
+    return query.order_by(User.id).all()
@@ -1,6 +1,8 @@
 from datetime import datetime
 from typing import Optional, Dict, Any
-from pydantic import BaseModel
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from pydantic import BaseModel, field_validator
 
 
 class UserBase(BaseModel):
@@ -25,14 +27,27 @@ class UserUpdate(BaseModel):
     last_name: Optional[str] = None
     username: Optional[str] = None
     settings_json: Optional[Dict[str, Any]] = None
+    timezone: Optional[str] = None
     is_active: Optional[bool] = None
 
+    @field_validator("timezone")
+    @classmethod
+    def validate_timezone(cls, value: Optional[str]) -> Optional[str]:
+        if value is None:
+            return value
+        try:
+            ZoneInfo(value)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError("Неизвестный часовой пояс")
+        return value
+
 
 class User(UserBase):
     id: int
     telegram_id: int
     created_at: datetime
     settings_json: Dict[str, Any]
+    timezone: Optional[str] = None
     is_active: bool
 
     class Config:
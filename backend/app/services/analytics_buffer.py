@@ -0,0 +1,307 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.analytics import UsageEvent
+
+logger = logging.getLogger(__name__)
+
+SPILL_PATTERN = "usage_events-*.jsonl"
+REPLAY_PATTERN = SPILL_PATTERN + ".*.replay"
+
+
+class AnalyticsBuffer:
+	"""Единый приёмник событий аналитики с пакетной записью в БД.
+
+	Middleware кладёт события в ограниченную очередь (без ожидания), а один
+	долгоживущий фоновый таск сбрасывает их пачками одним многострочным
+	INSERT — по достижении batch_size или раз в flush_interval секунд. Запись
+	идёт в отдельном потоке, чтобы не занимать пул потоков FastAPI.
+
+	Если БД недоступна, пачка дописывается в локальный файл (spill_dir) и
+	переигрывается в БД, как только запись снова проходит. Без spill_dir
+	неудачная пачка возвращается в очередь. Если очередь переполнена, новые
+	события отбрасываются и учитываются в счётчике dropped.
+	"""
+
+	def __init__(
+		self,
+		session_factory: Callable[[], Session] = SessionLocal,
+		max_size: int = 10000,
+		batch_size: int = 500,
+		flush_interval: float = 2.0,
+		spill_dir: Optional[str] = None,
+	):
+		self.session_factory = session_factory
+		self.max_size = max_size
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.spill_dir = spill_dir or None
+		self._events: Deque[Dict[str, Any]] = deque()
+		self._wakeup: Optional[asyncio.Event] = None
+		self._task: Optional[asyncio.Task] = None
+		self._executor: Optional[ThreadPoolExecutor] = None
+		self._closed = False
+		if self.spill_dir:
+			self._recover_replays()
+		self._spill_pending = bool(self.spill_dir and self._spill_files())
+		self.dropped = 0
+		self.corrupt = 0
+		self.flushed = 0
+		self.failed_flushes = 0
+		self.spilled = 0
+		self.replayed = 0
+		self.last_flush_ms: Optional[float] = None
+		self.max_flush_ms: Optional[float] = None
+		self._flush_ms_total = 0.0
+		self._flush_count = 0
+
+	def record(self, event: Dict[str, Any]) -> bool:
+		"""Добавляет событие в буфер. Возвращает False, если событие отброшено."""
+		if self._closed or len(self._events) >= self.max_size:
+			self.dropped += 1
+			return False
+		self._events.append(event)
+		self._ensure_started()
+		if len(self._events) >= self.batch_size and self._wakeup is not None:
+			self._wakeup.set()
+		return True
+
+	def _ensure_started(self) -> None:
+		if self._task is not None:
+			return
+		try:
+			loop = asyncio.get_running_loop()
+		except RuntimeError:
+			return  # Вне event loop — события дождутся start() или stop()
+		self._wakeup = asyncio.Event()
+		self._task = loop.create_task(self._run())
+
+	async def start(self) -> None:
+		self._closed = False
+		self._ensure_started()
+
+	async def stop(self) -> None:
+		"""Останавливает фоновый таск и сбрасывает всё, что осталось в буфере"""
+		self._closed = True
+		if self._task is not None:
+			self._task.cancel()
+			try:
+				await self._task
+			except asyncio.CancelledError:
+				pass
+			self._task = None
+			self._wakeup = None
+		while self._events:
+			# При включённом spill неудачная пачка уходит в файл, а не обратно в очередь
+			if not await self.flush() and not self.spill_dir:
+				break
+		if self._events:
+			self.dropped += len(self._events)
+			logger.warning(f"Analytics: {len(self._events)} events lost on shutdown")
+			self._events.clear()
+		if self._executor is not None:
+			self._executor.shutdown(wait=True)
+			self._executor = None
+
+	async def _run(self) -> None:
+		while True:
+			try:
+				await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+			except asyncio.TimeoutError:
+				pass
+			self._wakeup.clear()
+			try:
+				while self._events:
+					if not await self.flush() or len(self._events) < self.batch_size:
+						break
+				if self._spill_pending:
+					await self.replay_spill()
+			except asyncio.CancelledError:
+				raise
+			except Exception as e:
+				# Таск должен жить всё время работы приложения
+				logger.error(f"Analytics: drainer error: {e}")
+
+	def _run_in_executor(self, func, *args):
+		if self._executor is None:
+			self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="analytics")
+		return asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+	async def flush(self) -> bool:
+		"""Записывает одну пачку событий. Возвращает False, если БД недоступна."""
+		if not self._events:
+			return True
+		batch = [self._events.popleft() for _ in range(min(self.batch_size, len(self._events)))]
+		start = time.perf_counter()
+		try:
+			await self._run_in_executor(self._insert_batch, batch)
+		except Exception as e:
+			self.failed_flushes += 1
+			logger.error(f"Analytics: failed to flush {len(batch)} events: {e}")
+			if self.spill_dir:
+				await self._run_in_executor(self._spill, batch)
+			else:
+				# Возвращаем пачку в начало очереди, насколько позволяет место
+				room = max(self.max_size - len(self._events), 0)
+				self._events.extendleft(reversed(batch[:room]))
+				self.dropped += len(batch) - min(room, len(batch))
+			return False
+		self._observe_flush((time.perf_counter() - start) * 1000)
+		self.flushed += len(batch)
+		if self._spill_pending:
+			await self.replay_spill()
+		return True
+
+	def _observe_flush(self, elapsed_ms: float) -> None:
+		self.last_flush_ms = elapsed_ms
+		self.max_flush_ms = elapsed_ms if self.max_flush_ms is None else max(self.max_flush_ms, elapsed_ms)
+		self._flush_ms_total += elapsed_ms
+		self._flush_count += 1
+
+	def _insert_batch(self, batch: List[Dict[str, Any]]) -> None:
+		session = self.session_factory()
+		try:
+			session.execute(insert(UsageEvent.__table__).values(batch))
+			session.commit()
+		except Exception:
+			session.rollback()
+			raise
+		finally:
+			session.close()
+
+	# --- Локальный файл на время недоступности БД ---
+
+	def _spill_path(self) -> str:
+		return os.path.join(self.spill_dir, f"usage_events-{os.getpid()}.jsonl")
+
+	def _spill_files(self) -> List[str]:
+		return sorted(glob.glob(os.path.join(self.spill_dir, SPILL_PATTERN)))
+
+	def _spill(self, batch: List[Dict[str, Any]]) -> None:
+		try:
+			os.makedirs(self.spill_dir, exist_ok=True)
+			with open(self._spill_path(), "a", encoding="utf-8") as f:
+				for event in batch:
+					f.write(json.dumps({**event, "ts": event["ts"].isoformat()}) + "\n")
+		except OSError as e:
+			self.dropped += len(batch)
+			logger.error(f"Analytics: failed to spill {len(batch)} events: {e}")
+			return
+		self.spilled += len(batch)
+		self._spill_pending = True
+
+	async def replay_spill(self) -> int:
+		"""Переносит события из локальных файлов в БД. Возвращает число записанных событий."""
+		if not self.spill_dir:
+			return 0
+		try:
+			replayed = await self._run_in_executor(self._replay_files)
+		except Exception as e:
+			logger.warning(f"Analytics: spill replay postponed: {e}")
+			return 0
+		self._spill_pending = False
+		if replayed:
+			self.replayed += replayed
+			logger.info(f"Analytics: replayed {replayed} spilled events")
+		return replayed
+
+	def _replay_files(self) -> int:
+		replayed = 0
+		for path in self._spill_files():
+			# Файл забирается переименованием, чтобы его не переиграли два воркера сразу
+			claimed = f"{path}.{os.getpid()}.replay"
+			try:
+				os.rename(path, claimed)
+			except FileNotFoundError:
+				continue
+			events = self._read_spill(claimed)
+			for offset in range(0, len(events), self.batch_size):
+				try:
+					self._insert_batch(events[offset:offset + self.batch_size])
+				except Exception:
+					# Недописанный остаток возвращается в файл этого процесса
+					self._spill(events[offset:])
+					os.remove(claimed)
+					raise
+				replayed += min(self.batch_size, len(events) - offset)
+			os.remove(claimed)
+		return replayed
+
+	def _read_spill(self, path: str) -> List[Dict[str, Any]]:
+		"""События файла; обрезанные строки (падение посреди записи) пропускаются"""
+		events, corrupt = [], 0
+		with open(path, encoding="utf-8", errors="replace") as f:
+			for line in f:
+				if not line.strip():
+					continue
+				try:
+					event = json.loads(line)
+					event["ts"] = datetime.fromisoformat(event["ts"])
+				except (ValueError, TypeError, KeyError):
+					corrupt += 1
+					continue
+				events.append(event)
+		if corrupt:
+			self.corrupt += corrupt
+			logger.warning(f"Analytics: skipped {corrupt} corrupt lines in {path}")
+		return events
+
+	def _recover_replays(self) -> None:
+		"""Возвращает в очередь файлы, которые начал переигрывать и не закончил умерший процесс"""
+		for path in glob.glob(os.path.join(self.spill_dir, REPLAY_PATTERN)):
+			owner = path.rsplit(".", 2)[-2]
+			# Свой PID при старте — тоже остаток прошлого запуска (в контейнере PID повторяется)
+			if owner.isdigit() and int(owner) != os.getpid() and _pid_alive(int(owner)):
+				continue
+			try:
+				os.rename(path, f"{path[:-len('.replay')]}.recovered.jsonl")
+			except FileNotFoundError:
+				continue
+			logger.warning(f"Analytics: recovered unfinished spill replay {path}")
+
+	def stats(self) -> Dict[str, Any]:
+		return {
+			"buffered": len(self._events),
+			"max_size": self.max_size,
+			"dropped": self.dropped,
+			"flushed": self.flushed,
+			"failed_flushes": self.failed_flushes,
+			"spilled": self.spilled,
+			"replayed": self.replayed,
+			"corrupt": self.corrupt,
+			"spill_pending": self._spill_pending,
+			"last_flush_ms": self.last_flush_ms,
+			"max_flush_ms": self.max_flush_ms,
+			"avg_flush_ms": self._flush_ms_total / self._flush_count if self._flush_count else None,
+		}
+
+
+def _pid_alive(pid: int) -> bool:
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		return True
+	return True
+
+
+analytics_buffer = AnalyticsBuffer(
+	max_size=settings.ANALYTICS_BUFFER_SIZE,
+	batch_size=settings.ANALYTICS_BATCH_SIZE,
+	flush_interval=settings.ANALYTICS_FLUSH_INTERVAL,
+	spill_dir=settings.ANALYTICS_SPILL_DIR,
+)
@@ -2,12 +2,15 @@ import hashlib
 import hmac
 import json
 import time
+from dataclasses import dataclass
+from functools import lru_cache
 from typing import Optional
 from urllib.parse import parse_qsl
 import logging
 from fastapi import HTTPException, status, Depends, Header, Request
 from sqlalchemy.orm import Session
 
+from app.core.cache import TTLCache
 from app.core.database import get_db
 from app.core.config import settings
 from app.models import User
@@ -16,8 +19,86 @@ from app.models import User
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class VerifiedInitData:
+    """Результат проверки initData, который хранится в кеше"""
+    data: dict
+    telegram_id: Optional[int]
+    user_id: Optional[int] = None  # users.id; сама строка читается в каждом запросе
+
+
+# Кеш проверенных initData: ключ — sha256 от строки initData.
+# Время жизни записи не превышает срока действия подписи (auth_date + TELEGRAM_AUTH_MAX_AGE).
+_init_data_cache: TTLCache[VerifiedInitData] = TTLCache(
+    max_size=settings.AUTH_CACHE_MAX_SIZE,
+    ttl=settings.AUTH_CACHE_TTL,
+    clock=time.time,
+)
+
+
+@lru_cache(maxsize=4)
+def _webapp_secret_key(bot_token: str) -> bytes:
+    """Секретный ключ WebAppData вычисляется один раз на токен бота"""
+    return hmac.new(
+        "WebAppData".encode(),
+        bot_token.encode(),
+        hashlib.sha256
+    ).digest()
+
+
+def _init_data_key(init_data: str) -> str:
+    return hashlib.sha256(init_data.encode()).hexdigest()
+
+
+def _parse_telegram_user(data_dict: dict) -> dict:
+    """Достаёт объект user из initData (user приходит как JSON-строка)"""
+    raw_user = data_dict.get('user')
+    if isinstance(raw_user, str):
+        try:
+            user_obj = json.loads(raw_user)
+        except Exception:
+            return {}
+        return user_obj if isinstance(user_obj, dict) else {}
+    if isinstance(raw_user, dict):
+        return raw_user
+    return {}
+
+
+def _verify_init_data(init_data: str) -> VerifiedInitData:
+    """Проверяет initData с учётом кеша и возвращает запись кеша"""
+    key = _init_data_key(init_data)
+    cached = _init_data_cache.get(key)
+    if cached is not None:
+        return cached
+
+    data_dict = _verify_signature(init_data)
+    entry = VerifiedInitData(
+        data=data_dict,
+        telegram_id=_parse_telegram_user(data_dict).get('id'),
+    )
+
+    # Запись не должна пережить срок действия подписи
+    ttl = None
+    auth_date = data_dict.get('auth_date')
+    if auth_date:
+        ttl = int(auth_date) + settings.TELEGRAM_AUTH_MAX_AGE - time.time()
+    _init_data_cache.set(key, entry, ttl=ttl)
+    return entry
+
+
+def cached_telegram_id(init_data: str) -> Optional[int]:
+    """telegram_id из уже проверенных initData или None, если их нет в кеше"""
+    cached = _init_data_cache.get(_init_data_key(init_data))
+    return cached.telegram_id if cached is not None else None
+
+
 def verify_telegram_webapp_data(init_data: str) -> dict:
     """Проверяет подпись данных от Telegram Web App"""
+    return dict(_verify_init_data(init_data).data)
+
+
+def _verify_signature(init_data: str) -> dict:
+    """Разбирает initData и проверяет HMAC-подпись"""
     try:
         # Разбираем init_data (URL-decoded пары key=value)
         pairs = dict(parse_qsl(init_data, keep_blank_values=True))
@@ -28,7 +109,7 @@ def verify_telegram_webapp_data(init_data: str) -> dict:
         if auth_date:
             try:
                 auth_timestamp = int(auth_date)
-                if time.time() - auth_timestamp > 3600:  # 60 минут
+                if time.time() - auth_timestamp > settings.TELEGRAM_AUTH_MAX_AGE:
                     raise HTTPException(
                         status_code=status.HTTP_401_UNAUTHORIZED,
                         detail="Данные аутентификации устарели"
@@ -52,16 +133,9 @@ def verify_telegram_webapp_data(init_data: str) -> dict:
                 detail="Bot token не настроен"
             )
         
-        # Вычисляем секретный ключ
-        secret_key = hmac.new(
-            "WebAppData".encode(),
-            bot_token.encode(),
-            hashlib.sha256
-        ).digest()
-        
         # Проверяем подпись
         data_hash = hmac.new(
-            secret_key,
+            _webapp_secret_key(bot_token),
             data_check_string.encode(),
             hashlib.sha256
         ).hexdigest()
@@ -94,43 +168,20 @@ def get_current_user(
             detail="Отсутствуют данные Telegram"
         )
     
-    # Проверяем подпись
-    telegram_data = verify_telegram_webapp_data(x_telegram_init_data)
-    
-    # Получаем user_id из данных (user приходит как JSON-строка)
-    raw_user = telegram_data.get('user')
-    user_obj = {}
-    if isinstance(raw_user, str):
-        try:
-            user_obj = json.loads(raw_user)
-        except Exception:
-            user_obj = {}
-    elif isinstance(raw_user, dict):
-        user_obj = raw_user
-
-    user_id = None
-    if isinstance(user_obj, dict):
-        user_id = user_obj.get('id')
+    # Проверяем подпись (повторные запросы с теми же initData берутся из кеша)
+    verified = _verify_init_data(x_telegram_init_data)
+    user_id = verified.telegram_id
     if not user_id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Не удалось получить ID пользователя"
         )
     
-    # Находим или создаём пользователя
-    user = db.query(User).filter(User.telegram_id == user_id).first()
-    if not user:
-        # Создаём нового пользователя
-        user_data = user_obj if isinstance(user_obj, dict) else {}
-        user = User(
-            telegram_id=user_id,
-            first_name=user_data.get('first_name', ''),
-            last_name=user_data.get('last_name'),
-            username=user_data.get('username')
-        )
-        db.add(user)
-        db.commit()
-        db.refresh(user)
+    # Для initData из кеша — выборка по первичному ключу вместо поиска по telegram_id
+    user = db.get(User, verified.user_id) if verified.user_id is not None else None
+    if user is None:
+        user = _load_or_create_user(db, user_id, _parse_telegram_user(verified.data))
+        verified.user_id = user.id
     
     # Прокидываем telegram_id в request.state для аналитики
     try:
@@ -141,3 +192,19 @@ def get_current_user(
         pass
 
     return user
+
+
+def _load_or_create_user(db: Session, telegram_id: int, user_data: dict) -> User:
+    """Находит пользователя по telegram_id или создаёт нового"""
+    user = db.query(User).filter(User.telegram_id == telegram_id).first()
+    if not user:
+        user = User(
+            telegram_id=telegram_id,
+            first_name=user_data.get('first_name', ''),
+            last_name=user_data.get('last_name'),
+            username=user_data.get('username')
+        )
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+    return user
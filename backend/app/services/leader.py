@@ -0,0 +1,65 @@
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import delete, or_
+from sqlalchemy.engine import Engine
+
+from app.core.database import engine as default_engine
+from app.models import SchedulerLease
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class LeaderLease:
+    """Аренда лидерства в общей БД (таблица scheduler_leases).
+
+    try_acquire — один атомарный UPSERT: строка переходит к нам, только если
+    она уже наша (продление) или чужая аренда истекла. Поэтому среди всех
+    воркеров и реплик лидер один, а после падения лидера его место занимает
+    другой процесс не позже чем через ttl секунд. Часы процессов должны
+    расходиться заметно меньше ttl.
+    """
+
+    def __init__(
+        self,
+        engine: Optional[Engine] = None,
+        name: str = "scheduler",
+        ttl: int = 60,
+        holder: Optional[str] = None,
+    ):
+        self.engine = engine or default_engine
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        if self.engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        elif self.engine.dialect.name == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            raise ValueError(f"Unsupported lease storage: {self.engine.dialect.name}")
+        self._insert = insert
+
+    def try_acquire(self, now: Optional[datetime] = None) -> bool:
+        """Захватывает или продлевает аренду. True — этот процесс лидер."""
+        now = now or _utcnow()
+        table = SchedulerLease.__table__
+        expires_at = now + timedelta(seconds=self.ttl)
+        stmt = self._insert(table).values(name=self.name, holder=self.holder, expires_at=expires_at)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.name],
+            set_={"holder": self.holder, "expires_at": expires_at},
+            where=or_(table.c.holder == self.holder, table.c.expires_at < now),
+        ).returning(table.c.holder)
+        with self.engine.begin() as conn:
+            return conn.execute(stmt).first() is not None
+
+    def release(self) -> None:
+        """Отдаёт аренду (при штатной остановке), чтобы другой процесс не ждал ttl"""
+        table = SchedulerLease.__table__
+        with self.engine.begin() as conn:
+            conn.execute(delete(table).where(table.c.name == self.name, table.c.holder == self.holder))
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional, Dict, Any, List, Tuple
 
+from sqlalchemy import func, insert
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
@@ -11,6 +14,8 @@ from app.core.database import SessionLocal
 from app.models import Notification, User, Pair
 from .telegram import TelegramService
 
+logger = logging.getLogger(__name__)
+
 
 @dataclass
 class SendResult:
@@ -18,12 +23,39 @@ class SendResult:
     reason: Optional[str] = None
 
 
+@dataclass
+class NotificationRequest:
+    """Одно уведомление для send_many (те же поля, что у send)"""
+    n_type: str
+    recipient: User
+    text: str
+    reply_markup: Optional[Dict[str, Any]] = None
+    pair: Optional[Pair] = None
+    actor: Optional[User] = None
+    entity_type: Optional[str] = None
+    entity_id: Optional[int] = None
+    date_bucket: Optional[str] = None
+    cooldown: Optional[timedelta] = None
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+def _naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
 class NotificationService:
-    def __init__(self, telegram: Optional[TelegramService] = None):
+    def __init__(
+        self,
+        telegram: Optional[TelegramService] = None,
+        session_factory: Callable[[], Session] = SessionLocal,
+    ):
         self.telegram = telegram or TelegramService()
+        self.session_factory = session_factory
 
     def _open_session(self) -> Session:
-        return SessionLocal()
+        return self.session_factory()
 
     def _make_dedupe_key(
         self,
@@ -57,51 +89,198 @@ class NotificationService:
         cooldown: Optional[timedelta] = None,
         metadata: Optional[Dict[str, Any]] = None,
     ) -> SendResult:
-        if not recipient.telegram_id:
-            return SendResult(False, "no_telegram_id")
-
-        dedupe_key = self._make_dedupe_key(
-            n_type, recipient.id, entity_type, entity_id, date_bucket
+        request = NotificationRequest(
+            n_type=n_type,
+            recipient=recipient,
+            text=text,
+            reply_markup=reply_markup,
+            pair=pair,
+            actor=actor,
+            entity_type=entity_type,
+            entity_id=entity_id,
+            date_bucket=date_bucket,
+            cooldown=cooldown,
+            metadata=metadata or {},
         )
+        return (await self.send_many([request]))[0]
+
+    async def send_many(
+        self,
+        requests: List[NotificationRequest],
+        concurrency: Optional[int] = None,
+    ) -> List[SendResult]:
+        """Отправляет пачку уведомлений.
+
+        Кулдауны всей пачки проверяются одним сгруппированным запросом.
+        Уведомления с date_bucket сначала «занимают» свой dedupe_key вставкой
+        в notifications (уникальный индекс, ON CONFLICT DO NOTHING) — повторная
+        или параллельная отправка того же ключа невозможна. Остальные успешные
+        отправки записываются одним INSERT. Результаты идут в порядке requests.
+        """
+        results: List[Optional[SendResult]] = [None] * len(requests)
+        keys: List[Optional[str]] = [None] * len(requests)
+        pending: List[int] = []
+
+        for i, request in enumerate(requests):
+            if not request.recipient.telegram_id:
+                results[i] = SendResult(False, "no_telegram_id")
+                continue
+            if request.date_bucket:
+                keys[i] = self._make_dedupe_key(
+                    request.n_type, request.recipient.id, request.entity_type, request.entity_id, request.date_bucket
+                )
+            pending.append(i)
 
         session = self._open_session()
         try:
             # Проверка кулдауна по типу/получателю/сущности
-            q = session.query(Notification).filter(
-                Notification.type == n_type,
-                Notification.recipient_user_id == recipient.id,
-            )
-            if entity_type:
-                q = q.filter(Notification.entity_type == entity_type)
-            if entity_id is not None:
-                q = q.filter(Notification.entity_id == entity_id)
-
-            if cooldown:
-                cutoff = datetime.utcnow() - cooldown
-                q = q.filter(Notification.sent_at >= cutoff)
-
-            recently = q.order_by(Notification.sent_at.desc()).first()
-            if recently:
-                return SendResult(False, "cooldown")
+            for i in self._on_cooldown(session, [requests[i] for i in pending], pending):
+                results[i] = SendResult(False, "cooldown")
+            pending = [i for i in pending if results[i] is None]
+
+            # Дубликаты ключа внутри самой пачки
+            seen = set()
+            for i in pending:
+                if keys[i] is not None:
+                    if keys[i] in seen:
+                        results[i] = SendResult(False, "duplicate")
+                    seen.add(keys[i])
+            pending = [i for i in pending if results[i] is None]
+
+            claimed = self._claim(session, requests, keys, [i for i in pending if keys[i] is not None])
+            for i in pending:
+                if keys[i] is not None and keys[i] not in claimed:
+                    results[i] = SendResult(False, "duplicate")
+            pending = [i for i in pending if results[i] is None]
 
             # Отправка
-            await self.telegram.send_message(chat_id=recipient.telegram_id, text=text, reply_markup=reply_markup)
-
-            # Лог
-            record = Notification(
-                type=n_type,
-                recipient_user_id=recipient.id,
-                pair_id=pair.id if pair else None,
-                actor_user_id=actor.id if actor else None,
-                entity_type=entity_type,
-                entity_id=entity_id,
-                metadata_json=metadata or {},
-            )
-            session.add(record)
-            session.commit()
+            semaphore = asyncio.Semaphore(concurrency or settings.NOTIFICATION_SEND_CONCURRENCY)
+
+            async def deliver(i: int) -> SendResult:
+                request = requests[i]
+                async with semaphore:
+                    try:
+                        await self.telegram.send_message(
+                            chat_id=request.recipient.telegram_id,
+                            text=request.text,
+                            reply_markup=request.reply_markup,
+                        )
+                    except Exception as e:
+                        logger.error(f"❌ Ошибка отправки {request.n_type} пользователю {request.recipient.id}: {e}")
+                        return SendResult(False, "error")
+                return SendResult(True)
+
+            for i, result in zip(pending, await asyncio.gather(*(deliver(i) for i in pending))):
+                results[i] = result
 
-            return SendResult(True)
+            # Лог: неудачные отправки освобождают ключ, остальные успешные пишутся одной вставкой
+            failed_keys = [keys[i] for i in pending if keys[i] is not None and not results[i].sent]
+            if failed_keys:
+                session.query(Notification).filter(
+                    Notification.dedupe_key.in_(failed_keys)
+                ).delete(synchronize_session=False)
+            rows = [self._row(requests[i], None) for i in pending if keys[i] is None and results[i].sent]
+            if rows:
+                session.execute(insert(Notification), rows)
+            session.commit()
         finally:
             session.close()
 
+        return results
+
+    def _row(self, request: NotificationRequest, dedupe_key: Optional[str]) -> Dict[str, Any]:
+        return {
+            "type": request.n_type,
+            "recipient_user_id": request.recipient.id,
+            "pair_id": request.pair.id if request.pair else None,
+            "actor_user_id": request.actor.id if request.actor else None,
+            "entity_type": request.entity_type,
+            "entity_id": request.entity_id,
+            "dedupe_key": dedupe_key,
+            "metadata_json": request.metadata or {},
+        }
+
+    def _on_cooldown(self, session: Session, requests: List[NotificationRequest], indexes: List[int]) -> List[int]:
+        """Индексы запросов, для которых уже есть недавнее уведомление.
 
+        Запросы с кулдауном проверяются одним GROUP BY только по окну самого
+        длинного кулдауна (индекс recipient/type/sent_at); вся история
+        читается лишь для запросов без кулдауна.
+        """
+        if not requests:
+            return []
+        last_sent: Dict[Tuple[str, int], List[Tuple[Optional[str], Optional[int], datetime]]] = {}
+        timed = [r for r in requests if r.cooldown]
+        untimed = [r for r in requests if not r.cooldown]
+        if timed:
+            since = datetime.now(timezone.utc) - max(r.cooldown for r in timed)
+            self._collect_last_sent(session, timed, since, last_sent)
+        if untimed:
+            self._collect_last_sent(session, untimed, None, last_sent)
+
+        now = datetime.utcnow()
+        blocked = []
+        for index, request in zip(indexes, requests):
+            cutoff = now - request.cooldown if request.cooldown else None
+            for entity_type, entity_id, sent_at in last_sent.get((request.n_type, request.recipient.id), []):
+                if request.entity_type and entity_type != request.entity_type:
+                    continue
+                if request.entity_id is not None and entity_id != request.entity_id:
+                    continue
+                if cutoff is not None and (sent_at is None or _naive_utc(sent_at) < cutoff):
+                    continue
+                blocked.append(index)
+                break
+        return blocked
+
+    def _collect_last_sent(
+        self,
+        session: Session,
+        requests: List[NotificationRequest],
+        since: Optional[datetime],
+        last_sent: Dict[Tuple[str, int], List[Tuple[Optional[str], Optional[int], datetime]]],
+    ) -> None:
+        """Последняя отправка по типу/получателю/сущности (с since — только не раньше since)"""
+        query = session.query(
+            Notification.type,
+            Notification.recipient_user_id,
+            Notification.entity_type,
+            Notification.entity_id,
+            func.max(Notification.sent_at),
+        ).filter(
+            Notification.type.in_({r.n_type for r in requests}),
+            Notification.recipient_user_id.in_({r.recipient.id for r in requests}),
+        )
+        if since is not None:
+            query = query.filter(Notification.sent_at >= since)
+        rows = query.group_by(
+            Notification.type,
+            Notification.recipient_user_id,
+            Notification.entity_type,
+            Notification.entity_id,
+        ).all()
+        for n_type, recipient_id, entity_type, entity_id, sent_at in rows:
+            last_sent.setdefault((n_type, recipient_id), []).append((entity_type, entity_id, sent_at))
+
+    def _claim(
+        self,
+        session: Session,
+        requests: List[NotificationRequest],
+        keys: List[Optional[str]],
+        indexes: List[int],
+    ) -> set:
+        """Вставляет записи с dedupe_key, пропуская уже существующие. Возвращает занятые ключи."""
+        if not indexes:
+            return set()
+        dialect = session.get_bind().dialect.name
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(Notification).values(
+            [self._row(requests[i], keys[i]) for i in indexes]
+        ).on_conflict_do_nothing(index_elements=["dedupe_key"]).returning(Notification.dedupe_key)
+        claimed = set(session.execute(stmt).scalars())
+        # Ключи фиксируются сразу: параллельный отправитель увидит их до нашей отправки
+        session.commit()
+        return claimed
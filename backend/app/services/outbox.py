@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, insert, or_
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models import NotificationOutbox, OutboxStatus, Pair, User
+from .notifications import NotificationRequest, NotificationService, SendResult
+
+logger = logging.getLogger(__name__)
+
+# Приоритет уведомлений, вызванных действием пользователя (выше правил расписания)
+INTERACTIVE_PRIORITY = 200
+
+# Причины отказа NotificationService, при которых повтор бессмысленен
+_SKIP_REASONS = {"no_telegram_id", "cooldown", "duplicate"}
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _outbox_row(request: NotificationRequest, priority: int, delay: float = 0) -> Dict[str, Any]:
+    return {
+        "status": OutboxStatus.PENDING,
+        "priority": priority,
+        "type": request.n_type,
+        "recipient_user_id": request.recipient.id,
+        "pair_id": request.pair.id if request.pair else None,
+        "actor_user_id": request.actor.id if request.actor else None,
+        "entity_type": request.entity_type,
+        "entity_id": request.entity_id,
+        "date_bucket": request.date_bucket,
+        "cooldown_seconds": int(request.cooldown.total_seconds()) if request.cooldown else None,
+        "text": request.text,
+        "reply_markup": request.reply_markup,
+        "metadata_json": request.metadata or {},
+        "attempts": 0,
+        "max_attempts": settings.OUTBOX_MAX_ATTEMPTS,
+        "available_at": _utcnow() + timedelta(seconds=delay),
+    }
+
+
+def enqueue_notification(db: Session, *, priority: int = 0, **fields: Any) -> NotificationOutbox:
+    """Ставит уведомление в outbox в транзакции вызывающего (коммит — за ним).
+
+    Поля те же, что у NotificationService.send.
+    """
+    entry = NotificationOutbox(**_outbox_row(NotificationRequest(**fields), priority))
+    db.add(entry)
+    return entry
+
+
+def enqueue_many(db: Session, requests: List[NotificationRequest], priority: int = 0, spread: float = 0) -> int:
+    """Ставит пачку уведомлений в outbox одним INSERT (коммит — за вызывающим).
+
+    spread > 0 откладывает каждое уведомление на случайное время в пределах
+    spread секунд, чтобы рассылка шла ровным потоком, а не одним пиком.
+    """
+    if not requests:
+        return 0
+    db.execute(insert(NotificationOutbox), [
+        _outbox_row(request, priority, random.uniform(0, spread) if spread > 0 else 0)
+        for request in requests
+    ])
+    return len(requests)
+
+
+class OutboxWorker:
+    """Пул фоновых воркеров, доставляющих уведомления из notification_outbox.
+
+    Каждый воркер забирает пачку готовых записей (SELECT ... FOR UPDATE SKIP
+    LOCKED по убыванию priority — на Postgres воркеры разных процессов не
+    мешают друг другу), переводит их в processing и отправляет через
+    NotificationService, который по-прежнему отвечает за кулдауны и
+    дедупликацию. Ошибка отправки возвращает запись в pending с
+    экспоненциальной задержкой; после max_attempts запись уходит в dead.
+    Запись, зависшая в processing дольше lease_seconds (процесс упал),
+    забирается снова.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        service: Optional[NotificationService] = None,
+        workers: int = 2,
+        batch_size: int = 50,
+        poll_interval: float = 5.0,
+        lease_seconds: int = 300,
+        retry_base: float = 30.0,
+    ):
+        self.session_factory = session_factory
+        self.service = service
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.retry_base = retry_base
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def _get_service(self) -> NotificationService:
+        if self.service is None:
+            self.service = NotificationService(session_factory=self.session_factory)
+        return self.service
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run(n)) for n in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._wakeup = None
+
+    def wake(self) -> None:
+        """Будит воркеры после коммита новых записей (иначе — ближайший опрос)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self, number: int) -> None:
+        while True:
+            try:
+                processed = await self.process_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Outbox worker {number}: {e}")
+                processed = 0
+            if processed:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def process_batch(self) -> int:
+        """Забирает и доставляет одну пачку. Возвращает число обработанных записей."""
+        claimed = await asyncio.to_thread(self._claim)
+        if not claimed:
+            return 0
+        ids = [entry_id for entry_id, _ in claimed]
+        results = await self._get_service().send_many([request for _, request in claimed])
+        await asyncio.to_thread(self._finish, ids, results)
+        return len(claimed)
+
+    def _claim(self) -> List[Tuple[int, NotificationRequest]]:
+        session = self.session_factory()
+        try:
+            now = _utcnow()
+            entries = session.query(NotificationOutbox).filter(or_(
+                and_(NotificationOutbox.status == OutboxStatus.PENDING, NotificationOutbox.available_at <= now),
+                and_(
+                    NotificationOutbox.status == OutboxStatus.PROCESSING,
+                    NotificationOutbox.locked_at < now - timedelta(seconds=self.lease_seconds),
+                ),
+            )).order_by(
+                NotificationOutbox.priority.desc(), NotificationOutbox.id
+            ).limit(self.batch_size).with_for_update(skip_locked=True).all()
+
+            claimed = []
+            for entry in entries:
+                if entry.attempts >= entry.max_attempts:
+                    # Зависла на последней попытке — больше не пробуем
+                    entry.status = OutboxStatus.DEAD
+                    entry.last_error = entry.last_error or "lease expired"
+                    entry.processed_at = datetime.now(timezone.utc)
+                    continue
+                entry.status = OutboxStatus.PROCESSING
+                entry.locked_at = now
+                entry.attempts += 1
+                claimed.append(entry)
+
+            result = self._to_requests(session, claimed)
+            session.commit()
+            return result
+        finally:
+            session.close()
+
+    def _to_requests(
+        self, session: Session, entries: List[NotificationOutbox]
+    ) -> List[Tuple[int, NotificationRequest]]:
+        """Собирает запросы для NotificationService: пользователи и пары — двумя запросами"""
+        if not entries:
+            return []
+        user_ids = {e.recipient_user_id for e in entries} | {e.actor_user_id for e in entries if e.actor_user_id}
+        pair_ids = {e.pair_id for e in entries if e.pair_id}
+        users = {u.id: u for u in session.query(User).filter(User.id.in_(user_ids))}
+        pairs = {p.id: p for p in session.query(Pair).filter(Pair.id.in_(pair_ids))} if pair_ids else {}
+        for obj in list(users.values()) + list(pairs.values()):
+            session.expunge(obj)
+
+        result = []
+        for e in entries:
+            if e.recipient_user_id not in users:
+                e.status = OutboxStatus.SKIPPED
+                e.last_error = "no_recipient"
+                e.processed_at = datetime.now(timezone.utc)
+                continue
+            result.append((e.id, NotificationRequest(
+                n_type=e.type,
+                recipient=users[e.recipient_user_id],
+                text=e.text,
+                reply_markup=e.reply_markup,
+                pair=pairs.get(e.pair_id),
+                actor=users.get(e.actor_user_id),
+                entity_type=e.entity_type,
+                entity_id=e.entity_id,
+                date_bucket=e.date_bucket,
+                cooldown=timedelta(seconds=e.cooldown_seconds) if e.cooldown_seconds else None,
+                metadata=e.metadata_json or {},
+            )))
+        return result
+
+    def _finish(self, ids: List[int], results: List[SendResult]) -> None:
+        session = self.session_factory()
+        try:
+            entries = {e.id: e for e in session.query(NotificationOutbox).filter(NotificationOutbox.id.in_(ids))}
+            now = _utcnow()
+            for entry_id, result in zip(ids, results):
+                entry = entries[entry_id]
+                entry.locked_at = None
+                if result.sent or result.reason in _SKIP_REASONS:
+                    entry.status = OutboxStatus.SENT if result.sent else OutboxStatus.SKIPPED
+                    entry.last_error = result.reason
+                    entry.processed_at = datetime.now(timezone.utc)
+                elif entry.attempts >= entry.max_attempts:
+                    entry.status = OutboxStatus.DEAD
+                    entry.last_error = result.reason
+                    entry.processed_at = datetime.now(timezone.utc)
+                    logger.warning(f"⚠️ Outbox: уведомление {entry.id} ({entry.type}) не доставлено за {entry.attempts} попыток")
+                else:
+                    entry.status = OutboxStatus.PENDING
+                    entry.last_error = result.reason
+                    delay = min(self.retry_base * 2 ** (entry.attempts - 1), 3600)
+                    entry.available_at = now + timedelta(seconds=delay)
+            session.commit()
+        finally:
+            session.close()
+
+
+outbox_worker = OutboxWorker(
+    workers=settings.OUTBOX_WORKERS,
+    batch_size=settings.OUTBOX_BATCH_SIZE,
+    poll_interval=settings.OUTBOX_POLL_INTERVAL,
+    lease_seconds=settings.OUTBOX_LEASE_SECONDS,
+    retry_base=settings.OUTBOX_RETRY_BASE,
+)
@@ -0,0 +1,92 @@
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from fastapi import Depends, Request
+from sqlalchemy import and_, case, or_
+from sqlalchemy.orm import Session, aliased
+
+from app.core.cache import TTLCache, detached_copy
+from app.core.config import settings
+from app.core.database import get_db
+from app.models import User, Pair
+from app.models.pair import PairStatus
+from app.services.auth import get_current_user
+
+
+@dataclass
+class PairContext:
+    """Пользователь запроса, его пара и партнёр"""
+    user: User
+    pair: Optional[Pair] = None
+    partner_id: Optional[int] = None
+    partner: Optional[User] = None
+
+    @property
+    def active_pair(self) -> Optional[Pair]:
+        """Пара, только если она активна"""
+        if self.pair is not None and self.pair.status == PairStatus.ACTIVE:
+            return self.pair
+        return None
+
+
+# user_id -> (снимок пары, снимок партнёра). Пользователи без пары не кешируются,
+# чтобы только что созданная пара была видна сразу и в других процессах.
+_pair_cache: TTLCache[Tuple[Pair, Optional[User]]] = TTLCache(
+    max_size=settings.PAIR_CONTEXT_CACHE_SIZE,
+    ttl=settings.PAIR_CONTEXT_CACHE_TTL,
+)
+
+
+def load_pair_context(db: Session, user: User) -> PairContext:
+    """Пара и партнёр пользователя одним запросом (или из кеша процесса)"""
+    cached = _pair_cache.get(user.id)
+    if cached is not None:
+        pair_snapshot, partner_snapshot = cached
+        pair = db.merge(pair_snapshot, load=False)
+        partner = db.merge(partner_snapshot, load=False) if partner_snapshot is not None else None
+        partner_id = pair.user2_id if pair.user1_id == user.id else pair.user1_id
+        return PairContext(user=user, pair=pair, partner_id=partner_id, partner=partner)
+
+    partner_alias = aliased(User)
+    row = db.query(Pair, partner_alias).outerjoin(
+        partner_alias,
+        or_(
+            and_(Pair.user1_id == user.id, partner_alias.id == Pair.user2_id),
+            and_(Pair.user2_id == user.id, partner_alias.id == Pair.user1_id),
+        )
+    ).filter(
+        or_(Pair.user1_id == user.id, Pair.user2_id == user.id)
+    ).order_by(
+        # Активная пара в приоритете, затем самая ранняя
+        case((Pair.status == PairStatus.ACTIVE, 0), else_=1),
+        Pair.id
+    ).first()
+
+    if row is None:
+        return PairContext(user=user)
+
+    pair, partner = row
+    partner_id = pair.user2_id if pair.user1_id == user.id else pair.user1_id
+    _pair_cache.set(user.id, (detached_copy(pair), detached_copy(partner) if partner is not None else None))
+    return PairContext(user=user, pair=pair, partner_id=partner_id, partner=partner)
+
+
+def invalidate_pair_context(*user_ids: int) -> None:
+    """Сбрасывает кеш пар для пользователей (и для тех, у кого они — партнёры)"""
+    ids = set(user_ids)
+    _pair_cache.discard_where(
+        lambda user_id, entry: user_id in ids or (entry[1] is not None and entry[1].id in ids)
+    )
+
+
+def get_pair_context(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+) -> PairContext:
+    """Зависимость FastAPI: контекст пары, вычисляется один раз на запрос"""
+    ctx = getattr(request.state, "pair_context", None)
+    if ctx is None or ctx.user.id != current_user.id:
+        ctx = load_pair_context(db, current_user)
+        request.state.pair_context = ctx
+    return ctx
@@ -0,0 +1,209 @@
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import and_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased
+
+from app.core.config import settings
+from app.models import Pair, Mood, PairContextSnapshot
+from app.models.tune import TuneAnswer
+
+
+def _day(value) -> date:
+    return value.date() if hasattr(value, "date") else value
+
+
+def _slot(pair: Pair, user_id: int) -> str:
+    return "user1" if pair.user1_id == user_id else "user2"
+
+
+def _window_start(today: Optional[date] = None) -> date:
+    return (today or date.today()) - timedelta(days=settings.GPT_CONTEXT_DAYS - 1)
+
+
+def _streaks(both_days: Iterable[date]) -> Dict[str, object]:
+    """Текущая (заканчивающаяся последним общим днём) и лучшая серии подряд"""
+    days = sorted(set(both_days))
+    current = best = 0
+    previous = None
+    for day in days:
+        current = current + 1 if previous is not None and day - previous == timedelta(days=1) else 1
+        best = max(best, current)
+        previous = day
+    return {"mood_streak": current, "mood_streak_best": best, "last_both_mood_date": previous}
+
+
+def _compute_snapshots(db: Session, pairs: List[Pair]) -> Dict[int, Dict[str, object]]:
+    """Считает снимки по исходным таблицам (используется для пересчёта)"""
+    if not pairs:
+        return {}
+
+    user_ids = {p.user1_id for p in pairs} | {p.user2_id for p in pairs}
+    days_by_user: Dict[int, Dict[date, str]] = {}
+    for user_id, mood_date, mood_code in (
+        db.query(Mood.user_id, Mood.date, Mood.mood_code)
+        .filter(Mood.user_id.in_(user_ids))
+        .order_by(Mood.date, Mood.id)
+    ):
+        days_by_user.setdefault(user_id, {})[_day(mood_date)] = mood_code
+
+    # Совпадения Сонастройки: ответ о себе и догадка партнёра по тому же вопросу
+    own, guess = aliased(TuneAnswer), aliased(TuneAnswer)
+    tune: Dict[int, List[int]] = {}
+    for pair_id, own_text, guess_text in (
+        db.query(own.pair_id, own.answer_text, guess.answer_text)
+        .join(guess, and_(
+            guess.pair_id == own.pair_id,
+            guess.question_id == own.question_id,
+            guess.subject_user_id == own.subject_user_id,
+            guess.author_user_id != own.author_user_id,
+        ))
+        .filter(own.pair_id.in_([p.id for p in pairs]), own.author_user_id == own.subject_user_id)
+    ):
+        counters = tune.setdefault(pair_id, [0, 0])
+        counters[0] += 1
+        counters[1] += int(own_text == guess_text)
+
+    since = _window_start()
+    result = {}
+    for pair in pairs:
+        first = days_by_user.get(pair.user1_id, {})
+        second = days_by_user.get(pair.user2_id, {})
+        mood_days: Dict[str, Dict[str, str]] = {}
+        for slot, days in (("user1", first), ("user2", second)):
+            for day, code in days.items():
+                if day >= since:
+                    mood_days.setdefault(day.isoformat(), {})[slot] = code
+        compared, matched = tune.get(pair.id, (0, 0))
+        result[pair.id] = {
+            "mood_days": mood_days,
+            "tune_compared": compared,
+            "tune_matched": matched,
+            **_streaks(set(first) & set(second)),
+        }
+    return result
+
+
+def rebuild_pair_snapshots(db: Session, pair_ids: Optional[Iterable[int]] = None) -> int:
+    """Пересчитывает pair_context_snapshots для указанных пар (или всех). Не коммитит."""
+    query = db.query(Pair)
+    if pair_ids is not None:
+        query = query.filter(Pair.id.in_(list(pair_ids)))
+    pairs = query.all()
+
+    for pair_id, fields in _compute_snapshots(db, pairs).items():
+        db.merge(PairContextSnapshot(pair_id=pair_id, **fields))
+    db.flush()
+    return len(pairs)
+
+
+def _locked_snapshot(db: Session, pair: Pair) -> Optional[PairContextSnapshot]:
+    """Строка снимка под блокировкой; если её нет — строит по исходным данным и возвращает None.
+
+    Блокировка строки (на Postgres) не даёт одновременным записям обоих
+    партнёров потерять обновление JSON или увеличение счётчика.
+    """
+    snapshot = db.query(PairContextSnapshot).filter(
+        PairContextSnapshot.pair_id == pair.id
+    ).with_for_update().populate_existing().first()
+    if snapshot is not None:
+        return snapshot
+    try:
+        with db.begin_nested():
+            rebuild_pair_snapshots(db, [pair.id])
+    except IntegrityError:
+        # Строку параллельно создал партнёр — обновляем её как обычно
+        return _locked_snapshot(db, pair)
+    return None
+
+
+def record_mood(db: Session, pair: Pair, user_id: int, day: date, mood_code: str) -> None:
+    """Учитывает настроение пользователя за день в снимке пары.
+
+    Вызывается в той же транзакции, что и запись Mood (после flush).
+    """
+    snapshot = _locked_snapshot(db, pair)
+    if snapshot is None:
+        return  # Снимок только что построен вместе с этим настроением
+
+    since = _window_start()
+    mood_days = {d: dict(slots) for d, slots in (snapshot.mood_days or {}).items() if d >= since.isoformat()}
+    if day >= since:
+        mood_days.setdefault(day.isoformat(), {})[_slot(pair, user_id)] = mood_code
+    snapshot.mood_days = mood_days
+
+    # Серия: день, когда настроение впервые отметили оба
+    if len(mood_days.get(day.isoformat(), {})) == 2 and (
+        snapshot.last_both_mood_date is None or day > snapshot.last_both_mood_date
+    ):
+        if snapshot.last_both_mood_date == day - timedelta(days=1):
+            snapshot.mood_streak += 1
+        else:
+            snapshot.mood_streak = 1
+        snapshot.mood_streak_best = max(snapshot.mood_streak_best, snapshot.mood_streak)
+        snapshot.last_both_mood_date = day
+
+
+def record_tune_answer(db: Session, pair: Pair, answer: TuneAnswer) -> None:
+    """Учитывает ответ Сонастройки: если у него есть пара (о себе / догадка) — сравнение.
+
+    Вызывается в той же транзакции, что и вставка TuneAnswer (после flush).
+    """
+    snapshot = _locked_snapshot(db, pair)
+    if snapshot is None:
+        return
+
+    if answer.author_user_id == answer.subject_user_id:
+        # Ответ о себе — ищем догадку партнёра
+        counterpart = db.query(TuneAnswer.answer_text).filter(
+            TuneAnswer.pair_id == pair.id,
+            TuneAnswer.question_id == answer.question_id,
+            TuneAnswer.subject_user_id == answer.subject_user_id,
+            TuneAnswer.author_user_id != answer.author_user_id,
+        ).scalar()
+    else:
+        # Догадка о партнёре — ищем его ответ о себе
+        counterpart = db.query(TuneAnswer.answer_text).filter(
+            TuneAnswer.pair_id == pair.id,
+            TuneAnswer.question_id == answer.question_id,
+            TuneAnswer.subject_user_id == answer.subject_user_id,
+            TuneAnswer.author_user_id == answer.subject_user_id,
+        ).scalar()
+    if counterpart is not None:
+        snapshot.tune_compared += 1
+        snapshot.tune_matched += int(counterpart == answer.answer_text)
+
+
+def ensure_pair_snapshot(db: Session, pair_id: int) -> None:
+    """Строит отсутствующий снимок пары в savepoint. Не коммитит."""
+    try:
+        with db.begin_nested():
+            rebuild_pair_snapshots(db, [pair_id])
+    except IntegrityError:
+        pass  # Снимок параллельно построил другой запрос — он и будет прочитан
+
+
+def get_pair_snapshot(db: Session, pair_id: int) -> Optional[PairContextSnapshot]:
+    """Снимок пары; отсутствующий строится по исходным данным и сохраняется"""
+    snapshot = db.get(PairContextSnapshot, pair_id)
+    if snapshot is None:
+        ensure_pair_snapshot(db, pair_id)
+        db.commit()
+        snapshot = db.get(PairContextSnapshot, pair_id)
+    return snapshot
+
+
+def current_streak(snapshot: PairContextSnapshot, today: Optional[date] = None) -> int:
+    """Серия на сегодня: прервана, если оба не отмечали настроение ни вчера, ни сегодня"""
+    today = today or date.today()
+    if snapshot.last_both_mood_date is None or snapshot.last_both_mood_date < today - timedelta(days=1):
+        return 0
+    return snapshot.mood_streak
+
+
+def mood_days_in_window(snapshot: PairContextSnapshot, today: Optional[date] = None) -> Dict[str, Dict[str, str]]:
+    """Дни снимка в пределах окна GPT_CONTEXT_DAYS (снимок неактивной пары может устареть)"""
+    since = _window_start(today).isoformat()
+    return {d: slots for d, slots in sorted((snapshot.mood_days or {}).items()) if d >= since}
+
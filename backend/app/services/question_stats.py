@@ -0,0 +1,119 @@
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import and_, exists, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased
+
+from app.models import Pair, Question, UserAnswer, PairQuestionStats
+
+
+def _compute_stats(db: Session, pairs: Iterable[Pair]) -> Dict[int, Dict[str, int]]:
+    """Считает счётчики по исходным таблицам (используется для пересчёта)"""
+    pairs = list(pairs)
+    if not pairs:
+        return {}
+
+    user_ids = {p.user1_id for p in pairs} | {p.user2_id for p in pairs}
+    per_user = dict(
+        db.query(UserAnswer.user_id, func.count(UserAnswer.id))
+        .filter(UserAnswer.user_id.in_(user_ids))
+        .group_by(UserAnswer.user_id)
+        .all()
+    )
+
+    first, second = aliased(UserAnswer), aliased(UserAnswer)
+    per_pair_both = dict(
+        db.query(Pair.id, func.count(first.id))
+        .join(first, first.user_id == Pair.user1_id)
+        .join(second, and_(second.user_id == Pair.user2_id, second.question_id == first.question_id))
+        .filter(Pair.id.in_([p.id for p in pairs]))
+        .group_by(Pair.id)
+        .all()
+    )
+
+    return {
+        p.id: {
+            "user1_answered": per_user.get(p.user1_id, 0),
+            "user2_answered": per_user.get(p.user2_id, 0),
+            "both_answered": per_pair_both.get(p.id, 0),
+        }
+        for p in pairs
+    }
+
+
+def rebuild_pair_question_stats(db: Session, pair_ids: Optional[Iterable[int]] = None) -> int:
+    """Пересчитывает pair_question_stats для указанных пар (или всех). Не коммитит."""
+    query = db.query(Pair)
+    if pair_ids is not None:
+        query = query.filter(Pair.id.in_(list(pair_ids)))
+    pairs = query.all()
+
+    for pair_id, counters in _compute_stats(db, pairs).items():
+        db.merge(PairQuestionStats(pair_id=pair_id, **counters))
+    db.flush()
+    return len(pairs)
+
+
+def ensure_pair_question_stats(db: Session, pair_id: int) -> None:
+    """Строит отсутствующую строку счётчиков пары в savepoint. Не коммитит."""
+    try:
+        with db.begin_nested():
+            rebuild_pair_question_stats(db, [pair_id])
+    except IntegrityError:
+        pass  # Строку параллельно создал другой запрос — она и будет прочитана
+
+
+def record_answer(db: Session, pair: Pair, user_id: int, question_id: int) -> None:
+    """Учитывает новый ответ пользователя в счётчиках пары.
+
+    Вызывается в той же транзакции, что и вставка UserAnswer (после flush).
+    UPDATE строки счётчиков выполняется первым: он блокирует строку, поэтому
+    одновременные ответы обоих партнёров не пропустят увеличение both_answered.
+    """
+    column = PairQuestionStats.user1_answered if pair.user1_id == user_id else PairQuestionStats.user2_answered
+    updated = db.query(PairQuestionStats).filter(
+        PairQuestionStats.pair_id == pair.id
+    ).update({column: column + 1}, synchronize_session=False)
+
+    if not updated:
+        # Строки ещё нет (пара без пересчёта) — строим её по исходным данным
+        try:
+            with db.begin_nested():
+                rebuild_pair_question_stats(db, [pair.id])
+        except IntegrityError:
+            # Строку параллельно создал партнёр — повторяем инкремент
+            record_answer(db, pair, user_id, question_id)
+        return
+
+    partner_id = pair.user2_id if pair.user1_id == user_id else pair.user1_id
+    partner_answered = db.query(
+        exists().where(UserAnswer.user_id == partner_id, UserAnswer.question_id == question_id)
+    ).scalar()
+    if partner_answered:
+        db.query(PairQuestionStats).filter(
+            PairQuestionStats.pair_id == pair.id
+        ).update({PairQuestionStats.both_answered: PairQuestionStats.both_answered + 1}, synchronize_session=False)
+
+
+def get_pair_question_stats(db: Session, pair: Pair, user_id: int) -> Dict[str, int]:
+    """Счётчики пары с точки зрения пользователя: одна выборка по первичному ключу"""
+    total_questions = select(func.count(Question.id)).scalar_subquery()
+    row = db.query(PairQuestionStats, total_questions).filter(
+        PairQuestionStats.pair_id == pair.id
+    ).first()
+
+    if row is None:
+        ensure_pair_question_stats(db, pair.id)
+        db.commit()
+        row = db.query(PairQuestionStats, total_questions).filter(
+            PairQuestionStats.pair_id == pair.id
+        ).first()
+
+    stats, total = row
+    is_user1 = pair.user1_id == user_id
+    return {
+        "total_questions": total,
+        "user_answered": stats.user1_answered if is_user1 else stats.user2_answered,
+        "partner_answered": stats.user2_answered if is_user1 else stats.user1_answered,
+        "both_answered": stats.both_answered,
+    }
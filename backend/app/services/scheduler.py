@@ -1,61 +1,202 @@
+import asyncio
 import logging
+import sys
+from datetime import datetime
 from typing import Optional
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
 from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.executors.asyncio import AsyncIOExecutor
+from apscheduler.executors.base_py3 import run_coroutine_job
 
+from app.core.config import settings
+from app.core.database import engine
+from app.notifications.base import get_rule, iter_rules
 from app.notifications.engine import NotificationEngine
+from app.services.leader import LeaderLease
 
 logger = logging.getLogger(__name__)
 
+RULE_JOB_PREFIX = "notification:"
+# Параметр задачи, в который ScheduledTimeExecutor подставляет плановое время запуска
+SCHEDULED_AT = "scheduled_at"
+
+
+class SharedEngineJobStore(SQLAlchemyJobStore):
+    """Хранилище задач на общем engine приложения: при остановке планировщика
+    (потеря лидерства) пул соединений приложения не закрывается"""
+
+    def shutdown(self):
+        pass
+
+
+class _StampedJob:
+    """Задача с плановым временем одного запуска в kwargs[SCHEDULED_AT]"""
+
+    def __init__(self, job, run_time: datetime):
+        self._job = job
+        self.kwargs = {**job.kwargs, SCHEDULED_AT: run_time}
+
+    def __getattr__(self, name):
+        return getattr(self._job, name)
+
+    def __str__(self):
+        return str(self._job)
+
+
+class ScheduledTimeExecutor(AsyncIOExecutor):
+    """AsyncIOExecutor, передающий корутине задачи плановое время запуска.
+
+    APScheduler сам его не сообщает, а запуск может прийти с опозданием
+    (рестарт, смена лидера, занятый цикл) — тогда текущее время указывает на
+    другой слот. Время получают задачи, у которых в kwargs есть SCHEDULED_AT;
+    каждый пропущенный запуск выполняется со своим временем.
+
+    Публичного способа для этого нет: класс повторяет AsyncIOExecutor._do_submit_job
+    и опирается на его внутренности (_pending_futures, _run_job_*, job._jobstore_alias,
+    run_coroutine_job). Поэтому версия APScheduler зафиксирована в requirements.txt,
+    а test_executor_relies_on_apscheduler_internals падает, если они изменятся.
+    """
+
+    def _do_submit_job(self, job, run_times):
+        if SCHEDULED_AT not in job.kwargs:
+            return super()._do_submit_job(job, run_times)
+
+        async def run():
+            events = []
+            for run_time in run_times:
+                events += await run_coroutine_job(
+                    _StampedJob(job, run_time), job._jobstore_alias, [run_time], self._logger.name
+                )
+            return events
+
+        def callback(f):
+            self._pending_futures.discard(f)
+            try:
+                events = f.result()
+            except BaseException:
+                self._run_job_error(job.id, *sys.exc_info()[1:])
+            else:
+                self._run_job_success(job.id, events)
+
+        f = self._eventloop.create_task(run())
+        f.add_done_callback(callback)
+        self._pending_futures.add(f)
+
 
 class NotificationScheduler:
-    def __init__(self):
+    """Планировщик уведомлений и GPT задач.
+
+    Процессов бэкенда может быть несколько (воркеры uvicorn, реплики), а
+    задачи должен выполнять ровно один. Каждый процесс периодически пытается
+    захватить или продлить аренду лидерства (LeaderLease); APScheduler
+    запускается только у лидера и останавливается, если аренда потеряна.
+    Задачи хранятся в БД (SCHEDULER_PERSIST_JOBS), поэтому новый лидер видит
+    пропущенные запуски и выполняет их в пределах misfire_grace_time.
+    """
+
+    def __init__(self, lease: Optional[LeaderLease] = None, persist_jobs: Optional[bool] = None):
         self.scheduler: Optional[AsyncIOScheduler] = None
         self.notification_engine: Optional[NotificationEngine] = None
-        
+        self.lease = lease
+        self.persist_jobs = settings.SCHEDULER_PERSIST_JOBS if persist_jobs is None else persist_jobs
+        self._election_task: Optional[asyncio.Task] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self.scheduler is not None
+
     def start(self, notification_engine: NotificationEngine):
-        """Запускает планировщик уведомлений"""
+        """Запускает выборы лидера; задачи начнут выполняться, когда процесс станет лидером"""
         self.notification_engine = notification_engine
-        
+        if self.lease is None:
+            self.lease = LeaderLease(ttl=settings.SCHEDULER_LEASE_TTL)
+        self._election_task = asyncio.get_running_loop().create_task(self._elect())
+        logger.info(f"🗳️ Планировщик: выборы лидера ({self.lease.holder})")
+
+    async def stop(self):
+        """Останавливает планировщик и отдаёт лидерство"""
+        if self._election_task:
+            self._election_task.cancel()
+            try:
+                await self._election_task
+            except asyncio.CancelledError:
+                pass
+            self._election_task = None
+        if self.is_leader:
+            self._stop_jobs()
+            try:
+                await asyncio.to_thread(self.lease.release)
+            except Exception as e:
+                logger.error(f"❌ Не удалось освободить аренду планировщика: {e}")
+
+    async def _elect(self):
+        while True:
+            await self.elect_once()
+            await asyncio.sleep(settings.SCHEDULER_LEASE_RENEW)
+
+    async def elect_once(self) -> bool:
+        """Одна попытка захватить/продлить аренду; запускает или останавливает задачи"""
+        try:
+            leader = await asyncio.to_thread(self.lease.try_acquire)
+        except Exception as e:
+            # Без БД нельзя подтвердить лидерство — безопаснее не выполнять задачи
+            logger.error(f"❌ Ошибка продления аренды планировщика: {e}")
+            leader = False
+        if leader and not self.is_leader:
+            self._start_jobs()
+        elif not leader and self.is_leader:
+            logger.warning("⚠️ Лидерство потеряно, планировщик остановлен")
+            self._stop_jobs()
+        return leader
+
+    def _start_jobs(self):
         # Создаем планировщик с асинхронным исполнителем
         executors = {
-            'default': AsyncIOExecutor()
+            'default': ScheduledTimeExecutor()
         }
         jobstores = {
-            'default': MemoryJobStore()
+            'default': SharedEngineJobStore(engine=engine) if self.persist_jobs else MemoryJobStore()
         }
-        
+
         self.scheduler = AsyncIOScheduler(
             executors=executors,
             jobstores=jobstores,
             timezone='UTC'
         )
-        
-        # Добавляем задачу для запуска уведомлений каждый час
-        # Это позволит запускать правила, которые должны выполняться в определенное время
-        self.scheduler.add_job(
-            self._run_scheduled_notifications,
-            CronTrigger(minute=0),  # Каждый час в :00
-            id='scheduled_notifications',
-            name='Запуск уведомлений по расписанию',
-            replace_existing=True
-        )
-        
+        # Задачи регистрируются на паузе: сохранённые запуски не сдвигаются до сверки
+        self.scheduler.start(paused=True)
+
+        # Каждое правило по расписанию — отдельная задача со своим cron
+        self._register_rule_jobs()
+
         # Регистрируем GPT задачи
         self._register_gpt_jobs()
-        
-        # Запускаем планировщик
-        self.scheduler.start()
-        logger.info("🚀 Планировщик уведомлений запущен")
-        
-    def stop(self):
-        """Останавливает планировщик"""
+
+        self.scheduler.resume()
+        logger.info("🚀 Планировщик уведомлений запущен (лидер)")
+        logger.info(f"📅 Расписание уведомлений:")
+        self.log_jobs()
+
+    def _stop_jobs(self):
         if self.scheduler:
-            self.scheduler.shutdown()
+            self.scheduler.shutdown(wait=False)
+            self.scheduler = None
             logger.info("🛑 Планировщик уведомлений остановлен")
-    
+
+    def ensure_job(self, func_ref: str, trigger, id: str, **options):
+        """Добавляет задачу, если её нет или изменились функция/расписание.
+
+        Совпадающая сохранённая задача остаётся как есть вместе со своим
+        next_run_time — так пропущенный за время простоя запуск не теряется.
+        func_ref — строка "модуль:объект", чтобы задачу можно было хранить в БД.
+        """
+        existing = self.scheduler.get_job(id)
+        if existing is not None and existing.func_ref == func_ref and str(existing.trigger) == str(trigger):
+            self.scheduler.modify_job(id, **options)
+            return existing
+        return self.scheduler.add_job(func_ref, trigger, id=id, replace_existing=True, **options)
+
     def _register_gpt_jobs(self):
         """Регистрирует GPT задачи в планировщике"""
         try:
@@ -66,18 +207,55 @@ class NotificationScheduler:
             logger.warning("⚠️ GPT модуль не найден, пропускаем регистрацию GPT задач")
         except Exception as e:
             logger.error(f"❌ Ошибка регистрации GPT задач: {e}")
-            
-    async def _run_scheduled_notifications(self):
-        """Запускает проверку и отправку уведомлений по расписанию"""
+
+    def _register_rule_jobs(self):
+        """Добавляет по задаче на каждое зарегистрированное правило с ScheduledTrigger"""
+        rule_job_ids = set()
+        for rule in iter_rules("schedule"):
+            trigger = rule.trigger
+            job_id = f"{RULE_JOB_PREFIX}{rule.id}"
+            rule_job_ids.add(job_id)
+            self.ensure_job(
+                f"{__name__}:run_notification_rule",
+                trigger.cron_trigger(),
+                id=job_id,
+                args=[rule.id],
+                kwargs={SCHEDULED_AT: None},
+                name=f"Уведомления: {rule.id}",
+                misfire_grace_time=trigger.misfire_grace_time,
+                coalesce=trigger.coalesce,
+                max_instances=1
+            )
+        # Сохранённые задачи удалённых правил
+        for job in self.scheduler.get_jobs():
+            if job.id.startswith(RULE_JOB_PREFIX) and job.id not in rule_job_ids:
+                job.remove()
+
+    async def _run_rule(self, rule_id: str, scheduled_at: Optional[datetime] = None):
+        """Запускает одно правило уведомлений (scheduled_at — плановое время запуска)"""
+        rule = get_rule(rule_id)
+        if rule is None or not self.notification_engine:
+            logger.warning(f"⚠️ Правило {rule_id} не найдено, пропускаем")
+            return
         try:
-            if self.notification_engine:
-                await self.notification_engine.run_scheduled()
-                logger.info("✅ Уведомления по расписанию обработаны")
+            await self.notification_engine.run_rule(rule, scheduled_at=scheduled_at)
+            logger.info(f"✅ Правило {rule_id} обработано")
         except Exception as e:
-            logger.error(f"❌ Ошибка при запуске уведомлений по расписанию: {e}")
+            logger.error(f"❌ Ошибка при выполнении правила {rule_id}: {e}")
+
+    def log_jobs(self):
+        """Пишет в лог ближайший запуск каждой задачи"""
+        if not self.scheduler:
+            return
+        for job in self.scheduler.get_jobs():
+            next_run = getattr(job, "next_run_time", None)
+            logger.info(f"   {job.id}: {job.trigger} → {next_run.isoformat() if next_run else 'не запланировано'}")
 
 
 # Глобальный экземпляр планировщика
 scheduler = NotificationScheduler()
 
 
+async def run_notification_rule(rule_id: str, scheduled_at: Optional[datetime] = None):
+    """Точка входа задачи правила (по ссылке, чтобы задача хранилась в БД)"""
+    await scheduler._run_rule(rule_id, scheduled_at)
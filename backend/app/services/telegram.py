@@ -1,17 +1,165 @@
-import httpx
+import asyncio
+import logging
+import random
+import time
 from typing import Optional, Dict, Any
 
+import httpx
+
 from app.core.config import settings
 
+logger = logging.getLogger(__name__)
+
+try:  # HTTP/2 доступен, если установлен httpx[http2]
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class TelegramError(RuntimeError):
+    """Telegram не принял сообщение (после всех повторов)"""
+
+
+class AsyncTokenBucket:
+    """Token bucket для asyncio: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1) -> None:
+        """Ждёт, пока в ведре наберётся amount токенов (не больше capacity), и списывает их"""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+    def consume(self, amount: float) -> None:
+        """Списывает без ожидания (баланс может уйти в минус — подождут следующие acquire)"""
+        self._refill()
+        self._tokens -= amount
+
+
+class TelegramClient:
+    """Долгоживущий клиент Bot API с пулом соединений и лимитами рассылки.
+
+    Один httpx.AsyncClient на процесс (keep-alive, HTTP/2 при наличии h2)
+    создаётся при первом запросе и закрывается на shutdown приложения.
+    Отправка ограничена глобальным token bucket и интервалом на чат (лимиты
+    Telegram для рассылок: ~30 сообщений в секунду, ~1 в секунду в один чат).
+    На 429 ждём retry_after из ответа, на 5xx и сетевые ошибки — экспоненциальный
+    backoff.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30,
+        per_chat_interval: float = 1.0,
+        max_retries: int = 3,
+        timeout: float = 10,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.global_rate = global_rate
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._bucket: Optional[AsyncTokenBucket] = None
+        self._chat_next_at: Dict[int, float] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+                transport=self.transport,
+            )
+            self._bucket = AsyncTokenBucket(self.global_rate, self.global_rate)
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _wait_for_chat(self, chat_id: int) -> None:
+        now = time.monotonic()
+        if len(self._chat_next_at) > 10000:
+            self._chat_next_at = {k: v for k, v in self._chat_next_at.items() if v > now}
+        next_at = self._chat_next_at.get(chat_id, now)
+        self._chat_next_at[chat_id] = max(next_at, now) + self.per_chat_interval
+        if next_at > now:
+            await asyncio.sleep(next_at - now)
+
+    async def call(self, bot_token: str, method: str, payload: Dict[str, Any]) -> httpx.Response:
+        """Вызов метода Bot API с лимитами и повторами. Возвращает последний ответ."""
+        client = self._get_client()
+        url = f"https://api.telegram.org/bot{bot_token}/{method}"
+        chat_id = payload.get("chat_id")
+        if chat_id is not None:
+            await self._wait_for_chat(chat_id)
+
+        for attempt in range(self.max_retries + 1):
+            await self._bucket.acquire()
+            try:
+                resp = await client.post(url, json=payload)
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise TelegramError(f"{method}: {e}") from e
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+
+            if resp.status_code == 429 and attempt < self.max_retries:
+                retry_after = _retry_after(resp)
+                logger.warning(f"Telegram 429 для chat_id={chat_id}, ждём {retry_after}с")
+                await asyncio.sleep(retry_after)
+                continue
+            if resp.status_code >= 500 and attempt < self.max_retries:
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            return resp
+        return resp
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        return min(0.5 * 2 ** attempt, 10) + random.uniform(0, 0.2)
+
+
+def _retry_after(resp: httpx.Response) -> float:
+    try:
+        return float(resp.json().get("parameters", {}).get("retry_after", 1))
+    except Exception:
+        return 1.0
+
+
+# Общий клиент процесса (закрывается в shutdown приложения)
+telegram_client = TelegramClient(global_rate=settings.TELEGRAM_GLOBAL_RATE)
+
 
 class TelegramService:
-    def __init__(self, bot_token: Optional[str] = None) -> None:
+    def __init__(self, bot_token: Optional[str] = None, client: Optional[TelegramClient] = None) -> None:
         self.bot_token = bot_token or settings.TELEGRAM_BOT_TOKEN
+        self.client = client or telegram_client
 
     async def send_message(self, chat_id: int, text: str, reply_markup: Optional[Dict[str, Any]] = None) -> None:
         if not self.bot_token:
             raise RuntimeError("Telegram bot token is not configured")
-        api_url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
 
         payload = {
             "chat_id": chat_id,
@@ -20,17 +168,18 @@ class TelegramService:
         if reply_markup:
             payload["reply_markup"] = reply_markup
 
-        async with httpx.AsyncClient(timeout=10) as client:
-            resp = await client.post(api_url, json=payload)
-            if resp.status_code != 200 and reply_markup:
-                # Фолбэк: конвертируем web_app кнопку в обычный URL, если возможно
-                fallback = _webapp_to_url_fallback(reply_markup)
-                if fallback:
-                    await client.post(api_url, json={
-                        "chat_id": chat_id,
-                        "text": text,
-                        "reply_markup": fallback
-                    })
+        resp = await self.client.call(self.bot_token, "sendMessage", payload)
+        if resp.status_code == 400 and reply_markup:
+            # Фолбэк: конвертируем web_app кнопку в обычный URL, если возможно
+            fallback = _webapp_to_url_fallback(reply_markup)
+            if fallback:
+                resp = await self.client.call(self.bot_token, "sendMessage", {
+                    "chat_id": chat_id,
+                    "text": text,
+                    "reply_markup": fallback
+                })
+        if resp.status_code != 200:
+            raise TelegramError(f"sendMessage {resp.status_code}: {resp.text[:200]}")
 
 
 def _webapp_to_url_fallback(reply_markup: Dict[str, Any]) -> Optional[Dict[str, Any]]:
@@ -50,5 +199,3 @@ def _webapp_to_url_fallback(reply_markup: Dict[str, Any]) -> Optional[Dict[str,
         return {"inline_keyboard": fallback_rows}
     except Exception:
         return None
-
-
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк накладных расходов стека middleware на маленьком JSON-эндпоинте.
+
+Сравнивает:
+  bare        — приложение без middleware;
+  base_http   — 9 пустых слоёв BaseHTTPMiddleware (модель прежнего стека);
+  asgi_stack  — текущий стек из app.middleware.stack.
+
+Запросы подаются напрямую в ASGI-приложение, без сети и сервера.
+Запуск: python scripts/bench_middleware.py [число_запросов]
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from urllib.parse import urlencode
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from fastapi import FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.middleware.stack import MIDDLEWARE_NAMES, setup_middlewares
+from app.models.analytics import UsageEvent
+from app.services.analytics_buffer import analytics_buffer
+
+INIT_DATA = urlencode({"user": json.dumps({"id": 123456, "first_name": "Bench"}), "auth_date": "0", "hash": "x"})
+
+
+def make_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/api/v1/ping")
+    async def ping():
+        return {"ok": True}
+
+    return app
+
+
+class PassThroughMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        return await call_next(request)
+
+
+def build_apps():
+    bare = make_app()
+
+    base_http = make_app()
+    for _ in MIDDLEWARE_NAMES:
+        base_http.add_middleware(PassThroughMiddleware)
+
+    asgi_stack = make_app()
+    # rate_limit отключён: с одного адреса бенчмарк упрётся в лимит
+    setup_middlewares(asgi_stack, disabled=["rate_limit"])
+
+    return {"bare": bare, "base_http": base_http, "asgi_stack": asgi_stack}
+
+
+async def call(app) -> None:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/api/v1/ping",
+        "raw_path": b"/api/v1/ping",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"host", b"localhost"),
+            (b"x-forwarded-for", b"10.0.0.1"),
+            (b"x-telegram-init-data", INIT_DATA.encode()),
+        ],
+        "client": ("127.0.0.1", 50000),
+        "server": ("localhost", 8000),
+    }
+
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def bench(app, requests: int) -> float:
+    for _ in range(200):  # Прогрев
+        await call(app)
+    start = time.perf_counter()
+    for _ in range(requests):
+        await call(app)
+    return (time.perf_counter() - start) / requests * 1_000_000
+
+
+async def main(requests: int) -> None:
+    # События аналитики пишутся в in-memory SQLite, а не в рабочую БД
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    UsageEvent.__table__.create(bind=engine)
+    analytics_buffer.session_factory = sessionmaker(bind=engine)
+    analytics_buffer.spill_dir = None
+
+    results = {}
+    for name, app in build_apps().items():
+        results[name] = await bench(app, requests)
+    await analytics_buffer.stop()
+
+    print(f"Запросов на вариант: {requests}")
+    for name, us in results.items():
+        overhead = us - results["bare"]
+        print(f"  {name:<12} {us:8.1f} мкс/запрос  (стек: {overhead:+8.1f} мкс)")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
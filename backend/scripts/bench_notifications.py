@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк конвейера уведомлений по расписанию на синтетических данных.
+
+Засевает N пар (ответы на вопрос дня и сонастройку, настроения, история
+UsageEvent) в SQLite или локальный Postgres и прогоняет правила
+DailyCheckinRule, MorningReminderRule и EveningReminderRule целиком:
+выборка получателей, рендер и постановка в outbox (NotificationEngine.run_rule),
+затем доставка воркером outbox через заглушку TelegramService.
+
+Для каждого правила печатает число получателей и отправок, SQL-запросы на
+получателя, время фаз, пиковую память (tracemalloc) и отправки в секунду.
+Второй прогон (replay) повторяет те же правила: все отправки должны
+отсечься кулдауном/dedupe — так измеряется стоимость повторного запуска.
+
+Запуск:
+  python scripts/bench_notifications.py [--pairs 1000] [--db sqlite://]
+      [--latency-ms 0] [--json]
+Для Postgres укажите --db postgresql://... с пустой базой: таблицы создаются,
+данные не удаляются.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta, timezone
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from sqlalchemy import create_engine, event, insert, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.core.config import settings
+from app.models import (
+    Base, User, Pair, Question, PairDailyQuestion, UserAnswer, Mood, UsageEvent,
+)
+from app.models.tune import PairDailyTuneQuestion, TuneAnswer, TuneQuizQuestion
+from app.notifications.engine import NotificationEngine
+from app.notifications.rules import daily_checkin, evening_reminder, morning_reminder
+from app.services.notifications import NotificationService
+from app.services.outbox import OutboxWorker
+
+RULE_MODULES = [daily_checkin, morning_reminder, evening_reminder]
+MOODS = ["joyful", "calm", "tired", "anxious", "sad", "irritable", "grateful"]
+
+
+class FakeTelegram:
+    """Заглушка TelegramService: считает отправки, опционально имитирует задержку API"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent += 1
+
+
+def make_engine(url: str):
+    if url in ("sqlite://", "sqlite:///:memory:"):
+        return create_engine(url, poolclass=StaticPool, connect_args={"check_same_thread": False})
+    if url.startswith("sqlite"):
+        return create_engine(url, connect_args={"check_same_thread": False})
+    return create_engine(url, pool_pre_ping=True)
+
+
+def seed(factory, pairs: int, seed_value: int = 42) -> None:
+    """Синтетические пары: у части ответы, сонастройка, настроения и недавняя активность"""
+    rnd = random.Random(seed_value)
+    today = date.today()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    session = factory()
+    try:
+        question = Question(number=1, text="Бенчмарк: вопрос дня", category="bench")
+        tune_question = TuneQuizQuestion(number=1, text="Бенчмарк: сонастройка", category="bench")
+        session.add_all([question, tune_question])
+        session.flush()
+
+        base_tg = 10_000_000
+        session.execute(insert(User), [
+            {"telegram_id": base_tg + i, "first_name": f"Bench{i}", "settings_json": {}}
+            for i in range(pairs * 2)
+        ])
+        user_ids = session.execute(
+            select(User.id).where(User.telegram_id >= base_tg).order_by(User.telegram_id)
+        ).scalars().all()
+
+        session.execute(insert(Pair), [
+            {"user1_id": user_ids[2 * i], "user2_id": user_ids[2 * i + 1]} for i in range(pairs)
+        ])
+        pair_rows = session.execute(select(Pair.id, Pair.user1_id, Pair.user2_id).order_by(Pair.id)).all()
+
+        session.execute(insert(PairDailyQuestion), [
+            {"pair_id": pair_id, "question_id": question.id, "date": today} for pair_id, _, _ in pair_rows
+        ])
+        session.execute(insert(PairDailyTuneQuestion), [
+            {"pair_id": pair_id, "question_id": tune_question.id, "date": today} for pair_id, _, _ in pair_rows
+        ])
+
+        answers, tune_answers, moods, events = [], [], [], []
+        for pair_id, user1, user2 in pair_rows:
+            for user_id in (user1, user2):
+                if rnd.random() < 0.5:
+                    answers.append({"user_id": user_id, "question_id": question.id, "answer_text": "ответ"})
+                if rnd.random() < 0.3:
+                    other = user2 if user_id == user1 else user1
+                    for subject in (user_id, other):
+                        tune_answers.append({
+                            "pair_id": pair_id, "question_id": tune_question.id,
+                            "author_user_id": user_id, "subject_user_id": subject, "answer_text": "a",
+                        })
+                for days_ago in range(rnd.randint(0, 7)):
+                    moods.append({
+                        "user_id": user_id, "date": now - timedelta(days=days_ago), "mood_code": rnd.choice(MOODS),
+                    })
+        # История активности: часть пользователей заходила за последние 4 часа
+        for i in range(pairs * 2):
+            for _ in range(rnd.randint(0, 5)):
+                events.append({
+                    "ts": now - timedelta(minutes=rnd.randint(0, 48 * 60)),
+                    "method": "GET", "route": "/api/v1/questions/current", "status": 200,
+                    "duration_ms": rnd.randint(1, 50), "telegram_id": base_tg + i,
+                })
+        for model, rows in ((UserAnswer, answers), (TuneAnswer, tune_answers), (Mood, moods), (UsageEvent, events)):
+            if rows:
+                session.execute(insert(model), rows)
+        session.commit()
+    finally:
+        session.close()
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+async def run_rule(rule, engine, worker, telegram, counter) -> dict:
+    sent_before = telegram.sent
+    tracemalloc.reset_peak()
+
+    queries_start = counter.count
+    start = time.perf_counter()
+    # timezones=None: правила по местному времени берут всех пользователей
+    await engine.run_rule(rule, {"timezones": None})
+    enqueue_s = time.perf_counter() - start
+    enqueue_queries = counter.count - queries_start
+
+    processed = 0
+    start = time.perf_counter()
+    while True:
+        batch = await worker.process_batch()
+        if not batch:
+            break
+        processed += batch
+    deliver_s = time.perf_counter() - start
+    deliver_queries = counter.count - queries_start - enqueue_queries
+
+    sent = telegram.sent - sent_before
+    _, peak = tracemalloc.get_traced_memory()
+    return {
+        "rule": rule.id,
+        "recipients": processed,
+        "sent": sent,
+        "enqueue_s": round(enqueue_s, 3),
+        "deliver_s": round(deliver_s, 3),
+        "queries": enqueue_queries + deliver_queries,
+        "queries_per_recipient": round((enqueue_queries + deliver_queries) / processed, 2) if processed else None,
+        "peak_mb": round(peak / 1024 / 1024, 1),
+        "sends_per_s": round(sent / deliver_s, 1) if deliver_s and sent else 0.0,
+    }
+
+
+async def main(args) -> None:
+    db_engine = make_engine(args.db)
+    Base.metadata.create_all(bind=db_engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+
+    start = time.perf_counter()
+    seed(factory, args.pairs)
+    seed_s = time.perf_counter() - start
+
+    # Правила открывают сессии через SessionLocal своего модуля
+    for module in RULE_MODULES:
+        module.SessionLocal = factory
+    # Без разброса по времени: доставка сразу, иначе воркер не увидит записи
+    settings.NOTIFICATION_JITTER_SECONDS = 0
+
+    telegram = FakeTelegram(latency=args.latency_ms / 1000)
+    service = NotificationService(telegram=telegram, session_factory=factory)
+    worker = OutboxWorker(session_factory=factory, service=service, batch_size=args.batch_size)
+    engine = NotificationEngine(session_factory=factory, outbox=worker)
+    rules = [
+        daily_checkin.DailyCheckinRule(),
+        morning_reminder.MorningReminderRule(),
+        evening_reminder.EveningReminderRule(),
+    ]
+    counter = QueryCounter(db_engine)
+
+    tracemalloc.start()
+    results = []
+    for phase in ("first", "replay"):
+        for rule in rules:
+            result = await run_rule(rule, engine, worker, telegram, counter)
+            result["phase"] = phase
+            results.append(result)
+    tracemalloc.stop()
+
+    if args.json:
+        print(json.dumps({"pairs": args.pairs, "db": db_engine.dialect.name, "seed_s": round(seed_s, 2), "results": results}))
+        return
+
+    print(f"Пар: {args.pairs}, БД: {db_engine.dialect.name}, засев: {seed_s:.2f} с")
+    print(f"{'фаза':<7} {'правило':<17} {'получ.':>7} {'отпр.':>7} {'запр/получ':>10} "
+          f"{'очередь,с':>9} {'доставка,с':>10} {'отпр/с':>9} {'пик,МБ':>7}")
+    for r in results:
+        qpr = "-" if r["queries_per_recipient"] is None else f"{r['queries_per_recipient']:.2f}"
+        print(f"{r['phase']:<7} {r['rule']:<17} {r['recipients']:>7} {r['sent']:>7} {qpr:>10} "
+              f"{r['enqueue_s']:>9.3f} {r['deliver_s']:>10.3f} {r['sends_per_s']:>9.1f} {r['peak_mb']:>7.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк конвейера уведомлений")
+    parser.add_argument("--pairs", type=int, default=1000, help="Число синтетических пар")
+    parser.add_argument("--db", default="sqlite://", help="URL базы (по умолчанию in-memory SQLite)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Имитация задержки Telegram API")
+    parser.add_argument("--batch-size", type=int, default=500, help="Размер пачки воркера outbox")
+    parser.add_argument("--json", action="store_true", help="Вывод в JSON (для сравнения в CI)")
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(parser.parse_args()))
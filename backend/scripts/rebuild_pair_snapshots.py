@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Пересчёт таблицы pair_context_snapshots по настроениям и ответам Сонастройки.
+
+Запускать после миграции (backfill), после изменения GPT_CONTEXT_DAYS и
+после ручных правок moods / tune_answers.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+# Загружаем переменные окружения
+from dotenv import load_dotenv
+load_dotenv(os.path.join(os.path.dirname(__file__), '..', '..', '.env'))
+
+from app.core.database import SessionLocal
+from app.services.pair_snapshot import rebuild_pair_snapshots
+
+
+def main():
+    pair_ids = [int(arg) for arg in sys.argv[1:]] or None
+    db = SessionLocal()
+    try:
+        count = rebuild_pair_snapshots(db, pair_ids)
+        db.commit()
+        print(f"✅ Снимки контекста пересчитаны для {count} пар")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Ошибка пересчёта снимков: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Пересчёт таблицы pair_question_stats по ответам пользователей.
+
+Запускать после миграции (backfill) и после ручных правок user_answers
+(например, сброса ответов тестовых пар).
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+# Загружаем переменные окружения
+from dotenv import load_dotenv
+load_dotenv(os.path.join(os.path.dirname(__file__), '..', '..', '.env'))
+
+from app.core.database import SessionLocal
+from app.services.question_stats import rebuild_pair_question_stats
+
+
+def main():
+    pair_ids = [int(arg) for arg in sys.argv[1:]] or None
+    db = SessionLocal()
+    try:
+        count = rebuild_pair_question_stats(db, pair_ids)
+        db.commit()
+        print(f"✅ Статистика пересчитана для {count} пар")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Ошибка пересчёта статистики: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.models import Base, User, Pair
+from app.services.pair_context import PairContext
+
+
+@pytest.fixture
+def db_engine():
+    """Отдельная in-memory SQLite база на каждый тест"""
+    engine = create_engine(
+        "sqlite://",
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False},
+    )
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db_session(db_engine):
+    session = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def pair_users(db_session):
+    """Alice и Bob в активной паре (Alice — user1), загруженные после коммита"""
+    alice = User(telegram_id=1, first_name="Alice")
+    bob = User(telegram_id=2, first_name="Bob")
+    db_session.add_all([alice, bob])
+    db_session.flush()
+    pair = Pair(user1_id=alice.id, user2_id=bob.id)
+    db_session.add(pair)
+    db_session.commit()
+    for obj in (alice, bob, pair):
+        db_session.refresh(obj)
+    return alice, bob, pair
+
+
+@pytest.fixture
+def pair_ctx(pair_users):
+    """PairContext партнёра из pair_users: pair_ctx(alice), pair_ctx(bob)"""
+    alice, bob, pair = pair_users
+
+    def make(user):
+        partner = bob if user is alice else alice
+        return PairContext(user=user, pair=pair, partner_id=partner.id, partner=partner)
+
+    return make
+
+
+@pytest.fixture
+def query_log(db_engine):
+    """Список SQL-запросов, выполненных через db_engine"""
+    statements = []
+
+    def _log(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db_engine, "before_cursor_execute", _log)
+    yield statements
+    event.remove(db_engine, "before_cursor_execute", _log)
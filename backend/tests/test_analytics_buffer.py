@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy.orm import sessionmaker
+
+from app.models.analytics import UsageEvent
+from app.services.analytics_buffer import AnalyticsBuffer
+
+
+def make_event(i):
+    return {
+        "ts": datetime(2025, 1, 1),
+        "method": "GET",
+        "route": f"/api/v1/test/{i}",
+        "status": 200,
+        "duration_ms": i,
+        "telegram_id": None,
+    }
+
+
+def test_events_flushed_in_batches(db_engine, query_log):
+    buffer = AnalyticsBuffer(
+        session_factory=sessionmaker(bind=db_engine), batch_size=5, flush_interval=60
+    )
+
+    async def scenario():
+        for i in range(12):
+            buffer.record(make_event(i))
+        await asyncio.sleep(0.1)  # Фоновый таск сбрасывает полные пачки
+        flushed_before_stop = buffer.flushed
+        await buffer.stop()  # Остаток сбрасывается при остановке
+        return flushed_before_stop
+
+    assert asyncio.run(scenario()) == 10
+    inserts = [s for s in query_log if s.startswith("INSERT INTO usage_events")]
+    assert len(inserts) == 3
+    assert sessionmaker(bind=db_engine)().query(UsageEvent).count() == 12
+
+
+def test_overflow_is_dropped_and_counted(db_engine):
+    buffer = AnalyticsBuffer(session_factory=sessionmaker(bind=db_engine), max_size=3)
+
+    accepted = [buffer.record(make_event(i)) for i in range(5)]
+
+    assert accepted == [True, True, True, False, False]
+    assert buffer.stats()["dropped"] == 2
+
+
+def test_spill_to_file_and_replay_on_recovery(db_engine, tmp_path):
+    session_factory = sessionmaker(bind=db_engine)
+    state = {"db_up": False}
+
+    def flaky_factory():
+        if not state["db_up"]:
+            raise RuntimeError("database is unavailable")
+        return session_factory()
+
+    buffer = AnalyticsBuffer(session_factory=flaky_factory, batch_size=10, spill_dir=str(tmp_path))
+
+    async def scenario():
+        for i in range(3):
+            buffer.record(make_event(i))
+        assert not await buffer.flush()
+        assert len(list(tmp_path.glob("usage_events-*.jsonl"))) == 1
+
+        state["db_up"] = True
+        buffer.record(make_event(3))
+        assert await buffer.flush()  # Успешная запись запускает переигрывание файла
+        await buffer.stop()
+
+    asyncio.run(scenario())
+
+    stats = buffer.stats()
+    assert (stats["spilled"], stats["replayed"], stats["flushed"]) == (3, 3, 1)
+    assert session_factory().query(UsageEvent).count() == 4
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_replay_skips_corrupt_lines_and_recovers_dead_claims(db_engine, tmp_path):
+    session_factory = sessionmaker(bind=db_engine)
+    good = '{"ts": "2025-01-01T00:00:00", "method": "GET", "route": "/a", "status": 200, "duration_ms": 1, "telegram_id": null}\n'
+    # Файл, который начал переигрывать процесс, умерший посреди работы
+    (tmp_path / "usage_events-1.jsonl.999999999.replay").write_text(good * 2)
+    # Строка, обрезанная падением посреди дозаписи
+    (tmp_path / "usage_events-2.jsonl").write_text(good + '{"ts": "2025-01-01T00:0')
+
+    buffer = AnalyticsBuffer(session_factory=session_factory, spill_dir=str(tmp_path))
+
+    assert asyncio.run(buffer.replay_spill()) == 3
+    assert buffer.stats()["corrupt"] == 1
+    assert session_factory().query(UsageEvent).count() == 3
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,129 @@
+import asyncio
+import json
+from unittest.mock import patch
+
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
+
+from app.gpt.api.endpoints import get_gpt_service, router
+from app.gpt.services.gpt_service import AnthropicClient, AnthropicService, GPTService
+from app.gpt.services.response_cache import ResponseCache
+from app.models import GPTTask, TaskStatus, TaskType
+
+
+def sse(*events):
+    return "".join(f"event: {e['type']}\ndata: {json.dumps(e, ensure_ascii=False)}\n\n" for e in events).encode()
+
+
+STREAM = sse(
+    {"type": "message_start", "message": {"usage": {"input_tokens": 50, "output_tokens": 1}}},
+    {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+    {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": "Привет"}},
+    {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": ", мир"}},
+    {"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": 70}},
+    {"type": "message_stop"},
+)
+
+
+class FakeAPI:
+    """Транспорт вместо api.anthropic.com: считает параллельные запросы"""
+
+    def __init__(self, usage=None, delay=0.0):
+        self.usage = usage or {"input_tokens": 10, "output_tokens": 10}
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self.requests = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        self.requests.append(body)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+        if body.get("stream"):
+            return httpx.Response(200, content=STREAM, headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json={"content": [{"type": "text", "text": "ok"}], "usage": self.usage})
+
+
+def make_service(api, db_engine=None, **client_options):
+    client = AnthropicClient(transport=httpx.MockTransport(api), **client_options)
+    cache = ResponseCache(session_factory=sessionmaker(bind=db_engine)) if db_engine is not None else None
+    service = AnthropicService(cache=cache, client=client)
+    service.api_key = "test-key"
+    return service
+
+
+def test_pooled_client_caps_concurrency():
+    api = FakeAPI(delay=0.02)
+    service = make_service(api, max_concurrency=2)
+
+    async def run():
+        results = await service.batch_analyze([f"prompt {i}" for i in range(6)])
+        pooled = service.client._client
+        await service.analyze_text("again", use_cache=False)
+        assert service.client._client is pooled
+        await service.client.aclose()
+        return results
+
+    assert asyncio.run(run()) == ["ok"] * 6
+    assert api.max_active == 2
+    assert len(api.requests) == 7
+
+
+def test_token_budget_charges_actual_usage():
+    api = FakeAPI(usage={"input_tokens": 40, "output_tokens": 200})
+    service = make_service(api, tokens_per_minute=600)
+
+    asyncio.run(service.analyze_text("коротко", use_cache=False))
+
+    # Списана фактическая стоимость (240), а не оценка по длине промпта
+    assert 355 < service.client._budget._tokens < 365
+
+
+def test_stream_task_saves_result(db_engine, db_session):
+    gpt = GPTService()
+    gpt.anthropic = make_service(FakeAPI(), db_engine)
+    factory = sessionmaker(bind=db_engine)
+
+    async def collect(task_id):
+        return [chunk async for chunk in gpt.stream_task(task_id)]
+
+    with patch("app.gpt.services.gpt_service.SessionLocal", factory):
+        first = asyncio.run(gpt.create_task(TaskType.FEEDBACK_ANALYSIS, {"x": 1}))
+        second = asyncio.run(gpt.create_task(first.task_type, {"x": 1}))
+        assert asyncio.run(collect(first.id)) == ["Привет", ", мир"]
+        # Тот же промпт — ответ из кеша одним фрагментом
+        assert asyncio.run(collect(second.id)) == ["Привет, мир"]
+
+    tasks = db_session.query(GPTTask).order_by(GPTTask.id).all()
+    assert [(t.status, t.result, t.anthropic_calls) for t in tasks] == [
+        (TaskStatus.COMPLETED, "Привет, мир", 1),
+        (TaskStatus.COMPLETED, "Привет, мир", 0),
+    ]
+
+
+def test_analyze_stream_endpoint_sends_sse(db_engine):
+    gpt = GPTService()
+    gpt.anthropic = make_service(FakeAPI())
+    app = FastAPI()
+    app.include_router(router, prefix="/gpt")
+    app.dependency_overrides[get_gpt_service] = lambda: gpt
+
+    with patch("app.gpt.services.gpt_service.SessionLocal", sessionmaker(bind=db_engine)):
+        with TestClient(app) as client:
+            response = client.post("/gpt/analyze/stream", json={"analysis_type": "feedback", "data": {"x": 1}})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [block for block in response.text.split("\n\n") if block]
+    assert events[:2] == [
+        'data: {"text": "Привет"}',
+        'data: {"text": ", мир"}',
+    ]
+    assert events[2].startswith("event: done\ndata: ")
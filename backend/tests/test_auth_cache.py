@@ -0,0 +1,92 @@
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import urlencode
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.orm import sessionmaker
+
+from app.core.config import settings
+from app.models import User
+from app.services import auth
+
+
+BOT_TOKEN = "123456:test-token"
+
+
+def make_init_data(user_id: int = 42, auth_date: int = None, bot_token: str = BOT_TOKEN) -> str:
+    fields = {
+        "auth_date": str(auth_date or int(time.time())),
+        "query_id": "AAE",
+        "user": json.dumps({"id": user_id, "first_name": "Аня"}),
+    }
+    check_string = "\n".join(f"{k}={fields[k]}" for k in sorted(fields))
+    secret = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    fields["hash"] = hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+@pytest.fixture(autouse=True)
+def bot_token(monkeypatch):
+    monkeypatch.setattr(settings, "TELEGRAM_BOT_TOKEN", BOT_TOKEN)
+    auth._init_data_cache.clear()
+    yield
+    auth._init_data_cache.clear()
+
+
+def test_second_call_loads_user_by_primary_key(db_session, query_log):
+    init_data = make_init_data()
+
+    first = auth.get_current_user(init_data, db_session)
+    assert first.telegram_id == 42
+
+    db_session.expunge_all()
+    query_log.clear()
+    second = auth.get_current_user(init_data, db_session)
+    assert second.id == first.id
+    users_queries = [q for q in query_log if "FROM users" in q]
+    assert len(users_queries) == 1
+    assert "users.id =" in users_queries[0] and "telegram_id =" not in users_queries[0]
+
+
+def test_tampered_data_is_rejected_even_after_cache_hit(db_session):
+    init_data = make_init_data()
+    auth.get_current_user(init_data, db_session)
+
+    with pytest.raises(HTTPException) as exc:
+        auth.get_current_user(init_data.replace("query_id=AAE", "query_id=AAF"), db_session)
+    assert exc.value.status_code == 401
+
+
+def test_cache_entry_does_not_outlive_auth_date():
+    # Подпись истекает через 5 секунд — запись не должна жить дольше
+    auth_date = int(time.time()) - settings.TELEGRAM_AUTH_MAX_AGE + 5
+    init_data = make_init_data(auth_date=auth_date)
+    auth.verify_telegram_webapp_data(init_data)
+
+    expires_at, _ = auth._init_data_cache._data[auth._init_data_key(init_data)]
+    assert expires_at == pytest.approx(auth_date + settings.TELEGRAM_AUTH_MAX_AGE, abs=0.01)
+
+
+def test_cached_telegram_id(db_session):
+    init_data = make_init_data(user_id=7)
+    assert auth.cached_telegram_id(init_data) is None
+
+    auth.get_current_user(init_data, db_session)
+    assert auth.cached_telegram_id(init_data) == 7
+
+
+def test_user_changes_visible_with_cached_init_data(db_engine, db_session):
+    init_data = make_init_data(user_id=7)
+    user = auth.get_current_user(init_data, db_session)
+
+    # Изменение строки users в другой сессии (другой запрос или воркер)
+    other = sessionmaker(bind=db_engine)()
+    other.get(User, user.id).first_name = "Анна"
+    other.commit()
+    other.close()
+
+    db_session.expunge_all()
+    assert auth.get_current_user(init_data, db_session).first_name == "Анна"
@@ -0,0 +1,96 @@
+from datetime import date, datetime, timedelta, timezone
+from unittest.mock import patch
+
+from sqlalchemy.orm import sessionmaker
+
+from app.models import User, Pair, Question, PairDailyQuestion, UserAnswer, UsageEvent
+from app.models.tune import PairDailyTuneQuestion, TuneAnswer, TuneQuizQuestion
+from app.notifications.rules.evening_reminder import EveningReminderRule
+
+
+def seed_pairs(db_session, count):
+    """count пар: в каждой второй партнёр ответил на вопрос дня, в каждой третьей — прошёл сонастройку"""
+    question = Question(number=1, text="Вопрос", category="general")
+    tune_question = TuneQuizQuestion(number=1, text="Тюн", category="general")
+    db_session.add_all([question, tune_question])
+    db_session.flush()
+    recipients = []
+    for i in range(count):
+        user = User(telegram_id=1000 + 2 * i, first_name=f"U{i}")
+        partner = User(telegram_id=1001 + 2 * i, first_name=f"P{i}")
+        db_session.add_all([user, partner])
+        db_session.flush()
+        pair = Pair(user1_id=user.id, user2_id=partner.id)
+        db_session.add(pair)
+        db_session.flush()
+        db_session.add(PairDailyQuestion(pair_id=pair.id, question_id=question.id, date=date.today()))
+        db_session.add(PairDailyTuneQuestion(pair_id=pair.id, question_id=tune_question.id, date=date.today()))
+        if i % 2 == 0:
+            db_session.add(UserAnswer(user_id=partner.id, question_id=question.id, answer_text="да"))
+        if i % 3 == 0:
+            for subject in (partner.id, user.id):
+                db_session.add(TuneAnswer(
+                    pair_id=pair.id, question_id=tune_question.id,
+                    author_user_id=partner.id, subject_user_id=subject, answer_text="a",
+                ))
+        recipients.append(user)
+    db_session.add(UsageEvent(
+        ts=datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=1),
+        method="GET", route="/", status=200, duration_ms=1, telegram_id=1001,
+    ))
+    db_session.commit()
+    for user in recipients:
+        db_session.refresh(user)
+    return recipients
+
+
+def seed_pairs_more(db_session, count):
+    # Дополнительные пары без вопросов дня: у них только напоминание об активности
+    users = []
+    for i in range(count):
+        user = User(telegram_id=5000 + 2 * i, first_name=f"X{i}")
+        partner = User(telegram_id=5001 + 2 * i, first_name=f"Y{i}")
+        db_session.add_all([user, partner])
+        db_session.flush()
+        db_session.add(Pair(user1_id=user.id, user2_id=partner.id))
+        users.append(user)
+    db_session.commit()
+    for user in users:
+        db_session.refresh(user)
+    return users
+
+
+def test_render_many_uses_constant_queries(db_engine, db_session, query_log):
+    rule = EveningReminderRule()
+    with patch("app.notifications.rules.evening_reminder.SessionLocal", sessionmaker(bind=db_engine)):
+        users = seed_pairs(db_session, 2)
+        query_log.clear()
+        rule.render_many({}, users)
+        small = len(query_log)
+
+        users += seed_pairs_more(db_session, 10)
+        for user in users:
+            db_session.refresh(user)
+        query_log.clear()
+        renders = rule.render_many({}, users)
+
+    assert len(query_log) == small <= 7
+    assert renders[users[0].id]["text"] == (
+        "💬 P0 ответил(а) на вопрос дня, а вы ещё нет! 🎯 P0 прошёл(а) сонастройку, а вы ещё нет!"
+    )
+    assert renders[users[1].id]["text"] == "💬 Вопрос дня ждёт ваших ответов! 🎯 Сонастройка ждёт вас обоих!"
+
+
+def test_render_matches_single_user_path(db_engine, db_session):
+    rule = EveningReminderRule()
+    with patch("app.notifications.rules.evening_reminder.SessionLocal", sessionmaker(bind=db_engine)):
+        users = seed_pairs(db_session, 4)
+        lonely = User(telegram_id=1, first_name="Solo")
+        db_session.add(lonely)
+        db_session.commit()
+        db_session.refresh(lonely)
+
+        renders = rule.render_many({}, users + [lonely])
+        for user in users:
+            assert rule.render({}, user) == renders[user.id]
+        assert renders[lonely.id] is None
@@ -0,0 +1,83 @@
+import asyncio
+from unittest.mock import patch
+
+from sqlalchemy.orm import sessionmaker
+
+from app.models import User, Pair, NotificationOutbox
+from app.notifications import rules as _rules  # noqa: F401
+from app.notifications.base import rules_for_event
+from app.notifications.engine import NotificationEngine
+from app.notifications.events import EventBus
+from app.services.outbox import OutboxWorker
+
+
+class RecordingEngine:
+    def __init__(self):
+        self.calls = []
+
+    async def handle_event(self, event_name, ctx):
+        self.calls.append((event_name, ctx))
+
+
+def test_rules_are_indexed_by_event_name():
+    assert [rule.id for rule in rules_for_event("mood.created")] == ["mood_update"]
+    assert rules_for_event("nothing.happened") == []
+
+
+def test_bus_coalesces_events_with_same_key():
+    engine = RecordingEngine()
+    bus = EventBus(coalesce_window=0.05)
+
+    async def scenario():
+        await bus.start(engine)
+        assert bus.emit("mood.created", {"mood_code": "sad"}, key=1)
+        assert bus.emit("mood.created", {"mood_code": "calm"}, key=1)
+        assert bus.emit("mood.created", {"mood_code": "tired"}, key=2)
+        assert not bus.emit("nothing.happened", {})
+        await asyncio.sleep(0.02)
+        assert engine.calls == []  # ещё внутри окна
+        await asyncio.sleep(0.1)
+        await bus.stop()
+
+    asyncio.run(scenario())
+    assert engine.calls == [
+        ("mood.created", {"mood_code": "calm"}),
+        ("mood.created", {"mood_code": "tired"}),
+    ]
+    assert bus.stats()["coalesced"] == 1
+
+
+def test_stop_flushes_pending_events():
+    engine = RecordingEngine()
+    bus = EventBus(coalesce_window=60)
+
+    async def scenario():
+        await bus.start(engine)
+        bus.emit("mood.created", {"mood_code": "sad"}, key=1)
+        await bus.stop()
+
+    asyncio.run(scenario())
+    assert engine.calls == [("mood.created", {"mood_code": "sad"})]
+
+
+def test_mood_event_enqueues_partner_notification(db_engine, db_session):
+    actor = User(telegram_id=1, first_name="Аня")
+    partner = User(telegram_id=2, first_name="Боря")
+    db_session.add_all([actor, partner])
+    db_session.flush()
+    pair = Pair(user1_id=actor.id, user2_id=partner.id)
+    db_session.add(pair)
+    db_session.commit()
+    ctx = {"actor_id": actor.id, "pair_id": pair.id, "partner_id": partner.id, "mood_code": "calm", "was_update": False}
+
+    factory = sessionmaker(bind=db_engine)
+    engine = NotificationEngine(session_factory=factory, outbox=OutboxWorker())
+    with patch("app.notifications.rules.mood_update.SessionLocal", factory):
+        asyncio.run(engine.handle_event("mood.created", ctx))
+
+    entry = db_session.query(NotificationOutbox).one()
+    assert (entry.type, entry.recipient_user_id, entry.actor_user_id, entry.pair_id) == (
+        "mood_update", partner.id, actor.id, pair.id
+    )
+    assert entry.text == "Аня отметил настроение дня: 😌"
+    assert entry.priority == 200
@@ -0,0 +1,115 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.orm import sessionmaker
+
+from app.gpt.services.data_loader import GPTDataLoader
+from app.gpt.services.gpt_service import GPTService
+from app.models import User, Pair, Mood, Question, UserAnswer, GPTTask, TaskType, PairContextSnapshot
+from app.services import pair_snapshot
+
+
+def seed_pair(db_session):
+    anna = User(telegram_id=1, first_name="Анна", last_name="К")
+    oleg = User(telegram_id=2, first_name="Олег")
+    db_session.add_all([anna, oleg])
+    db_session.flush()
+    pair = Pair(user1_id=anna.id, user2_id=oleg.id)
+    db_session.add(pair)
+    now = datetime.now(timezone.utc)
+    db_session.add_all([
+        Mood(user_id=anna.id, date=now - timedelta(days=1), mood_code="calm"),
+        Mood(user_id=anna.id, date=now - timedelta(days=60), mood_code="sad"),
+        Mood(user_id=oleg.id, date=now - timedelta(days=1), mood_code="joyful"),
+        Mood(user_id=oleg.id, date=now, mood_code="joyful", note="отпуск"),
+    ])
+    for number in range(1, 4):
+        question = Question(number=number, text=f"Вопрос {number}", category="general")
+        db_session.add(question)
+        db_session.flush()
+        db_session.add(UserAnswer(user_id=anna.id, question_id=question.id, answer_text=f"ответ {number}"))
+    db_session.commit()
+    return pair
+
+
+class FakeAnthropic:
+    def __init__(self):
+        self.prompts = []
+
+    async def complete(self, prompt, system_prompt=None, use_cache=True):
+        self.prompts.append(prompt)
+        return "анализ", False
+
+
+def test_relationship_context_from_snapshot(db_engine, db_session, query_log):
+    pair_id = seed_pair(db_session).id
+    loader = GPTDataLoader(session_factory=sessionmaker(bind=db_engine))
+
+    # Первое обращение строит снимок по исходным данным
+    first = asyncio.run(loader.relationship_context(pair_id))
+    assert db_session.get(PairContextSnapshot, pair_id) is not None
+
+    query_log.clear()
+    context = asyncio.run(loader.relationship_context(pair_id))
+
+    assert len(query_log) == 1
+    assert context == first
+    assert context.user1.full_name == "Анна К"
+    assert context.user2.full_name == "Олег"
+    # Настроения за GPT_CONTEXT_DAYS, счётчики ответов из pair_question_stats
+    assert list(context.user1.moods.values()) == ["calm"]
+    assert context.user2.mood_counts == {"joyful": 2}
+    assert (context.user1.answered, context.user2.answered, context.both_answered) == (3, 0, 0)
+    assert context.mood_streak == 1
+    assert context.tune_agreement is None
+
+
+def test_snapshot_built_concurrently(db_engine, db_session, monkeypatch):
+    pair_id = seed_pair(db_session).id
+    rebuild = pair_snapshot.rebuild_pair_snapshots
+
+    def racing_rebuild(db, pair_ids):
+        # Параллельный запрос успел построить снимок между нашей проверкой и вставкой
+        other = sessionmaker(bind=db_engine)()
+        rebuild(other, pair_ids)
+        other.commit()
+        other.close()
+        db.add(PairContextSnapshot(pair_id=pair_id, mood_days={}))
+        db.flush()
+
+    monkeypatch.setattr(pair_snapshot, "rebuild_pair_snapshots", racing_rebuild)
+    loader = GPTDataLoader(session_factory=sessionmaker(bind=db_engine))
+
+    context = asyncio.run(loader.relationship_context(pair_id))
+    assert list(context.user1.moods.values()) == ["calm"]
+    assert context.user1.answered == 3
+
+
+def test_relationship_analysis_uses_loader(db_engine, db_session):
+    pair = seed_pair(db_session)
+    task = GPTTask(task_type=TaskType.RELATIONSHIP_ANALYSIS, input_data={}, pair_id=pair.id,
+                   anthropic_calls=0, internal_api_calls=0)
+    service = GPTService(data_loader=GPTDataLoader(session_factory=sessionmaker(bind=db_engine)))
+    service.anthropic = FakeAnthropic()
+
+    assert asyncio.run(service.run_task(task, db_session)) == "анализ"
+    prompt = service.anthropic.prompts[0]
+    assert "Анна К" in prompt and "Олег" in prompt
+    yesterday = (datetime.now(timezone.utc) - timedelta(days=1)).date().isoformat()
+    assert f"{yesterday}: calm / joyful" in prompt
+    assert "пользователь 1 — 3" in prompt
+    # Данные читаются из БД напрямую — обращений к внутреннему API нет
+    assert task.internal_api_calls == 0
+
+
+def test_mood_analysis_reads_users_slot(db_engine, db_session, query_log):
+    pair = seed_pair(db_session)
+    loader = GPTDataLoader(session_factory=sessionmaker(bind=db_engine))
+    asyncio.run(loader.relationship_context(pair.id))
+    oleg_id = pair.user2_id
+
+    query_log.clear()
+    user = asyncio.run(loader.user_context(oleg_id))
+
+    assert len(query_log) == 1
+    assert user.mood_counts == {"joyful": 2}
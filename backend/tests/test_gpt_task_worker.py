@@ -0,0 +1,144 @@
+import asyncio
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import httpx
+from sqlalchemy.orm import sessionmaker
+
+from app.gpt.services.gpt_service import GPTService
+from app.gpt.services.task_worker import GPTTaskWorker
+from app.models import GPTTask, TaskStatus, TaskType
+
+
+class FakeService:
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.active = 0
+        self.max_active = 0
+        self.calls = []
+
+    async def run_task(self, task, db):
+        self.calls.append(task.id)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(0.01)
+            error = self.errors.get(task.id)
+            if error is not None:
+                raise error
+            return f"result {task.id}"
+        finally:
+            self.active -= 1
+
+
+def overloaded():
+    request = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+    return httpx.HTTPStatusError("overloaded", request=request, response=httpx.Response(529, request=request))
+
+
+def make_tasks(db_session, count, **fields):
+    tasks = [GPTTask(task_type=TaskType.CUSTOM_ANALYSIS, input_data={}, **fields) for _ in range(count)]
+    db_session.add_all(tasks)
+    db_session.commit()
+    return [task.id for task in tasks]
+
+
+def test_worker_respects_concurrency(db_engine, db_session):
+    ids = make_tasks(db_session, 5)
+    service = FakeService()
+    worker = GPTTaskWorker(session_factory=sessionmaker(bind=db_engine), service=service, concurrency=2)
+
+    async def run():
+        await worker.start()
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if len(service.calls) == 5 and not worker._running:
+                break
+        await worker.stop()
+
+    async def inline(func, *args):
+        return func(*args)
+
+    # У тестовой SQLite одно соединение на все сессии — захват выполняем в цикле событий, а не в потоке
+    with patch("app.gpt.services.task_worker.asyncio.to_thread", inline):
+        asyncio.run(run())
+
+    assert sorted(service.calls) == ids
+    assert service.max_active == 2
+    tasks = db_session.query(GPTTask).order_by(GPTTask.id).all()
+    assert [(t.status, t.result, t.attempts) for t in tasks] == [
+        (TaskStatus.COMPLETED, f"result {task_id}", 1) for task_id in ids
+    ]
+
+
+def test_transient_errors_retry_with_backoff(db_engine, db_session):
+    transient, permanent = make_tasks(db_session, 2, max_attempts=2)
+    service = FakeService(errors={transient: overloaded(), permanent: ValueError("Pair ID required")})
+    worker = GPTTaskWorker(session_factory=sessionmaker(bind=db_engine), service=service, retry_base=60)
+
+    assert asyncio.run(worker.process_batch()) == 2
+    first = db_session.get(GPTTask, transient)
+    assert first.status == TaskStatus.PENDING
+    assert first.available_at > datetime.utcnow() + timedelta(seconds=30)
+    assert db_session.get(GPTTask, permanent).status == TaskStatus.FAILED
+    # Повтор отложен — сразу задача не берётся
+    assert asyncio.run(worker.process_batch()) == 0
+
+    first.available_at = datetime.utcnow() - timedelta(seconds=1)
+    db_session.commit()
+    assert asyncio.run(worker.process_batch()) == 1
+    db_session.refresh(first)
+    assert first.status == TaskStatus.FAILED
+    assert first.attempts == 2
+    assert first.error_message == "overloaded"
+
+
+def test_stuck_processing_task_is_reclaimed(db_engine, db_session):
+    stale = datetime.utcnow() - timedelta(hours=1)
+    stuck, exhausted = make_tasks(db_session, 2, status=TaskStatus.PROCESSING, locked_at=stale, attempts=1)
+    db_session.get(GPTTask, exhausted).max_attempts = 1
+    make_tasks(db_session, 1, status=TaskStatus.PROCESSING, locked_at=datetime.utcnow(), attempts=1)
+    service = FakeService()
+    worker = GPTTaskWorker(session_factory=sessionmaker(bind=db_engine), service=service, lease_seconds=60)
+
+    assert asyncio.run(worker.process_batch()) == 1
+    assert service.calls == [stuck]
+    statuses = [(t.status, t.attempts) for t in db_session.query(GPTTask).order_by(GPTTask.id)]
+    assert statuses == [
+        (TaskStatus.COMPLETED, 2),
+        (TaskStatus.FAILED, 1),
+        (TaskStatus.PROCESSING, 1),
+    ]
+
+
+class InlineAnthropic:
+    async def complete(self, prompt, system_prompt=None, use_cache=True):
+        return "inline", False
+
+    async def cached(self, prompt, system_prompt=None):
+        return None
+
+    async def stream(self, prompt, system_prompt=None, use_cache=True):
+        yield "inline"
+
+
+def test_inline_task_is_not_taken_by_worker(db_engine, db_session):
+    factory = sessionmaker(bind=db_engine)
+    gpt = GPTService()
+    gpt.anthropic = InlineAnthropic()
+    worker = GPTTaskWorker(session_factory=factory, service=FakeService())
+
+    async def collect(task_id):
+        return [chunk async for chunk in gpt.stream_task(task_id, claimed=True)]
+
+    with patch("app.gpt.services.gpt_service.SessionLocal", factory):
+        sync_task = asyncio.run(gpt.create_task(TaskType.CUSTOM_ANALYSIS, {"x": 1}, claimed=True))
+        stream_task = asyncio.run(gpt.create_task(TaskType.CUSTOM_ANALYSIS, {"x": 2}, claimed=True))
+        # Воркер опрашивает очередь между созданием и обработкой
+        assert worker._claim(10) == []
+        response = asyncio.run(gpt.process_task(sync_task.id, claimed=True))
+        assert asyncio.run(collect(stream_task.id)) == ["inline"]
+
+    assert response.success and response.result == "inline"
+    tasks = db_session.query(GPTTask).order_by(GPTTask.id).all()
+    assert [(t.status, t.attempts) for t in tasks] == [(TaskStatus.COMPLETED, 1)] * 2
@@ -0,0 +1,38 @@
+import fnmatch
+
+from starlette.middleware.cors import CORSMiddleware
+
+from app.core.config import settings
+from app.middleware.trusted_host import AllowListCORSMiddleware, HostMatcher
+
+
+def legacy_is_host_allowed(host, allowed_hosts):
+    for allowed_host in allowed_hosts:
+        clean_allowed = allowed_host.replace("https://", "").replace("http://", "")
+        if fnmatch.fnmatch(host, clean_allowed) or host == clean_allowed:
+            return True
+    return False
+
+
+def test_matcher_agrees_with_fnmatch_loop():
+    matcher = HostMatcher(settings.ALLOWED_HOSTS)
+    hosts = [
+        "gallery.homoludens.photos", "t.me", "web.telegram.org", "localhost", "127.0.0.1",
+        "192.168.2.15", "192.168.3.15", "172.16.0.1", "172.19.0.1", "10.1.2.3",
+        "localhost:8000", "evil.example", "gallery.homoludens.photos.evil.example", "",
+    ]
+
+    for host in hosts:
+        assert matcher.matches(host) == legacy_is_host_allowed(host, settings.ALLOWED_HOSTS), host
+
+
+def test_cors_origins_match_exactly():
+    origins = settings.ALLOWED_HOSTS + ["https://*.example"]
+    middleware = AllowListCORSMiddleware(app=None, allow_origins=origins)
+    standard = CORSMiddleware(app=None, allow_origins=origins)
+
+    assert middleware.is_allowed_origin("https://t.me")
+    # Wildcards действуют только для Host — как и стандартный CORSMiddleware, не разрешаем
+    for origin in ("http://t.me", "http://192.168.2.15", "https://evil.example", "https://*.example.evil"):
+        assert not middleware.is_allowed_origin(origin), origin
+        assert not standard.is_allowed_origin(origin), origin
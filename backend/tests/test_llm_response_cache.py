@@ -0,0 +1,103 @@
+import asyncio
+import json
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from app.gpt.services.gpt_service import AnthropicService, GPTService
+from app.gpt.services.response_cache import ResponseCache
+from app.models import GPTTask, LLMResponseCache, TaskType
+
+
+class StubAnthropic(BaseHTTPRequestHandler):
+    """Локальная заглушка /v1/messages: отвечает номером запроса"""
+    requests = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.requests.append(body)
+        payload = json.dumps({"content": [{"type": "text", "text": f"answer {len(self.requests)}"}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    StubAnthropic.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAnthropic)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+    server.server_close()
+
+
+def make_service(db_engine, base_url, **cache_options):
+    cache = ResponseCache(session_factory=sessionmaker(bind=db_engine), **cache_options)
+    service = AnthropicService(cache=cache)
+    service.api_key = "test-key"
+    service.base_url = base_url
+    return service
+
+
+def test_cache_hits_on_same_normalized_prompt(db_engine, db_session, stub_server):
+    service = make_service(db_engine, stub_server)
+
+    async def run():
+        first = await service.complete("Проанализируй:\n    данные пары", "Ты эксперт")
+        again = await service.complete("  Проанализируй:\n        данные пары  ", "Ты эксперт")
+        other_system = await service.complete("Проанализируй:\n    данные пары", "Ты психолог")
+        return first, again, other_system
+
+    first, again, other_system = asyncio.run(run())
+
+    assert first == ("answer 1", False)
+    assert again == ("answer 1", True)
+    assert other_system == ("answer 2", False)
+    assert len(StubAnthropic.requests) == 2
+    assert service.cache.stats() == {"hits": 1, "misses": 2}
+    assert sorted(row.hits for row in db_session.query(LLMResponseCache)) == [0, 1]
+
+
+def test_cache_expires_and_evicts_least_recently_used(db_engine, db_session, stub_server):
+    service = make_service(db_engine, stub_server, max_entries=2)
+
+    asyncio.run(service.analyze_text("a"))
+    row = db_session.query(LLMResponseCache).one()
+    row.expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db_session.commit()
+    # Просроченный ответ не используется
+    assert asyncio.run(service.analyze_text("a")) == "answer 2"
+
+    asyncio.run(service.analyze_text("b"))
+    asyncio.run(service.analyze_text("a"))  # "a" использован последним
+    asyncio.run(service.analyze_text("c"))
+    db_session.expire_all()
+    assert db_session.query(LLMResponseCache).count() == 2
+    assert asyncio.run(service.analyze_text("a")) == "answer 2"
+    assert asyncio.run(service.analyze_text("b")) == "answer 5"
+
+
+def test_task_types_can_opt_out(db_engine, stub_server):
+    gpt = GPTService()
+    gpt.anthropic = make_service(db_engine, stub_server)
+
+    def run(task_type):
+        task = GPTTask(task_type=task_type, input_data={"count": 10}, anthropic_calls=0)
+        asyncio.run(gpt.run_task(task, None))
+        asyncio.run(gpt.run_task(task, None))
+        return task.anthropic_calls
+
+    # question_generation исключён по умолчанию (GPT_CACHE_DISABLED_TASK_TYPES)
+    assert run(TaskType.QUESTION_GENERATION) == 2
+    assert run(TaskType.FEEDBACK_ANALYSIS) == 1
+    assert len(StubAnthropic.requests) == 3
@@ -0,0 +1,51 @@
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.middleware.stack import setup_middlewares
+
+
+def make_client(disabled=()):
+    app = FastAPI()
+
+    @app.get("/api/v1/whoami")
+    def whoami(request: Request):
+        return {"telegram_id": getattr(request.state, "telegram_id", None)}
+
+    @app.get("/api/v1/internal/ping")
+    def internal_ping():
+        return {"ok": True}
+
+    setup_middlewares(app, disabled=["usage_analytics", *disabled])
+    return TestClient(app, base_url="http://localhost")
+
+
+def test_stack_sets_state_and_security_headers():
+    client = make_client()
+
+    response = client.get(
+        "/api/v1/whoami",
+        headers={"X-Telegram-Init-Data": "user=%7B%22id%22%3A%2042%7D&hash=x"},
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {"telegram_id": 42}
+    assert response.headers["X-Frame-Options"] == "DENY"
+
+
+def test_rejections_are_proper_http_errors():
+    client = make_client()
+
+    assert client.get("/api/v1/whoami", headers={"host": "evil.example"}).status_code == 400
+    assert client.get("/api/v1/whoami", headers={"X-Telegram-Init-Data": "<script>"}).status_code == 400
+    forbidden = client.get("/api/v1/internal/ping", headers={"X-Forwarded-For": "8.8.8.8"})
+    assert forbidden.status_code == 403
+    assert forbidden.json() == {"detail": "Доступ к внутреннему API запрещен"}
+
+
+def test_disabled_layers_are_skipped():
+    client = make_client(disabled=["trusted_host", "security_headers"])
+
+    response = client.get("/api/v1/whoami", headers={"host": "evil.example"})
+
+    assert response.status_code == 200
+    assert "X-Frame-Options" not in response.headers
@@ -0,0 +1,141 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.orm import sessionmaker
+
+from app.models import User, Pair, UsageEvent, Notification
+from app.notifications.targets import active_pair_users
+from app.services.notifications import NotificationRequest, NotificationService
+
+
+def test_active_pair_users_skips_recently_active(db_session, query_log):
+    users = [User(telegram_id=100 + i, first_name=f"U{i}") for i in range(5)]
+    db_session.add_all(users)
+    db_session.flush()
+    db_session.add_all([
+        Pair(user1_id=users[0].id, user2_id=users[1].id),
+        Pair(user1_id=users[2].id, user2_id=users[3].id),
+    ])
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    db_session.add_all([
+        UsageEvent(ts=now - timedelta(hours=1), method="GET", route="/", status=200, duration_ms=1, telegram_id=101),
+        UsageEvent(ts=now - timedelta(hours=6), method="GET", route="/", status=200, duration_ms=1, telegram_id=102),
+    ])
+    db_session.commit()
+    query_log.clear()
+
+    eligible = active_pair_users(db_session, inactive_for=timedelta(hours=4))
+
+    assert [u.telegram_id for u in eligible] == [100, 102, 103]
+    assert len(query_log) == 1
+
+
+class FakeTelegram:
+    def __init__(self, fail_for=()):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.sent = []
+        self.fail_for = set(fail_for)
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        if chat_id in self.fail_for:
+            raise RuntimeError("telegram is down")
+        self.sent.append(chat_id)
+
+
+def make_users(db_session, count):
+    users = [User(telegram_id=100 + i, first_name=f"U{i}") for i in range(count)]
+    db_session.add_all(users)
+    db_session.commit()
+    for user in users:
+        db_session.refresh(user)
+    return users
+
+
+def test_send_many_is_concurrent_bounded_and_deduplicated(db_engine, db_session, query_log):
+    users = make_users(db_session, 6)
+    telegram = FakeTelegram(fail_for={103})
+    service = NotificationService(telegram=telegram, session_factory=sessionmaker(bind=db_engine))
+    requests = [
+        NotificationRequest(n_type="evening_reminder", recipient=u, text="hi", date_bucket="2025-01-01")
+        for u in users
+    ]
+
+    query_log.clear()
+    results = asyncio.run(service.send_many(requests, concurrency=2))
+
+    assert [r.sent for r in results] == [True, True, True, False, True, True]
+    assert telegram.max_in_flight == 2
+    # Кулдауны, занятие ключей, освобождение ключа после ошибки — без запросов на каждого получателя
+    assert len(query_log) <= 4
+
+    # Повторный запуск: уже отправленные отсекает кулдаун, упавшая отправка повторяется
+    telegram.sent.clear()
+    telegram.fail_for.clear()
+    results = asyncio.run(service.send_many(requests))
+    assert [r.reason for r in results] == ["cooldown"] * 3 + [None] + ["cooldown"] * 2
+    assert telegram.sent == [103]
+
+
+def test_dedupe_key_is_enforced_by_unique_index(db_engine, db_session):
+    users = make_users(db_session, 1)
+    # Запись того же ключа, которую кулдаун уже не видит (например, от другого процесса с другими часами)
+    db_session.add(Notification(
+        type="evening_reminder", recipient_user_id=users[0].id,
+        dedupe_key=f"evening_reminder:{users[0].id}:2025-01-01",
+        sent_at=datetime(2000, 1, 1),
+    ))
+    db_session.commit()
+    telegram = FakeTelegram()
+    service = NotificationService(telegram=telegram, session_factory=sessionmaker(bind=db_engine))
+    request = NotificationRequest(
+        n_type="evening_reminder", recipient=users[0], text="hi",
+        date_bucket="2025-01-01", cooldown=timedelta(hours=24),
+    )
+
+    results = asyncio.run(service.send_many([request, request]))
+
+    assert [r.reason for r in results] == ["duplicate", "duplicate"]
+    assert telegram.sent == []
+
+
+def test_send_many_applies_cooldown_per_entity(db_engine, db_session):
+    users = make_users(db_session, 2)
+    db_session.add(Notification(type="question_reminder", recipient_user_id=users[0].id, entity_type="question", entity_id=1))
+    db_session.commit()
+    telegram = FakeTelegram()
+    service = NotificationService(telegram=telegram, session_factory=sessionmaker(bind=db_engine))
+
+    results = asyncio.run(service.send_many([
+        NotificationRequest(n_type="question_reminder", recipient=users[0], text="q1", entity_type="question", entity_id=1),
+        NotificationRequest(n_type="question_reminder", recipient=users[0], text="q2", entity_type="question", entity_id=2),
+        NotificationRequest(n_type="question_reminder", recipient=users[1], text="q1", entity_type="question", entity_id=1),
+    ]))
+
+    assert [r.reason for r in results] == ["cooldown", None, None]
+    assert db_session.query(Notification).count() == 3
+
+
+def test_cooldown_lookup_is_bounded_by_longest_cooldown(db_engine, db_session, query_log):
+    users = make_users(db_session, 2)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    db_session.add_all([
+        Notification(type="mood_reminder", recipient_user_id=users[0].id, sent_at=now - timedelta(days=3)),
+        Notification(type="mood_reminder", recipient_user_id=users[1].id, sent_at=now - timedelta(hours=1)),
+    ])
+    db_session.commit()
+    service = NotificationService(telegram=FakeTelegram(), session_factory=sessionmaker(bind=db_engine))
+    query_log.clear()
+
+    results = asyncio.run(service.send_many([
+        NotificationRequest(n_type="mood_reminder", recipient=user, text="...", cooldown=timedelta(days=1))
+        for user in users
+    ]))
+
+    assert [r.reason for r in results] == [None, "cooldown"]
+    lookups = [s for s in query_log if "GROUP BY" in s]
+    assert len(lookups) == 1 and "sent_at >=" in lookups[0]
@@ -0,0 +1,56 @@
+import pytest
+
+from app.models import User
+from app.services import pair_context
+from app.services.pair_context import load_pair_context, invalidate_pair_context
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    pair_context._pair_cache.clear()
+    yield
+    pair_context._pair_cache.clear()
+
+
+def test_pair_and_partner_in_single_query(db_session, pair_users, query_log):
+    alice, bob, pair = pair_users
+    query_log.clear()
+
+    ctx = load_pair_context(db_session, bob)
+
+    assert len(query_log) == 1
+    assert ctx.pair.id == pair.id
+    assert ctx.partner_id == alice.id
+    assert ctx.partner.first_name == "Alice"
+    assert ctx.active_pair is ctx.pair
+
+
+def test_cached_context_needs_no_queries(db_session, pair_users, query_log):
+    alice, bob, pair = pair_users
+    load_pair_context(db_session, alice)
+    db_session.expunge_all()
+    query_log.clear()
+
+    ctx = load_pair_context(db_session, alice)
+
+    assert query_log == []
+    assert ctx.partner.first_name == "Bob"
+    assert ctx.pair.id == pair.id
+
+
+def test_user_without_pair_is_not_cached(db_session):
+    loner = User(telegram_id=3, first_name="Solo")
+    db_session.add(loner)
+    db_session.commit()
+
+    assert load_pair_context(db_session, loner).pair is None
+    assert len(pair_context._pair_cache) == 0
+
+
+def test_invalidation_by_partner_id(db_session, pair_users):
+    alice, bob, _ = pair_users
+    load_pair_context(db_session, alice)
+
+    invalidate_pair_context(bob.id)
+
+    assert len(pair_context._pair_cache) == 0
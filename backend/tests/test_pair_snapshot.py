@@ -0,0 +1,99 @@
+import asyncio
+from datetime import date, datetime, timedelta
+
+from app.api.api_v1.endpoints.mood import create_mood
+from app.api.api_v1.endpoints.tune import submit_tune_answer
+from app.models import Mood, PairContextSnapshot
+from app.models.tune import PairDailyTuneQuestion, TuneQuizQuestion
+from app.schemas.mood import MoodCreate
+from app.schemas.tune import TuneAnswerCreate
+from app.services.pair_snapshot import current_streak, rebuild_pair_snapshots, record_mood
+
+
+def snapshot_fields(db_session, pair_id):
+    db_session.expire_all()
+    snapshot = db_session.get(PairContextSnapshot, pair_id)
+    return {
+        "mood_days": snapshot.mood_days,
+        "mood_streak": snapshot.mood_streak,
+        "mood_streak_best": snapshot.mood_streak_best,
+        "last_both_mood_date": snapshot.last_both_mood_date,
+        "tune_compared": snapshot.tune_compared,
+        "tune_matched": snapshot.tune_matched,
+    }
+
+
+def log_mood(db_session, pair, user, days_ago, code):
+    mood = Mood(user_id=user.id, date=datetime.utcnow() - timedelta(days=days_ago), mood_code=code)
+    db_session.add(mood)
+    db_session.flush()
+    record_mood(db_session, pair, user.id, mood.date.date(), code)
+    db_session.commit()
+
+
+def test_mood_endpoint_updates_snapshot(db_session, pair_users, pair_ctx):
+    alice, bob, pair = pair_users
+    asyncio.run(create_mood(MoodCreate(mood_code="calm"), db=db_session, ctx=pair_ctx(alice)))
+    asyncio.run(create_mood(MoodCreate(mood_code="tired"), db=db_session, ctx=pair_ctx(bob)))
+    # Повторная отметка за день меняет настроение, но не серию
+    asyncio.run(create_mood(MoodCreate(mood_code="joyful"), db=db_session, ctx=pair_ctx(alice)))
+
+    today = datetime.utcnow().date()
+    fields = snapshot_fields(db_session, pair.id)
+    assert fields["mood_days"] == {today.isoformat(): {"user1": "joyful", "user2": "tired"}}
+    assert (fields["mood_streak"], fields["last_both_mood_date"]) == (1, today)
+
+
+def test_incremental_updates_match_rebuild(db_session, pair_users):
+    alice, bob, pair = pair_users
+    log_mood(db_session, pair, alice, 60, "sad")  # За пределами окна GPT_CONTEXT_DAYS
+    for days_ago in (6, 5, 4, 1, 0):
+        log_mood(db_session, pair, alice, days_ago, "calm")
+        log_mood(db_session, pair, bob, days_ago, "joyful")
+    log_mood(db_session, pair, alice, 3, "anxious")
+
+    incremental = snapshot_fields(db_session, pair.id)
+    assert len(incremental["mood_days"]) == 6
+    assert (incremental["mood_streak"], incremental["mood_streak_best"]) == (2, 3)
+
+    rebuild_pair_snapshots(db_session, [pair.id])
+    db_session.commit()
+    assert snapshot_fields(db_session, pair.id) == incremental
+
+
+def test_streak_resets_when_a_day_is_missed(db_session, pair_users):
+    alice, bob, pair = pair_users
+    for days_ago in (3, 2):
+        log_mood(db_session, pair, alice, days_ago, "calm")
+        log_mood(db_session, pair, bob, days_ago, "calm")
+
+    snapshot = db_session.get(PairContextSnapshot, pair.id)
+    assert snapshot.mood_streak == 2
+    # Вчера оба не отметились — на сегодня серия прервана
+    assert current_streak(snapshot) == 0
+    assert current_streak(snapshot, today=date.today() - timedelta(days=1)) == 2
+
+
+def test_tune_agreement_counts_guesses(db_session, pair_users, pair_ctx):
+    alice, bob, pair = pair_users
+    question = TuneQuizQuestion(number=1, text="?", category="general", option1="a", option2="b", option3="c")
+    db_session.add(question)
+    db_session.flush()
+    db_session.add(PairDailyTuneQuestion(pair_id=pair.id, question_id=question.id, date=date.today()))
+    db_session.commit()
+
+    def answer(user, about, option):
+        payload = TuneAnswerCreate(question_id=question.id, about=about, selected_option=option)
+        submit_tune_answer(payload, db=db_session, ctx=pair_ctx(user))
+
+    answer(alice, "me", 1)
+    answer(bob, "partner", 1)  # Угадал
+    answer(alice, "partner", 2)
+    answer(bob, "me", 0)  # Не угадала
+
+    fields = snapshot_fields(db_session, pair.id)
+    assert (fields["tune_compared"], fields["tune_matched"]) == (2, 1)
+
+    rebuild_pair_snapshots(db_session, [pair.id])
+    db_session.commit()
+    assert snapshot_fields(db_session, pair.id) == fields
@@ -0,0 +1,76 @@
+import asyncio
+from datetime import date
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from app.api.api_v1.endpoints.questions import get_questions_stats, submit_answer
+from app.models import Question, UserAnswer, PairDailyQuestion, PairQuestionStats
+from app.schemas.question import UserAnswerCreate
+from app.services import question_stats
+from app.services.question_stats import get_pair_question_stats, rebuild_pair_question_stats
+
+
+@pytest.fixture(autouse=True)
+def questions(db_session):
+    db_session.add_all([Question(number=n, text=f"Вопрос {n}", category="general") for n in range(1, 5)])
+    db_session.commit()
+
+
+def answer_today(db_session, ctx, number):
+    question = db_session.query(Question).filter(Question.number == number).one()
+    if not db_session.query(PairDailyQuestion).filter(PairDailyQuestion.date == date.today()).first():
+        db_session.add(PairDailyQuestion(pair_id=ctx.pair.id, question_id=question.id, date=date.today()))
+        db_session.commit()
+    payload = UserAnswerCreate(question_id=question.id, answer_text="...")
+    asyncio.run(submit_answer(answer_data=payload, db=db_session, ctx=ctx))
+
+
+def test_counters_follow_answers(db_session, pair_users, pair_ctx):
+    alice, bob, pair = pair_users
+    answer_today(db_session, pair_ctx(alice), 1)
+    answer_today(db_session, pair_ctx(bob), 1)
+
+    stats = asyncio.run(get_questions_stats(db=db_session, ctx=pair_ctx(bob)))
+
+    assert stats == {
+        "total_questions": 4,
+        "user_answered": 1,
+        "partner_answered": 1,
+        "both_answered": 1,
+        "completion_percentage": 25.0,
+    }
+
+
+def test_rebuild_matches_raw_aggregation(db_session, pair_users):
+    alice, bob, pair = pair_users
+    questions = db_session.query(Question).order_by(Question.number).all()
+    for q in questions[:3]:
+        db_session.add(UserAnswer(user_id=alice.id, question_id=q.id, answer_text="..."))
+    for q in questions[1:]:
+        db_session.add(UserAnswer(user_id=bob.id, question_id=q.id, answer_text="..."))
+    db_session.commit()
+
+    rebuild_pair_question_stats(db_session)
+    db_session.commit()
+
+    stats = db_session.get(PairQuestionStats, pair.id)
+    assert (stats.user1_answered, stats.user2_answered, stats.both_answered) == (3, 3, 2)
+
+
+def test_missing_row_built_concurrently(db_engine, db_session, pair_users, monkeypatch):
+    alice, bob, pair = pair_users
+
+    def racing_rebuild(db, pair_ids):
+        # Параллельный запрос успел вставить строку между нашей проверкой и вставкой
+        other = sessionmaker(bind=db_engine)()
+        other.add(PairQuestionStats(pair_id=pair.id, user1_answered=2, user2_answered=1, both_answered=1))
+        other.commit()
+        other.close()
+        db.add(PairQuestionStats(pair_id=pair.id, user1_answered=0, user2_answered=0, both_answered=0))
+        db.flush()
+
+    monkeypatch.setattr(question_stats, "rebuild_pair_question_stats", racing_rebuild)
+
+    stats = get_pair_question_stats(db_session, pair, bob.id)
+    assert stats == {"total_questions": 4, "user_answered": 1, "partner_answered": 2, "both_answered": 1}
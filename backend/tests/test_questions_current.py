@@ -0,0 +1,47 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+from app.api.api_v1.endpoints.questions import get_current_question
+from app.models import Question, UserAnswer, PairDailyQuestion
+
+
+@pytest.fixture
+def ctx(db_session, pair_users, pair_ctx):
+    db_session.add_all([
+        Question(number=n, text=f"Вопрос {n}", category="general") for n in range(1, 6)
+    ])
+    db_session.commit()
+    return pair_ctx(pair_users[0])
+
+
+def test_assigns_question_not_answered_by_either_partner(db_session, ctx):
+    answered = db_session.query(Question).filter(Question.number.in_([1, 2, 3, 4])).all()
+    for i, question in enumerate(answered):
+        author = ctx.user.id if i % 2 else ctx.partner_id
+        db_session.add(UserAnswer(user_id=author, question_id=question.id, answer_text="..."))
+    db_session.commit()
+
+    result = asyncio.run(get_current_question(db=db_session, ctx=ctx))
+
+    assert result.number == 5
+    assigned = db_session.query(PairDailyQuestion).one()
+    assert assigned.date == date.today()
+
+
+def test_existing_assignment_is_one_query(db_session, ctx, query_log):
+    question = db_session.query(Question).filter(Question.number == 3).one()
+    db_session.add(PairDailyQuestion(pair_id=ctx.pair.id, question_id=question.id, date=date.today()))
+    db_session.add(UserAnswer(user_id=ctx.partner_id, question_id=question.id, answer_text="..."))
+    db_session.commit()
+    for obj in (ctx.user, ctx.partner, ctx.pair):
+        db_session.refresh(obj)
+    query_log.clear()
+
+    result = asyncio.run(get_current_question(db=db_session, ctx=ctx))
+
+    assert len(query_log) == 1
+    assert result.number == 3
+    assert result.partner_answered is True
+    assert result.user_answered is False
@@ -0,0 +1,58 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import Response
+
+from app.api.api_v1.endpoints.questions import get_questions_history
+from app.models import Question, UserAnswer
+
+
+@pytest.fixture
+def ctx(db_session, pair_users, pair_ctx):
+    alice, bob, pair = pair_users
+    base = datetime(2025, 1, 1, 12, 0)
+    for n in range(1, 8):
+        question = Question(number=n, text=f"Вопрос {n}", category="general")
+        db_session.add(question)
+        db_session.flush()
+        db_session.add(UserAnswer(
+            user_id=alice.id, question_id=question.id, answer_text="...",
+            created_at=base + timedelta(days=n)
+        ))
+        if n % 2 == 0:
+            db_session.add(UserAnswer(user_id=bob.id, question_id=question.id, answer_text="..."))
+    db_session.commit()
+    for obj in (alice, bob, pair):
+        db_session.refresh(obj)
+    return pair_ctx(alice)
+
+
+def fetch(db_session, ctx, **params):
+    response = Response()
+    items = asyncio.run(get_questions_history(response=response, db=db_session, ctx=ctx, **params))
+    return items, response.headers.get("X-Next-Cursor")
+
+
+def test_history_page_is_single_query(db_session, ctx, query_log):
+    query_log.clear()
+
+    items, _ = fetch(db_session, ctx, limit=20)
+
+    assert len(query_log) == 1
+    assert [i.question.number for i in items] == [7, 6, 5, 4, 3, 2, 1]
+    assert [i.partner_answered for i in items] == [False, True, False, True, False, True, False]
+
+
+def test_cursor_pagination_matches_offset(db_session, ctx):
+    first, cursor = fetch(db_session, ctx, limit=3)
+    second, cursor = fetch(db_session, ctx, limit=3, cursor=cursor)
+    legacy, _ = fetch(db_session, ctx, limit=3, skip=3)
+
+    assert [i.question.number for i in first] == [7, 6, 5]
+    assert [i.question.number for i in second] == [4, 3, 2]
+    assert [i.question.number for i in legacy] == [4, 3, 2]
+
+    last, cursor = fetch(db_session, ctx, limit=3, cursor=cursor)
+    assert [i.question.number for i in last] == [1]
+    assert cursor is None
@@ -0,0 +1,39 @@
+import pytest
+
+from app.core.rate_limit import DatabaseRateLimitBackend, MemoryRateLimitBackend
+
+
+def backends(tmp_path):
+    return [MemoryRateLimitBackend(), DatabaseRateLimitBackend(f"sqlite:///{tmp_path / 'limits.db'}")]
+
+
+@pytest.mark.parametrize("index", [0, 1])
+def test_burst_then_steady_rate(tmp_path, index):
+    backend = backends(tmp_path)[index]
+    now = 1000.0
+
+    # 3 запроса за 60 секунд: бёрст из трёх, затем по одному раз в 20 секунд
+    assert [backend.acquire("ip:1", 3, 60, now) for _ in range(3)] == [0, 0, 0]
+    assert backend.acquire("ip:1", 3, 60, now) == pytest.approx(20)
+    assert backend.acquire("ip:2", 3, 60, now) == 0
+    assert backend.acquire("ip:1", 3, 60, now + 20) == 0
+    assert backend.acquire("ip:1", 3, 60, now + 20) > 0
+
+
+def test_database_backend_is_shared_between_workers(tmp_path):
+    url = f"sqlite:///{tmp_path / 'limits.db'}"
+    worker1, worker2 = DatabaseRateLimitBackend(url), DatabaseRateLimitBackend(url)
+
+    assert worker1.acquire("tg:42", 2, 60, 1000.0) == 0
+    assert worker2.acquire("tg:42", 2, 60, 1000.0) == 0
+    assert worker1.acquire("tg:42", 2, 60, 1000.0) > 0
+
+
+def test_memory_backend_forgets_idle_keys():
+    backend = MemoryRateLimitBackend()
+    for i in range(100):
+        backend.acquire(f"ip:{i}", 10, 60, 1000.0)
+
+    backend.acquire("ip:new", 10, 60, 1000.0 + 60)
+
+    assert len(backend) == 1
@@ -0,0 +1,70 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.services.telegram import TelegramClient, TelegramError, TelegramService
+
+
+def make_service(handler, **options):
+    client = TelegramClient(transport=httpx.MockTransport(handler), per_chat_interval=0, **options)
+    return TelegramService(bot_token="TOKEN", client=client), client
+
+
+def test_retry_after_is_honoured(monkeypatch):
+    responses = iter([
+        httpx.Response(429, json={"ok": False, "parameters": {"retry_after": 3}}),
+        httpx.Response(200, json={"ok": True}),
+    ])
+    sleeps = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    service, client = make_service(lambda request: next(responses))
+
+    async def scenario():
+        await service.send_message(chat_id=1, text="hi")
+        await client.aclose()
+
+    asyncio.run(scenario())
+    assert 3.0 in sleeps
+
+
+def test_webapp_fallback_only_on_bad_request_and_errors_raise():
+    seen = []
+
+    def handler(request):
+        body = request.read().decode()
+        seen.append(body)
+        return httpx.Response(400, json={"ok": False, "description": "BUTTON_TYPE_INVALID"})
+
+    service, client = make_service(handler)
+    markup = {"inline_keyboard": [[{"text": "Open", "web_app": {"url": "https://example.org"}}]]}
+
+    async def scenario():
+        try:
+            await service.send_message(chat_id=1, text="hi", reply_markup=markup)
+        finally:
+            await client.aclose()
+
+    with pytest.raises(TelegramError):
+        asyncio.run(scenario())
+    assert len(seen) == 2
+    assert '"url": "https://example.org"' in seen[1] or '"url":"https://example.org"' in seen[1]
+
+
+def test_connection_is_reused():
+    service, client = make_service(lambda request: httpx.Response(200, json={"ok": True}))
+
+    async def scenario():
+        await service.send_message(chat_id=1, text="a")
+        first = client._client
+        await service.send_message(chat_id=2, text="b")
+        assert client._client is first
+        await client.aclose()
+
+    asyncio.run(scenario())